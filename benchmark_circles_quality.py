@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for evaluate_circles_quality.
+
+Compares the vectorized scorer in find_circles.py against the original pure-Python loops
+on synthetic answer-card grids with some noise and duplicate detections, checks that both
+return the same score, and prints the speedup.
+
+Usage:
+    python benchmark_circles_quality.py [circle counts...]
+"""
+
+import sys
+import time
+import numpy as np
+
+from find_circles import evaluate_circles_quality
+
+
+def evaluate_circles_quality_reference(circles, expected_count=None, min_radius=None, max_radius=None, img_shape=None):
+    """
+    The original pure-Python scorer, kept here to check and time the vectorized one against.
+    """
+    if circles is None or len(circles[0]) == 0:
+        return 0
+    
+    circles_array = circles[0]
+    num_circles = len(circles_array)
+    
+    # Base score from number of circles
+    if expected_count is not None:
+        count_score = max(0, 1 - abs(num_circles - expected_count) / max(expected_count, 1))
+    else:
+        count_score = min(num_circles / 20, 1)  # Prefer more circles up to 20
+    
+    # Radius consistency score
+    radii = [c[2] for c in circles_array]
+    if len(radii) > 1:
+        radius_std = np.std(radii)
+        radius_mean = np.mean(radii)
+        radius_consistency = max(0, 1 - (radius_std / radius_mean))
+    else:
+        radius_consistency = 1
+    
+    # Overlap penalty score - heavily penalize overlapping circles
+    overlap_score = 1
+    if len(circles_array) > 1:
+        overlap_count = 0
+        total_pairs = 0
+        
+        for i in range(len(circles_array)):
+            for j in range(i + 1, len(circles_array)):
+                total_pairs += 1
+                circle1 = circles_array[i]
+                circle2 = circles_array[j]
+                
+                # Calculate distance between centers
+                distance = np.sqrt((circle1[0] - circle2[0])**2 + (circle1[1] - circle2[1])**2)
+                
+                # Check if circles overlap (distance < sum of radii with some tolerance)
+                min_allowed_distance = (circle1[2] + circle2[2]) * 0.8  # 80% of sum of radii
+                
+                if distance < min_allowed_distance:
+                    overlap_count += 1
+        
+        # Calculate overlap penalty (0 = all overlapping, 1 = no overlapping)
+        if total_pairs > 0:
+            overlap_score = max(0, 1 - (overlap_count / total_pairs))
+    
+    # Boundary penalty score - penalize circles outside image boundaries
+    boundary_score = 1
+    if img_shape is not None:
+        img_height, img_width = img_shape[:2]
+        outside_count = 0
+        
+        for circle in circles_array:
+            center_x, center_y, radius = circle[0], circle[1], circle[2]
+            
+            # Check if circle extends outside image boundaries
+            if (center_x - radius < 0 or  # Left boundary
+                center_y - radius < 0 or  # Top boundary
+                center_x + radius >= img_width or  # Right boundary
+                center_y + radius >= img_height):  # Bottom boundary
+                outside_count += 1
+        
+        # Calculate boundary penalty (0 = all outside, 1 = all inside)
+        if num_circles > 0:
+            boundary_score = max(0, 1 - (outside_count / num_circles))
+    
+    # Grid pattern score - reward proper rows and columns
+    grid_score = 1
+    if len(circles_array) >= 4:  # Need at least 4 circles to form a grid
+        # Group circles into rows (similar Y coordinates)
+        avg_radius = np.mean(radii)
+        row_tolerance = avg_radius * 0.5  # Allow some tolerance for row alignment
+        col_tolerance = avg_radius * 0.5  # Allow some tolerance for column alignment
+        
+        # Sort circles by Y coordinate to group into rows
+        sorted_by_y = sorted(circles_array, key=lambda c: c[1])
+        rows = []
+        
+        for circle in sorted_by_y:
+            placed = False
+            for row in rows:
+                # Check if this circle belongs to an existing row
+                if abs(circle[1] - row[0][1]) <= row_tolerance:
+                    row.append(circle)
+                    placed = True
+                    break
+            if not placed:
+                rows.append([circle])
+        
+        # Group circles into columns (similar X coordinates)
+        sorted_by_x = sorted(circles_array, key=lambda c: c[0])
+        cols = []
+        
+        for circle in sorted_by_x:
+            placed = False
+            for col in cols:
+                # Check if this circle belongs to an existing column
+                if abs(circle[0] - col[0][0]) <= col_tolerance:
+                    col.append(circle)
+                    placed = True
+                    break
+            if not placed:
+                cols.append([circle])
+        
+        # Calculate grid quality
+        grid_quality = 0
+        
+        if len(rows) > 1 and len(cols) > 1:
+            # Check row consistency (similar number of circles per row)
+            row_sizes = [len(row) for row in rows]
+            most_common_row_size = max(set(row_sizes), key=row_sizes.count)
+            consistent_rows = sum(1 for size in row_sizes if abs(size - most_common_row_size) <= 1)
+            row_consistency = consistent_rows / len(rows)
+            
+            # Check column consistency (similar number of circles per column)
+            col_sizes = [len(col) for col in cols]
+            most_common_col_size = max(set(col_sizes), key=col_sizes.count)
+            consistent_cols = sum(1 for size in col_sizes if abs(size - most_common_col_size) <= 1)
+            col_consistency = consistent_cols / len(cols)
+            
+            # Check row spacing consistency
+            row_spacing_score = 1
+            if len(rows) > 2:
+                row_centers = [np.mean([c[1] for c in row]) for row in rows]
+                row_spacings = [row_centers[i+1] - row_centers[i] for i in range(len(row_centers)-1)]
+                if len(row_spacings) > 1:
+                    spacing_std = np.std(row_spacings)
+                    spacing_mean = np.mean(row_spacings)
+                    row_spacing_score = max(0, 1 - (spacing_std / spacing_mean)) if spacing_mean > 0 else 0
+            
+            # Check column spacing consistency
+            col_spacing_score = 1
+            if len(cols) > 2:
+                col_centers = [np.mean([c[0] for c in col]) for col in cols]
+                col_spacings = [col_centers[i+1] - col_centers[i] for i in range(len(col_centers)-1)]
+                if len(col_spacings) > 1:
+                    spacing_std = np.std(col_spacings)
+                    spacing_mean = np.mean(col_spacings)
+                    col_spacing_score = max(0, 1 - (spacing_std / spacing_mean)) if spacing_mean > 0 else 0
+            
+            # Calculate overall grid quality
+            grid_quality = (row_consistency + col_consistency + row_spacing_score + col_spacing_score) / 4
+        
+        grid_score = grid_quality
+    
+    # Spacing consistency score (for grid-like patterns)
+    spacing_score = 1
+    if len(circles_array) > 3:
+        distances = []
+        for i in range(len(circles_array)):
+            for j in range(i + 1, len(circles_array)):
+                dist = np.sqrt((circles_array[i][0] - circles_array[j][0])**2 + 
+                             (circles_array[i][1] - circles_array[j][1])**2)
+                distances.append(dist)
+        
+        if distances:
+            distances = sorted(distances)
+            # Look at the most common distance (assuming grid pattern)
+            min_distances = [d for d in distances if d > np.mean(radii)][:num_circles]
+            if len(min_distances) > 1:
+                spacing_std = np.std(min_distances)
+                spacing_mean = np.mean(min_distances)
+                spacing_score = max(0, 1 - (spacing_std / spacing_mean))
+    
+    # Radius range score (prefer circles within expected range)
+    radius_range_score = 1
+    if min_radius is not None and max_radius is not None:
+        in_range_count = sum(1 for r in radii if min_radius <= r <= max_radius)
+        radius_range_score = in_range_count / num_circles if num_circles > 0 else 0
+    
+    # Combined score with weights - grid pattern has high weight
+    total_score = (
+        count_score * 0.15 +
+        radius_consistency * 0.1 +
+        overlap_score * 0.25 +  # High weight for overlap penalty
+        boundary_score * 0.2 +  # High weight for boundary penalty
+        grid_score * 0.25 +     # High weight for grid pattern reward
+        spacing_score * 0.05 +
+        radius_range_score * 0.0
+    )
+    
+    return total_score
+
+
+def make_circles(count, seed=0):
+    """Build a HoughCircles-style (1, count, 3) float32 array laid out like a dense answer grid."""
+    rng = np.random.default_rng(seed)
+    columns = max(1, int(np.sqrt(count * 2)))
+    rows = int(np.ceil(count / columns))
+
+    index = np.arange(count)
+    xs = 40 + (index % columns) * 32 + rng.normal(0, 1.5, count)
+    ys = 40 + (index // columns) * 48 + rng.normal(0, 1.5, count)
+    radii = 11 + rng.normal(0, 0.8, count)
+
+    # Some duplicate detections and stray circles like loose Hough thresholds produce
+    duplicates = rng.choice(count, size=count // 10, replace=False)
+    xs[duplicates] += rng.normal(0, 4, len(duplicates))
+    strays = rng.choice(count, size=count // 20, replace=False)
+    xs[strays] = rng.uniform(0, columns * 32 + 80, len(strays))
+    ys[strays] = rng.uniform(0, rows * 48 + 80, len(strays))
+
+    circles = np.stack([xs, ys, radii], axis=1).astype(np.float32)
+    img_shape = (rows * 48 + 80, columns * 32 + 80)
+    return circles[np.newaxis, :, :], img_shape
+
+
+def time_call(function, repeats, *args, **kwargs):
+    """Return (best wall time in seconds, result) over repeats calls."""
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    counts = [int(value) for value in sys.argv[1:]] or [50, 500, 2000]
+
+    print(f"{'circles':>8} {'reference':>12} {'vectorized':>12} {'speedup':>9}  scores")
+    for count in counts:
+        circles, img_shape = make_circles(count)
+        kwargs = dict(expected_count=count, min_radius=8, max_radius=14, img_shape=img_shape)
+
+        # The reference scorer takes seconds past a few hundred circles, time it once there
+        reference_time, reference_score = time_call(
+            evaluate_circles_quality_reference, 1 if count >= 500 else 10, circles, **kwargs
+        )
+        vectorized_time, score = time_call(evaluate_circles_quality, 20, circles, **kwargs)
+
+        if score != reference_score:
+            print(f"Score mismatch for {count} circles: {score} != {reference_score}")
+            sys.exit(1)
+
+        print(f"{count:>8} {reference_time * 1000:>10.2f}ms {vectorized_time * 1000:>10.2f}ms "
+              f"{reference_time / vectorized_time:>8.1f}x  {score:.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import math
+import numpy as np
+
+
+class CircleSpatialIndex:
+    """
+    Uniform grid over circle centers for finding nearby pairs without comparing every circle
+    against every other one.
+
+    Centers are bucketed into square cells of cell_size pixels. Pair queries only look at
+    cells close enough to hold a center within the requested reach, so the cost grows with
+    the number of close pairs instead of with N².
+    """
+
+    # Cell coordinates are packed into a single int64 key as cell_x * KEY_STRIDE + cell_y
+    KEY_STRIDE = 1 << 32
+
+    def __init__(self, centers, cell_size):
+        """
+        Args:
+            centers: (N, 2) array of circle centers (x, y)
+            cell_size: Width and height of a grid cell in pixels
+        """
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+
+        cells = np.floor(self.centers / self.cell_size).astype(np.int64)
+        self.cells = cells
+        keys = self._cell_keys(cells[:, 0], cells[:, 1])
+
+        # Circles of the same cell end up next to each other, in their original order
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.centers)
+
+    def _cell_keys(self, cell_x, cell_y):
+        return cell_x * self.KEY_STRIDE + cell_y
+
+    def candidate_pairs(self, reach, mask=None):
+        """
+        Return every pair (i, j) with i < j whose centers may be within reach of each other.
+
+        The result is a superset: callers apply their own exact distance test to the pairs.
+        Pairs are sorted by i, then j.
+
+        Args:
+            reach: Largest center distance the caller is interested in
+            mask: Optional boolean array, only circles where it is True are paired
+
+        Returns:
+            Tuple of (i, j) int64 index arrays
+        """
+        count = len(self.centers)
+        empty = np.empty(0, dtype=np.int64)
+        if count < 2:
+            return empty, empty
+
+        # One extra ring of cells covers any rounding in the cell assignment
+        span = int(math.ceil(max(reach, 0) / self.cell_size)) + 1
+        indices = np.arange(count)
+        pairs_i = []
+        pairs_j = []
+
+        for offset_x in range(-span, span + 1):
+            for offset_y in range(-span, span + 1):
+                target_keys = self._cell_keys(self.cells[:, 0] + offset_x, self.cells[:, 1] + offset_y)
+                starts = np.searchsorted(self.sorted_keys, target_keys, side='left')
+                ends = np.searchsorted(self.sorted_keys, target_keys, side='right')
+                counts = ends - starts
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+
+                # Expand each circle's [start, end) run of the sorted keys into one row per pair
+                first = np.repeat(indices, counts)
+                run_offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                second = self.order[np.repeat(starts, counts) + run_offsets]
+
+                keep = first < second
+                pairs_i.append(first[keep])
+                pairs_j.append(second[keep])
+
+        if len(pairs_i) == 0:
+            return empty, empty
+
+        pairs_i = np.concatenate(pairs_i)
+        pairs_j = np.concatenate(pairs_j)
+
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            keep = mask[pairs_i] & mask[pairs_j]
+            pairs_i = pairs_i[keep]
+            pairs_j = pairs_j[keep]
+
+        order = np.lexsort((pairs_j, pairs_i))
+        return pairs_i[order], pairs_j[order]
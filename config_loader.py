@@ -49,6 +49,10 @@ class ConfigLoader:
         """Get configuration value with optional default."""
         return self.config.get(key, str(default) if default is not None else "")
 
+    def set(self, key: str, value: Any) -> None:
+        """Override a configuration value for the current process."""
+        self.config[key] = str(value)
+
     def get_bool(self, key: str, default: bool = False) -> bool:
         """Get boolean configuration value."""
         value = self.get(key, str(default)).lower()
@@ -104,6 +108,77 @@ class ConfigLoader:
             'check_interval': self.get_int('MEMORY_CHECK_INTERVAL', 2)
         }
 
+    def get_worker_config(self) -> Dict[str, Any]:
+        """Get processing computer job execution configuration."""
+        return {
+            # Threads running jobs off the websocket event loop, 0 means one per CPU core
+            'job_workers': self.get_int('JOB_WORKERS', 2),
+            # Processes the pages of multi-page jobs are spread over, 0 means one per CPU core, 1 runs pages in order
+            'page_workers': self.get_int('PAGE_WORKERS', 0),
+            # Memory the running jobs may reserve together, 0 means what is left below MEMORY_THRESHOLD_PERCENT at startup
+            'job_memory_budget_mb': self.get_int('JOB_MEMORY_BUDGET_MB', 0)
+        }
+
+    def get_transfer_config(self) -> Dict[str, Any]:
+        """Get file transfer configuration between the relay and internal clients."""
+        return {
+            'chunk_size_kb': self.get_int('TRANSFER_CHUNK_SIZE_KB', 200),
+            # Received files larger than this are written to a memory-mapped temporary file, 0 keeps every file in memory
+            'spill_threshold_mb': self.get_int('TRANSFER_SPILL_THRESHOLD_MB', 64),
+            'spill_dir': self.get('TRANSFER_SPILL_DIR', ''),
+            # Uploads idle for this long are dropped, 0 keeps them until the job or the connection ends
+            'ttl_seconds': self.get_int('TRANSFER_TTL_SECONDS', 600),
+            # Total size of the files a worker holds, the least recently active uploads are dropped first
+            'quota_mb': self.get_int('TRANSFER_QUOTA_MB', 2048)
+        }
+
+    def get_content_store_config(self) -> Dict[str, Any]:
+        """Get configuration of the worker's content-addressed file store."""
+        return {
+            'dir': self.get('CONTENT_STORE_DIR', ''),
+            'max_mb': self.get_int('CONTENT_STORE_MB', 1024)
+        }
+
+    def get_image_config(self) -> Dict[str, Any]:
+        """Get encoding configuration of the page images sent back by read to images jobs."""
+        return {
+            'codec': self.get('PAGE_IMAGE_CODEC', 'png'),
+            'png_compression': self.get_int('PAGE_IMAGE_PNG_COMPRESSION', 1),
+            'webp_method': self.get_int('PAGE_IMAGE_WEBP_METHOD', 4),
+            # Memory a worker keeps its full-resolution rendered pages in for find circles, 0 disables it
+            'cache_mb': self.get_int('PAGE_CACHE_MB', 512)
+        }
+
+    def get_routing_config(self) -> Dict[str, Any]:
+        """Get relay configuration for choosing the internal client of a job."""
+        return {
+            # Rendered pages whose worker the relay remembers, 0 picks a random worker for every job
+            'affinity_entries': self.get_int('WORKER_AFFINITY_ENTRIES', 10000),
+            # random, least-outstanding or ewma, see worker_selection
+            'policy': self.get('WORKER_SELECTION_POLICY', 'ewma'),
+            'latency_ewma_alpha': self.get_float('WORKER_LATENCY_EWMA_ALPHA', 0.3),
+            # push sends jobs right away, pull queues them until a worker asks for work
+            'distribution': self.get('JOB_DISTRIBUTION', 'push'),
+            # Least pages per sub-job when a job is split across workers, 0 keeps every job whole
+            'shard_pages': self.get_int('JOB_SHARD_PAGES', 0)
+        }
+
+    def get_detection_config(self) -> Dict[str, Any]:
+        """Get circle detection configuration."""
+        return {
+            # 0 means one worker per CPU core, 1 runs the sweep serially
+            'sweep_workers': self.get_int('HOUGH_SWEEP_WORKERS', 0),
+            'params_cache_file': self.get('HOUGH_PARAMS_CACHE_FILE', 'hough_params_cache.json'),
+            # 0 disables the per-template parameter memo
+            'params_cache_size': self.get_int('HOUGH_PARAMS_CACHE_SIZE', 512),
+            'params_cache_margin': self.get_float('HOUGH_PARAMS_CACHE_MARGIN', 0.05),
+            # Bubble radius in pixels the page is scaled to before detection, 0 keeps the fixed 4000 px width
+            'target_radius': self.get_float('DETECTION_TARGET_RADIUS', 24),
+            # Template registration aligns pages on copies this wide and needs this ECC correlation
+            'registration_width': self.get_int('REGISTRATION_WIDTH', 512),
+            'registration_min_correlation': self.get_float('REGISTRATION_MIN_CORRELATION', 0.8)
+        }
+
     def print_config_summary(self) -> None:
         """Print configuration summary for debugging."""
         print("🔧 Configuration Summary:")
@@ -113,6 +188,8 @@ class ConfigLoader:
         print(f"   HTTP Config: {self.get_http_config()}")
         print(f"   WebSocket URI: {self.get_websocket_uri()}")
         print(f"   Memory Config: {self.get_memory_config()}")
+        print(f"   Worker Config: {self.get_worker_config()}")
+        print(f"   Detection Config: {self.get_detection_config()}")
         print()
 
 
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from config_loader import config
+from utils import Utils
+
+
+def content_hash(data) -> str:
+    """Address of a file in the content store, the SHA-256 of its bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ContentStore:
+    """
+    Bounded on-disk store of files addressed by the hash of their content.
+
+    The worker keeps the pages it produces and the files it receives here, so the relay can
+    skip sending a file the worker already holds. Files are written atomically under their
+    hash and the least recently used ones are deleted once the store grows past max_bytes.
+    Jobs run on several threads, every operation takes the store's lock.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            directory: Directory of the store, defaults to CONTENT_STORE_DIR or a directory in
+                the system temporary directory
+            max_bytes: Size the store is kept under, 0 disables it. Defaults to CONTENT_STORE_MB
+        """
+        store_config = config.get_content_store_config()
+        self.directory = directory or store_config['dir'] or os.path.join(tempfile.gettempdir(), "answer_card_content_store")
+        self.max_bytes = max_bytes if max_bytes is not None else store_config['max_mb'] * 1024 * 1024
+
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()  # hash -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, address: str) -> str:
+        return os.path.join(self.directory, address)
+
+    def _load_index(self) -> None:
+        # Files left by a previous run are kept, oldest first, leftover partial writes are removed
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._sizes[name] = size
+            self._size += size
+
+        with self._lock:
+            self._evict()
+
+    def put(self, data) -> Optional[str]:
+        """Store data unless it is already there, returns its hash or None when the store is disabled."""
+        if not self.enabled or len(data) > self.max_bytes:
+            return None
+
+        address = content_hash(data)
+        with self._lock:
+            if address in self._sizes:
+                self._sizes.move_to_end(address)
+                return address
+
+        temp_path = f"{self._path(address)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, self._path(address))
+        except OSError as e:
+            Utils.log_error(f"Could not store file {address}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+
+        with self._lock:
+            if address not in self._sizes:
+                self._sizes[address] = len(data)
+                self._size += len(data)
+            self._evict()
+
+        return address
+
+    def read(self, address: str) -> Optional[bytes]:
+        """Return the stored file with this hash, None if the store doesn't hold it."""
+        with self._lock:
+            if address not in self._sizes:
+                self.misses += 1
+                return None
+            self._sizes.move_to_end(address)
+
+        try:
+            with open(self._path(address), "rb") as file:
+                data = file.read()
+        except OSError:
+            with self._lock:
+                self._forget(address)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "files": len(self._sizes),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def _forget(self, address: str) -> None:
+        size = self._sizes.pop(address, None)
+        if size is not None:
+            self._size -= size
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and len(self._sizes) > 0:
+            address, size = self._sizes.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._path(address))
+            except OSError as e:
+                Utils.log_error(f"Could not remove stored file {address}: {e}")
@@ -1,9 +1,18 @@
+import asyncio
+import math
+import os
 import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import cv2
 import numpy as np
+from config_loader import config
+from circle_spatial_index import CircleSpatialIndex
+from hough_params_cache import HoughParamsCache
+from page_preprocessing import PagePreprocessor
 from utils import Utils, show_image
-from websocket_types import BoxRectangleType
+from websocket_types import BoxRectangleType, HoughSearchMode
 
 
 def replace_all_not_used(text):
@@ -19,43 +28,77 @@ def distance_between_points(point1, point2):
 
 
 
-async def find_circles(img, rectangle, rectangle_type, on_progress=None):
-    
-    img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+def slice_bounds(start, stop, size):
+    """Resolve arrays of slice start/stop values the way Python slicing does, returns clipped (start, stop)."""
+    start = np.where(start < 0, start + size, start).clip(0, size)
+    stop = np.where(stop < 0, stop + size, stop).clip(0, size)
+    return start, np.maximum(stop, start)
 
-    return await find_circles_cv2(img, rectangle, rectangle_type, img=img, on_progress=on_progress)
 
-async def find_circles_fallback(image_path, rectangle, rectangle_type, template_circles, darkness_threshold=180/255, on_progress=None, img=None):
+def classify_circles_fill(img, circles, darkness_threshold):
+    """
+    Decide which circles are filled from the mean intensity of the square around each one.
 
-    if img is None:
+    All squares are summed from one integral image of the box, so the cost per circle is
+    constant instead of proportional to its area. The mean is taken over every channel,
+    the same as np.mean on the colour crop.
 
-        img = cv2.imread(image_path)
+    Args:
+        img: Box image, colour or grayscale
+        circles: (N, 3) integer array of (x, y, radius) in box pixels
+        darkness_threshold: Circles with a mean below darkness_threshold * 255 are filled
 
-    
+    Returns:
+        Tuple of (filled, fill_ratio) arrays, fill_ratio is 1 - mean / 255 and 0 for
+        circles whose square is empty
+    """
+    circles = np.asarray(circles, dtype=np.int64).reshape(-1, 3)
+    channels = 1 if img.ndim == 2 else img.shape[2]
 
+    # Pixel sums are integers, float64 keeps them exact for any box size
+    integral = cv2.integral(img, sdepth=cv2.CV_64F).reshape(img.shape[0] + 1, img.shape[1] + 1, channels)
 
+    xs, ys, radii = circles[:, 0], circles[:, 1], circles[:, 2]
+    y_min, y_max = slice_bounds(np.maximum(ys - radii, 0), np.minimum(ys + radii, img.shape[0]), img.shape[0])
+    x_min, x_max = slice_bounds(np.maximum(xs - radii, 0), np.minimum(xs + radii, img.shape[1]), img.shape[1])
 
-    image_new_width = 4000
+    totals = (integral[y_max, x_max] - integral[y_min, x_max] - integral[y_max, x_min] + integral[y_min, x_min]).sum(axis=1)
+    counts = (y_max - y_min) * (x_max - x_min) * channels
 
-    width_ratio = image_new_width / img.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = totals / counts
 
-    img = cv2.resize(img,fx=width_ratio,fy=width_ratio,dsize=(0,0))
+    filled = means < darkness_threshold * 255
+    return filled, np.nan_to_num(1 - means / 255, nan=0.0)
 
 
+async def find_circles(img, rectangle, rectangle_type, on_progress=None):
     
-    
+    img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
 
-    old_x, old_y,width,height = rectangle.values()
-    
-    if old_x > 1 or old_y > 1 or width > 1 or height > 1 or old_x < 0 or old_y < 0 or width < 0 or height < 0:
-        raise ValueError("The rectangle values must be between 0 and 1.")
+    return await find_circles_cv2(img, rectangle, rectangle_type, img=img, on_progress=on_progress)
+
+async def find_circles_fallback(image_path, rectangle, rectangle_type, template_circles, darkness_threshold=180/255, on_progress=None, img=None, page=None):
+
+    if page is None:
+
+        if img is None:
+
+            img = cv2.imread(image_path)
+
+        page = PagePreprocessor(img)
+
+    # The template circles give the bubble size to pick the working resolution from
+    circle_size = float(np.median([circ["radius"] for circ in template_circles])) if len(template_circles) > 0 else None
+
+    scaled_page = page.scaled(circle_size)
+
+    img = scaled_page.image
+
+    width_ratio = scaled_page.width_ratio
 
     # transform to absolute
-        
-    x = int(old_x * img.shape[1])
-    y = int(old_y * img.shape[0])
-    width = int(width * img.shape[1])
-    height = int(height * img.shape[0])
+    x, y, width, height = scaled_page.rectangle_to_pixels(rectangle)
 
     if Utils.is_debug():
 
@@ -67,7 +110,11 @@ async def find_circles_fallback(image_path, rectangle, rectangle_type, template_
 
     # crop image on rectangle
 
-    crop_img = img[y:y+height, x:x+width]
+    crop_img = scaled_page.crop(x, y, width, height)
+
+    if Utils.is_debug():
+        # copy so the debug drawings below don't end up on the shared page
+        crop_img = crop_img.copy()
 
     template_circles = list(map(lambda circ: [
         int((circ["center_x"] * img.shape[1]) - x),
@@ -81,30 +128,18 @@ async def find_circles_fallback(image_path, rectangle, rectangle_type, template_
 
     output_circles = []
 
-    for i in template_circles:
-        y_min = max(i[1] - i[2],0)
-        x_min = max(i[0]-i[2],0)
-        y_max = min(i[1] + i[2],crop_img.shape[0])
-        x_max = min(i[0] + i[2],crop_img.shape[1])
-
-        #Utils.log_info(f"y_min: {y_min} | x_min: {x_min} | y_max: {y_max} | x_max: {x_max}")
-
-        circle_cropped = crop_img[y_min:y_max,x_min:x_max]
-
-        # check if filled (black) circle
+    # check which circles are filled (black), all at once
+    filled_circles, fill_ratios = classify_circles_fill(crop_img, template_circles, darkness_threshold)
 
-        filled = False
+    for i, filled, fill_ratio in zip(template_circles, filled_circles.tolist(), fill_ratios.tolist()):
 
-        if np.mean(circle_cropped) < darkness_threshold * 255:
-
-            filled = True
+        if filled:
 
             if Utils.is_debug():
 
                 cv2.circle(crop_img, (i[0], i[1]), i[2], (255, 0, 0), 2)
 
         else:
-            filled = False
 
             if Utils.is_debug():
 
@@ -129,6 +164,7 @@ async def find_circles_fallback(image_path, rectangle, rectangle_type, template_
             "center_y": float(i[1]),
             "radius": float(i[2]),
             "filled": filled,
+            "fill_ratio": fill_ratio,
             "id": random.randbytes(10).hex()
         })
 
@@ -141,6 +177,57 @@ async def find_circles_fallback(image_path, rectangle, rectangle_type, template_
 
 
 
+def group_sorted_values(sorted_values, tolerance):
+    """
+    Split an ascending array into runs whose values are within tolerance of the run's first value.
+
+    Returns a list of (start, end) slice bounds. This is the greedy "join the first group whose
+    first element is close enough" grouping: with sorted input only the last group can ever match,
+    so each run boundary can be found with a binary search instead of scanning every group.
+    """
+    bounds = []
+    count = len(sorted_values)
+    start = 0
+    while start < count:
+        anchor = sorted_values[start]
+        end = int(np.searchsorted(sorted_values, anchor + tolerance, side='right'))
+        # Re-check the boundary with the exact comparison, anchor + tolerance may round differently
+        while end < count and abs(sorted_values[end] - anchor) <= tolerance:
+            end += 1
+        while end > start + 1 and abs(sorted_values[end - 1] - anchor) > tolerance:
+            end -= 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def evaluate_grid_axis(values, tolerance):
+    """
+    Group circle coordinates along one axis into rows (or columns) and score them.
+
+    Returns:
+        Tuple of (group_count, size_consistency, spacing_score)
+    """
+    sorted_values = values[np.argsort(values, kind='stable')]
+    bounds = group_sorted_values(sorted_values, tolerance)
+
+    sizes = [end - start for start, end in bounds]
+    most_common_size = max(set(sizes), key=sizes.count)
+    consistent = sum(1 for size in sizes if abs(size - most_common_size) <= 1)
+    size_consistency = consistent / len(bounds)
+
+    spacing_score = 1
+    if len(bounds) > 2:
+        centers = np.array([np.mean(sorted_values[start:end]) for start, end in bounds])
+        spacings = np.diff(centers)
+        if len(spacings) > 1:
+            spacing_std = np.std(spacings)
+            spacing_mean = np.mean(spacings)
+            spacing_score = max(0, 1 - (spacing_std / spacing_mean)) if spacing_mean > 0 else 0
+
+    return len(bounds), size_consistency, spacing_score
+
+
 def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_radius=None, img_shape=None):
     """
     Evaluate the quality of detected circles based on various metrics.
@@ -149,8 +236,11 @@ def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_
     if circles is None or len(circles[0]) == 0:
         return 0
     
-    circles_array = circles[0]
+    circles_array = np.asarray(circles[0])
     num_circles = len(circles_array)
+    xs = np.ascontiguousarray(circles_array[:, 0])
+    ys = np.ascontiguousarray(circles_array[:, 1])
+    radii = np.ascontiguousarray(circles_array[:, 2])
     
     # Base score from number of circles
     if expected_count is not None:
@@ -159,7 +249,6 @@ def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_
         count_score = min(num_circles / 20, 1)  # Prefer more circles up to 20
     
     # Radius consistency score
-    radii = [c[2] for c in circles_array]
     if len(radii) > 1:
         radius_std = np.std(radii)
         radius_mean = np.mean(radii)
@@ -167,26 +256,19 @@ def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_
     else:
         radius_consistency = 1
     
+    # Center distances for every pair (i < j), shared by the overlap and spacing scores
+    if num_circles > 1:
+        pair_i, pair_j = np.triu_indices(num_circles, k=1)
+        pair_distances = np.sqrt((xs[pair_i] - xs[pair_j])**2 + (ys[pair_i] - ys[pair_j])**2)
+    
     # Overlap penalty score - heavily penalize overlapping circles
     overlap_score = 1
-    if len(circles_array) > 1:
-        overlap_count = 0
-        total_pairs = 0
+    if num_circles > 1:
+        total_pairs = len(pair_distances)
         
-        for i in range(len(circles_array)):
-            for j in range(i + 1, len(circles_array)):
-                total_pairs += 1
-                circle1 = circles_array[i]
-                circle2 = circles_array[j]
-                
-                # Calculate distance between centers
-                distance = np.sqrt((circle1[0] - circle2[0])**2 + (circle1[1] - circle2[1])**2)
-                
-                # Check if circles overlap (distance < sum of radii with some tolerance)
-                min_allowed_distance = (circle1[2] + circle2[2]) * 0.8  # 80% of sum of radii
-                
-                if distance < min_allowed_distance:
-                    overlap_count += 1
+        # Circles overlap when their distance is below 80% of the sum of radii
+        min_allowed_distances = (radii[pair_i] + radii[pair_j]) * 0.8
+        overlap_count = int(np.count_nonzero(pair_distances < min_allowed_distances))
         
         # Calculate overlap penalty (0 = all overlapping, 1 = no overlapping)
         if total_pairs > 0:
@@ -196,17 +278,14 @@ def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_
     boundary_score = 1
     if img_shape is not None:
         img_height, img_width = img_shape[:2]
-        outside_count = 0
         
-        for circle in circles_array:
-            center_x, center_y, radius = circle[0], circle[1], circle[2]
-            
-            # Check if circle extends outside image boundaries
-            if (center_x - radius < 0 or  # Left boundary
-                center_y - radius < 0 or  # Top boundary
-                center_x + radius >= img_width or  # Right boundary
-                center_y + radius >= img_height):  # Bottom boundary
-                outside_count += 1
+        outside = (
+            (xs - radii < 0) |             # Left boundary
+            (ys - radii < 0) |             # Top boundary
+            (xs + radii >= img_width) |    # Right boundary
+            (ys + radii >= img_height)     # Bottom boundary
+        )
+        outside_count = int(np.count_nonzero(outside))
         
         # Calculate boundary penalty (0 = all outside, 1 = all inside)
         if num_circles > 0:
@@ -214,106 +293,40 @@ def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_
     
     # Grid pattern score - reward proper rows and columns
     grid_score = 1
-    if len(circles_array) >= 4:  # Need at least 4 circles to form a grid
-        # Group circles into rows (similar Y coordinates)
+    if num_circles >= 4:  # Need at least 4 circles to form a grid
         avg_radius = np.mean(radii)
         row_tolerance = avg_radius * 0.5  # Allow some tolerance for row alignment
         col_tolerance = avg_radius * 0.5  # Allow some tolerance for column alignment
         
-        # Sort circles by Y coordinate to group into rows
-        sorted_by_y = sorted(circles_array, key=lambda c: c[1])
-        rows = []
-        
-        for circle in sorted_by_y:
-            placed = False
-            for row in rows:
-                # Check if this circle belongs to an existing row
-                if abs(circle[1] - row[0][1]) <= row_tolerance:
-                    row.append(circle)
-                    placed = True
-                    break
-            if not placed:
-                rows.append([circle])
-        
-        # Group circles into columns (similar X coordinates)
-        sorted_by_x = sorted(circles_array, key=lambda c: c[0])
-        cols = []
-        
-        for circle in sorted_by_x:
-            placed = False
-            for col in cols:
-                # Check if this circle belongs to an existing column
-                if abs(circle[0] - col[0][0]) <= col_tolerance:
-                    col.append(circle)
-                    placed = True
-                    break
-            if not placed:
-                cols.append([circle])
+        row_count, row_consistency, row_spacing_score = evaluate_grid_axis(ys, row_tolerance)
+        col_count, col_consistency, col_spacing_score = evaluate_grid_axis(xs, col_tolerance)
         
         # Calculate grid quality
         grid_quality = 0
         
-        if len(rows) > 1 and len(cols) > 1:
-            # Check row consistency (similar number of circles per row)
-            row_sizes = [len(row) for row in rows]
-            most_common_row_size = max(set(row_sizes), key=row_sizes.count)
-            consistent_rows = sum(1 for size in row_sizes if abs(size - most_common_row_size) <= 1)
-            row_consistency = consistent_rows / len(rows)
-            
-            # Check column consistency (similar number of circles per column)
-            col_sizes = [len(col) for col in cols]
-            most_common_col_size = max(set(col_sizes), key=col_sizes.count)
-            consistent_cols = sum(1 for size in col_sizes if abs(size - most_common_col_size) <= 1)
-            col_consistency = consistent_cols / len(cols)
-            
-            # Check row spacing consistency
-            row_spacing_score = 1
-            if len(rows) > 2:
-                row_centers = [np.mean([c[1] for c in row]) for row in rows]
-                row_spacings = [row_centers[i+1] - row_centers[i] for i in range(len(row_centers)-1)]
-                if len(row_spacings) > 1:
-                    spacing_std = np.std(row_spacings)
-                    spacing_mean = np.mean(row_spacings)
-                    row_spacing_score = max(0, 1 - (spacing_std / spacing_mean)) if spacing_mean > 0 else 0
-            
-            # Check column spacing consistency
-            col_spacing_score = 1
-            if len(cols) > 2:
-                col_centers = [np.mean([c[0] for c in col]) for col in cols]
-                col_spacings = [col_centers[i+1] - col_centers[i] for i in range(len(col_centers)-1)]
-                if len(col_spacings) > 1:
-                    spacing_std = np.std(col_spacings)
-                    spacing_mean = np.mean(col_spacings)
-                    col_spacing_score = max(0, 1 - (spacing_std / spacing_mean)) if spacing_mean > 0 else 0
-            
-            # Calculate overall grid quality
+        if row_count > 1 and col_count > 1:
             grid_quality = (row_consistency + col_consistency + row_spacing_score + col_spacing_score) / 4
         
         grid_score = grid_quality
     
     # Spacing consistency score (for grid-like patterns)
     spacing_score = 1
-    if len(circles_array) > 3:
-        distances = []
-        for i in range(len(circles_array)):
-            for j in range(i + 1, len(circles_array)):
-                dist = np.sqrt((circles_array[i][0] - circles_array[j][0])**2 + 
-                             (circles_array[i][1] - circles_array[j][1])**2)
-                distances.append(dist)
-        
-        if distances:
-            distances = sorted(distances)
-            # Look at the most common distance (assuming grid pattern)
-            min_distances = [d for d in distances if d > np.mean(radii)][:num_circles]
-            if len(min_distances) > 1:
-                spacing_std = np.std(min_distances)
-                spacing_mean = np.mean(min_distances)
-                spacing_score = max(0, 1 - (spacing_std / spacing_mean))
+    if num_circles > 3:
+        # Look at the most common distance (assuming grid pattern): the num_circles
+        # shortest distances that are longer than a radius
+        min_distances = pair_distances[pair_distances > np.mean(radii)]
+        if len(min_distances) > num_circles:
+            min_distances = np.partition(min_distances, num_circles - 1)[:num_circles]
+        min_distances = np.sort(min_distances)
+        if len(min_distances) > 1:
+            spacing_std = np.std(min_distances)
+            spacing_mean = np.mean(min_distances)
+            spacing_score = max(0, 1 - (spacing_std / spacing_mean))
     
     # Radius range score (prefer circles within expected range)
     radius_range_score = 1
     if min_radius is not None and max_radius is not None:
-        in_range_count = sum(1 for r in radii if min_radius <= r <= max_radius)
+        in_range_count = int(np.count_nonzero((radii >= min_radius) & (radii <= max_radius)))
         radius_range_score = in_range_count / num_circles if num_circles > 0 else 0
     
     # Combined score with weights - grid pattern has high weight
@@ -329,19 +342,351 @@ def evaluate_circles_quality(circles, expected_count=None, min_radius=None, max_
     
     return total_score
 
+_sweep_executor = None
+
+
+def get_sweep_executor():
+    """
+    Return the shared thread pool used to run Hough sweep combinations, or None
+    when the sweep is configured to run serially.
+
+    cv2.threshold and cv2.HoughCircles release the GIL, so threads are enough to
+    spread the combinations over every core without copying the image around.
+    """
+    global _sweep_executor
+
+    workers = config.get_detection_config()['sweep_workers']
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        return None
+
+    if _sweep_executor is None:
+        _sweep_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hough-sweep")
+        Utils.log_info(f"Hough sweep executor started with {workers} workers")
+
+    return _sweep_executor
+
+
+_params_cache = None
+
+
+def get_params_cache():
+    """
+    Return the worker's persistent memo of winning Hough parameters, or None when it is disabled.
+
+    A relative HOUGH_PARAMS_CACHE_FILE is kept in the temporary directory, so every worker
+    process uses the same file whatever directory it was started from.
+    """
+    global _params_cache
+
+    detection_config = config.get_detection_config()
+    if detection_config['params_cache_size'] <= 0:
+        return None
+
+    if _params_cache is None:
+        path = detection_config['params_cache_file']
+        if not os.path.isabs(path):
+            path = os.path.join(tempfile.gettempdir(), path)
+        _params_cache = HoughParamsCache(path, detection_config['params_cache_size'])
+
+    return _params_cache
+
+
+def build_param_combinations(dp_values, param1_values, param2_values, threshold_values, min_dist_values):
+    """
+    Build the list of Hough parameter combinations in the order the sweep reports them.
+    """
+    param_combos = []
+    for dp in dp_values:
+        for param1 in param1_values:
+            for param2 in param2_values:
+                for threshold in threshold_values:
+                    for test_min_dist in min_dist_values:
+                        param_combos.append({
+                            'dp': dp,
+                            'param1': param1,
+                            'param2': param2,
+                            'threshold': threshold,
+                            'min_dist': test_min_dist
+                        })
+    return param_combos
+
+
+def neighbour_combinations(param_combo, dp_values, param1_values, param2_values, threshold_values):
+    """
+    Combinations one step away from param_combo in param2 and threshold, or both, keeping its
+    dp, param1 and min_dist. Values not in the grid step from the nearest grid value.
+    """
+    def neighbours(values, value):
+        index = min(range(len(values)), key=lambda i: abs(values[i] - value))
+        return values[max(0, index - 1):index + 2]
+
+    combos = []
+    for param2 in neighbours(param2_values, param_combo['param2']):
+        for threshold in neighbours(threshold_values, param_combo['threshold']):
+            if param2 == param_combo['param2'] and threshold == param_combo['threshold']:
+                continue
+            combos.append({**param_combo, 'param2': param2, 'threshold': threshold})
+    return combos
+
+
+def fixed_search(param_combos):
+    """Search over a given list of combinations, a single batch like grid_search."""
+    yield param_combos
+
+
+def grid_search(dp_values, param1_values, param2_values, threshold_values, min_dist_values):
+    """
+    Exhaustive search: a single batch with the full cartesian product of the parameter values.
+
+    Like successive_halving_search, this is a generator that yields batches of parameter
+    combinations and receives the list of scores for each batch through send().
+    """
+    yield build_param_combinations(dp_values, param1_values, param2_values, threshold_values, min_dist_values)
+
+
+def successive_halving_search(dp_values, param1_values, param2_values, threshold_values, min_dist_values, eta=3):
+    """
+    Coarse-to-fine search that evaluates roughly 1/eta of the full grid.
+
+    Rounds:
+        1. Seed every other threshold at the first dp and the middle param2
+        2. Fill in the thresholds next to the best 1/eta seeds
+        3. Try every param2 on the best 1/eta thresholds
+        4. Try the remaining dp/param1/min_dist values on the best 1/eta (param2, threshold) pairs
+
+    Yields batches of parameter combinations and receives the list of scores for each batch
+    through send(). Failed combinations should be reported with a score of -1.
+    """
+    scores = {}  # (dp, param1, param2, threshold, min_dist) -> score
+
+    def keep(count):
+        return max(1, math.ceil(count / eta))
+
+    def best_keys(keys, count):
+        # sorted() is stable, so ties keep evaluation order and the search stays deterministic
+        return sorted(keys, key=lambda key: scores[key], reverse=True)[:count]
+
+    def evaluate(keys):
+        keys = [key for key in dict.fromkeys(keys) if key not in scores]
+        if len(keys) == 0:
+            return
+        batch_scores = yield [
+            {'dp': dp, 'param1': param1, 'param2': param2, 'threshold': threshold, 'min_dist': test_min_dist}
+            for dp, param1, param2, threshold, test_min_dist in keys
+        ]
+        scores.update(zip(keys, batch_scores))
+
+    base_dp, base_param1, base_min_dist = dp_values[0], param1_values[0], min_dist_values[0]
+    mid_param2 = param2_values[len(param2_values) // 2]
+
+    # Round 1: coarse threshold seeds
+    seeds = [(base_dp, base_param1, mid_param2, threshold, base_min_dist) for threshold in threshold_values[::2]]
+    yield from evaluate(seeds)
+
+    # Round 2: refine around the best seeds with their neighbouring thresholds
+    refined = []
+    for key in best_keys(seeds, keep(len(seeds))):
+        index = threshold_values.index(key[3])
+        for threshold in threshold_values[max(0, index - 1):index + 2]:
+            refined.append((base_dp, base_param1, mid_param2, threshold, base_min_dist))
+    yield from evaluate(refined)
+
+    # Round 3: vote threshold for the surviving thresholds
+    threshold_keys = list(scores)
+    yield from evaluate([
+        (base_dp, base_param1, param2, key[3], base_min_dist)
+        for key in best_keys(threshold_keys, keep(len(threshold_keys)))
+        for param2 in param2_values
+    ])
+
+    # Round 4: accumulator resolution (and any other remaining axis) for the best pairs
+    pair_keys = list(scores)
+    yield from evaluate([
+        (dp, param1, key[2], key[3], test_min_dist)
+        for key in best_keys(pair_keys, keep(len(pair_keys)))
+        for dp in dp_values
+        for param1 in param1_values
+        for test_min_dist in min_dist_values
+    ])
+
+
+HOUGH_SEARCH_STRATEGIES = {
+    HoughSearchMode.GRID: grid_search,
+    HoughSearchMode.SUCCESSIVE_HALVING: successive_halving_search,
+}
+
+
+def threshold_images(gray_img, param_combos):
+    """
+    Threshold the image once for every distinct threshold in param_combos.
+
+    The thresholded image only depends on the threshold, so the dp and param2 values
+    sharing it reuse the same (read-only) image.
+    """
+    thresholded = {}
+    for param_combo in param_combos:
+        threshold = param_combo['threshold']
+        if threshold not in thresholded:
+            _, thresholded[threshold] = cv2.threshold(gray_img, threshold, 255, cv2.THRESH_BINARY)
+    return thresholded
+
+
+def run_hough_combination(gray_img, param_combo, min_radius, max_radius, expected_count=None, thresh_img=None):
+    """
+    Threshold the image, run HoughCircles and score the result for a single parameter combination.
+
+    thresh_img can be passed in when the image was already thresholded with param_combo['threshold'].
+
+    Returns:
+        Tuple of (circles, score)
+    """
+    # Apply threshold to the grayscale image
+    if thresh_img is None:
+        _, thresh_img = cv2.threshold(gray_img, param_combo['threshold'], 255, cv2.THRESH_BINARY)
+
+    circles = cv2.HoughCircles(
+        thresh_img,
+        cv2.HOUGH_GRADIENT,
+        param_combo['dp'],
+        param_combo['min_dist'],
+        param1=param_combo['param1'],
+        param2=param_combo['param2'],
+        minRadius=min_radius,
+        maxRadius=max_radius
+    )
+
+    score = evaluate_circles_quality(
+        circles,
+        expected_count=expected_count,
+        min_radius=min_radius,
+        max_radius=max_radius,
+        img_shape=thresh_img.shape
+    )
+
+    return circles, score
+
+
+async def run_hough_sweep(gray_img, param_combos, min_radius, max_radius, expected_count=None):
+    """
+    Evaluate every parameter combination, yielding (param_combo, circles, score, error) tuples.
+
+    Combinations are dispatched to the sweep executor all at once, but results are always
+    yielded in the order of param_combos so the caller sees the same sequence as the serial path.
+    """
+    executor = get_sweep_executor()
+    thresholded = threshold_images(gray_img, param_combos)
+
+    if executor is None:
+        for param_combo in param_combos:
+            try:
+                circles, score = run_hough_combination(gray_img, param_combo, min_radius, max_radius, expected_count,
+                                                       thresholded[param_combo['threshold']])
+                yield param_combo, circles, score, None
+            except Exception as e:
+                yield param_combo, None, 0, e
+        return
+
+    loop = asyncio.get_running_loop()
+    futures = [
+        loop.run_in_executor(executor, run_hough_combination, gray_img, param_combo, min_radius, max_radius, expected_count,
+                             thresholded[param_combo['threshold']])
+        for param_combo in param_combos
+    ]
+
+    try:
+        for param_combo, future in zip(param_combos, futures):
+            try:
+                circles, score = await future
+                yield param_combo, circles, score, None
+            except Exception as e:
+                yield param_combo, None, 0, e
+    finally:
+        # Don't leave queued combinations running if the caller stopped early
+        for future in futures:
+            future.cancel()
+
+
+class HoughSweepResults:
+    """
+    Scores and circles of every successful Hough sweep combination.
+
+    Circles of all combinations live in one structured array (combo id, x, y, r, score) that
+    grows by doubling, instead of one small array and tuple per combination.
+    """
+
+    CIRCLE_DTYPE = np.dtype([
+        ('combo', np.int32),
+        ('x', np.float32),
+        ('y', np.float32),
+        ('r', np.float32),
+        ('score', np.float64),
+    ])
+
+    def __init__(self, capacity=1024):
+        self.param_combos = []
+        self.scores = []
+        self.circle_counts = []
+        self._circles = np.empty(capacity, dtype=self.CIRCLE_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return len(self.param_combos)
+
+    @property
+    def circles(self):
+        """Structured array with one row per circle found, in the order the combinations were added."""
+        return self._circles[:self._size]
+
+    def add(self, param_combo, score, circles):
+        """Record a combination with its score and the circles returned by HoughCircles (or None)."""
+        combo_id = len(self.param_combos)
+        self.param_combos.append(param_combo)
+        self.scores.append(score)
+
+        count = len(circles[0]) if circles is not None else 0
+        self.circle_counts.append(count)
+        if count == 0:
+            return
+
+        end = self._size + count
+        if end > len(self._circles):
+            grown = np.empty(max(end, len(self._circles) * 2), dtype=self.CIRCLE_DTYPE)
+            grown[:self._size] = self._circles[:self._size]
+            self._circles = grown
+
+        rows = self._circles[self._size:end]
+        rows['combo'] = combo_id
+        rows['x'] = circles[0][:, 0]
+        rows['y'] = circles[0][:, 1]
+        rows['r'] = circles[0][:, 2]
+        rows['score'] = score
+        self._size = end
+
+
 async def find_circles_hough_iterative(gray_img, dp_base, min_dist, min_radius, max_radius, 
-                                 expected_count=None, circle_precision_percentage=1, on_progress=None, rectangle_info=None):
+                                 expected_count=None, circle_precision_percentage=1, on_progress=None, rectangle_info=None,
+                                 search_mode=HoughSearchMode.GRID, cache_key=None, pixel_scale=1):
     """
     Iteratively test different Hough circle parameters to find the best result.
+
+    search_mode selects how the parameter space is explored: HoughSearchMode.GRID tests every
+    combination, HoughSearchMode.SUCCESSIVE_HALVING tests about a third of them coarse-to-fine.
+
+    When cache_key is given, the parameters that won on an earlier box with the same key are
+    tried first and the search only runs if they score noticeably worse than they did before.
+    Otherwise only their neighbours are tested, so consensus recovery still has several
+    combinations to combine.
+
+    pixel_scale is the image width divided by the 4000 width the pixel tolerances were tuned at.
     """
     best_circles = None
     best_score = -1
     best_params = None
     
-    # Track all circles found across all parameter combinations for consensus
-    all_circles_found = []  # List of (circle, param_combo, score) tuples
-    # Track parameter combination results for top-score analysis
-    param_combo_results = []  # List of (param_combo, score, circles) tuples
+    # Track parameter combination results and their circles for consensus
+    sweep_results = HoughSweepResults()
     
     # Parameter ranges to test
     dp_values = [1,1.2]
@@ -350,8 +695,17 @@ async def find_circles_hough_iterative(gray_img, dp_base, min_dist, min_radius,
     threshold_values = [220,224,228,233,237,243]  # Different threshold values to test
     min_dist_values = [min_dist]
     
-    total_combinations = len(dp_values) * len(param1_values) * len(param2_values) * len(threshold_values) * len(min_dist_values)
-    Utils.log_info(f"Testing {total_combinations} parameter combinations...")
+    if search_mode not in HOUGH_SEARCH_STRATEGIES:
+        Utils.log_error(f"Unknown Hough search mode {search_mode}, using {HoughSearchMode.GRID}")
+        search_mode = HoughSearchMode.GRID
+
+    grid_size = len(dp_values) * len(param1_values) * len(param2_values) * len(threshold_values) * len(min_dist_values)
+    if search_mode == HoughSearchMode.SUCCESSIVE_HALVING:
+        # Planned budget, the adaptive search may end up testing slightly fewer combinations
+        total_combinations = math.ceil(grid_size / 3)
+    else:
+        total_combinations = grid_size
+    Utils.log_info(f"Testing {total_combinations} parameter combinations ({search_mode} search)...")
     
     # Format rectangle info for progress messages
     rect_info = ""
@@ -362,122 +716,99 @@ async def find_circles_hough_iterative(gray_img, dp_base, min_dist, min_radius,
         rect_total = rectangle_info.get('total', 1)
         rect_info = f"{page_info}[{rect_index}/{rect_total}] "
     
+    # Try the parameters that won on an earlier page with the same box layout
+    params_cache = get_params_cache() if cache_key is not None else None
+    cached_entry = params_cache.get(cache_key) if params_cache is not None else None
+    used_cached_params = False
+
+    if cached_entry is not None:
+        cached_combo = {**cached_entry['params'], 'min_dist': min_dist}
+        margin = config.get_detection_config()['params_cache_margin']
+        async for param_combo, circles, score, error in run_hough_sweep(gray_img, [cached_combo], min_radius, max_radius, expected_count):
+            if error is None and score >= cached_entry['score'] - margin:
+                used_cached_params = True
+                best_score = score
+                best_circles = circles
+                best_params = dict(param_combo)
+                sweep_results.add(param_combo, score, circles)
+                Utils.log_info(f"♻️ Reusing cached parameters {cached_entry['params']} - score {score:.3f} (cached: {cached_entry['score']:.3f})")
+                if on_progress is not None:
+                    await on_progress(f"{rect_info}♻️ Reused parameters from a previous page\nScore: {score:.3f}")
+            else:
+                Utils.log_info(f"Cached parameters {cached_entry['params']} scored {score:.3f} (cached: {cached_entry['score']:.3f}), running full search")
+
     test_count = 0
-    for dp in dp_values:
-        for param1 in param1_values:
-            for param2 in param2_values:
-                for threshold in threshold_values:
-                    for test_min_dist in min_dist_values:
-                        test_count += 1
-                        progress_percent = (test_count / total_combinations) * 100
-                        
-                        # Update progress with current best score
-                        best_score_text = f"Best: {best_score:.3f}" if best_score > -1 else "Best: None"
-                        if on_progress is not None:
-                            await on_progress(f"{rect_info}Testing {test_count}/{total_combinations} ({progress_percent:.1f}%)\n{best_score_text} | dp={dp}, param1={param1}, param2={param2}, threshold={threshold}")
-                        
-                        try:
-                            # Apply threshold to the grayscale image
-                            _, thresh_img = cv2.threshold(gray_img, threshold, 255, cv2.THRESH_BINARY)
-                            
-                            circles = cv2.HoughCircles(
-                                thresh_img, 
-                                cv2.HOUGH_GRADIENT, 
-                                dp, 
-                                test_min_dist,
-                                param1=param1, 
-                                param2=param2, 
-                                minRadius=min_radius, 
-                                maxRadius=max_radius
-                            )
-                            
-                            score = evaluate_circles_quality(
-                                circles, 
-                                expected_count=expected_count,
-                                min_radius=min_radius,
-                                max_radius=max_radius,
-                                img_shape=thresh_img.shape
-                            )
-
-                            param_combo = {
-                                'dp': dp,
-                                'param1': param1,
-                                'param2': param2,
-                                'threshold': threshold,
-                                'min_dist': test_min_dist
-                            }
-                            
-                            # Store parameter combination result
-                            param_combo_results.append((param_combo, score, circles))
-
-                            # Store all circles found with their parameters and score
-                            if circles is not None and len(circles[0]) > 0:
-                                for circle in circles[0]:
-                                    all_circles_found.append((circle, param_combo, score))
-
-                            circle_count = len(circles[0]) if circles is not None and len(circles[0]) > 0 else 0
-                            #Utils.log_info(f"[{test_count}/{total_combinations}] ({progress_percent:.1f}%) Testing dp={dp}, param1={param1}, param2={param2}, threshold={threshold} → Score: {score:.3f}, Circles: {circle_count}")
-
-                            """ if Utils.is_debug():
-                                # show circles in image
-                                gray_img_copy = thresh_img.copy()
-                                # convert gray to rgb
-                                gray_img_copy = cv2.cvtColor(gray_img_copy, cv2.COLOR_GRAY2RGB)
-                                if circles is not None:
-                                    for circle in circles[0]:
-                                        # Convert coordinates to integers for OpenCV
-                                        center_x = int(circle[0])
-                                        center_y = int(circle[1])
-                                        radius = int(circle[2])
-                                        cv2.circle(gray_img_copy, (center_x, center_y), radius, (0, 0, 255), 2)
-                                show_image(gray_img_copy, f"threshold_{threshold}_dp_{dp}")
-
-                                Utils.log_info(f"Score: {score:.3f} with params: dp={dp}, param1={param1}, param2={param2}, threshold={threshold}, min_dist={test_min_dist}, num circles: {len(circles[0]) if circles is not None else 0}")
-                             """
-                            if score > best_score:
-                                best_score = score
-                                best_circles = circles
-                                best_params = {
-                                    'dp': dp,
-                                    'param1': param1,
-                                    'param2': param2,
-                                    'threshold': threshold,
-                                    'min_dist': test_min_dist
-                                }
-                                Utils.log_info(f"🎯 NEW BEST SCORE: {score:.3f} with {circle_count} circles! Params: dp={dp}, param1={param1}, param2={param2}, threshold={threshold}")
-                                if on_progress is not None:
-                                    await on_progress(f"{rect_info}🎯 NEW BEST!\nScore: {score:.3f}, Circles: {circle_count} | Progress: {progress_percent:.1f}%")
-                        
-                        except Exception as e:
-                            Utils.log_error(f"Error with parameters dp={dp}, param1={param1}, param2={param2}, threshold={threshold}, min_dist={test_min_dist}: {e}")
-                            continue
+    if used_cached_params:
+        neighbours = neighbour_combinations(best_params, dp_values, param1_values, param2_values, threshold_values)
+        search = fixed_search(neighbours)
+        total_combinations = len(neighbours)
+        cached_score = best_score
+    else:
+        search = HOUGH_SEARCH_STRATEGIES[search_mode](dp_values, param1_values, param2_values, threshold_values, min_dist_values)
+    param_combos = next(search, None)
+
+    while param_combos is not None:
+        batch_scores = []
+
+        async for param_combo, circles, score, error in run_hough_sweep(gray_img, param_combos, min_radius, max_radius, expected_count):
+            test_count += 1
+            progress_percent = min(100, (test_count / total_combinations) * 100)
+            dp = param_combo['dp']
+            param1 = param_combo['param1']
+            param2 = param_combo['param2']
+            threshold = param_combo['threshold']
+            test_min_dist = param_combo['min_dist']
+
+            # Update progress with current best score
+            best_score_text = f"Best: {best_score:.3f}" if best_score > -1 else "Best: None"
+            if on_progress is not None:
+                await on_progress(f"{rect_info}Testing {test_count}/{total_combinations} ({progress_percent:.1f}%)\n{best_score_text} | dp={dp}, param1={param1}, param2={param2}, threshold={threshold}")
+
+            if error is not None:
+                Utils.log_error(f"Error with parameters dp={dp}, param1={param1}, param2={param2}, threshold={threshold}, min_dist={test_min_dist}: {error}")
+                batch_scores.append(-1)
+                continue
+
+            batch_scores.append(score)
+
+            # Store parameter combination result
+            sweep_results.add(param_combo, score, circles)
+
+            circle_count = len(circles[0]) if circles is not None and len(circles[0]) > 0 else 0
+            #Utils.log_info(f"[{test_count}/{total_combinations}] ({progress_percent:.1f}%) Testing dp={dp}, param1={param1}, param2={param2}, threshold={threshold} → Score: {score:.3f}, Circles: {circle_count}")
+
+            if score > best_score:
+                best_score = score
+                best_circles = circles
+                best_params = dict(param_combo)
+                Utils.log_info(f"🎯 NEW BEST SCORE: {score:.3f} with {circle_count} circles! Params: dp={dp}, param1={param1}, param2={param2}, threshold={threshold}")
+                if on_progress is not None:
+                    await on_progress(f"{rect_info}🎯 NEW BEST!\nScore: {score:.3f}, Circles: {circle_count} | Progress: {progress_percent:.1f}%")
+
+        try:
+            param_combos = search.send(batch_scores)
+        except StopIteration:
+            param_combos = None
+
+    if params_cache is not None and best_params is not None and (not used_cached_params or best_score > cached_score):
+        # min_dist follows the circle size of each box, so only the sweep parameters are remembered
+        params_cache.put(cache_key, {key: value for key, value in best_params.items() if key != 'min_dist'}, best_score)
 
     Utils.log_info(f"✅ Parameter testing complete! Applying consensus recovery...")
     if on_progress is not None:
         await on_progress(f"{rect_info}Parameter testing complete!\nFinal score: {best_score:.3f} | Applying consensus recovery...")
     
     # Apply consensus-based circle recovery using top percentage of best-scoring combinations
-    if best_circles is not None and len(param_combo_results) > 0:
-        Utils.log_info(f"🔄 Running consensus analysis on {len(param_combo_results)} parameter combinations...")
-        enhanced_circles = apply_consensus_recovery(best_circles[0], param_combo_results, top_percentage=0.4,min_frequency_ratio=0.4)
+    if best_circles is not None and len(sweep_results) > 0:
+        Utils.log_info(f"🔄 Running consensus analysis on {len(sweep_results)} parameter combinations...")
+        enhanced_circles = apply_consensus_recovery(best_circles[0], sweep_results, location_tolerance=15 * pixel_scale,
+                                                    top_percentage=0.4,min_frequency_ratio=0.4)
         
-        # Filter circles by bounds before grid outlier removal
-        Utils.log_info(f"🔍 Filtering circles by image bounds...")
-        bounds_filtered_circles = filter_circles_by_bounds(enhanced_circles, gray_img.shape,max_outside_ratio=0.4)
+        filtered_circles = post_filter_circles(enhanced_circles, gray_img.shape, max_outside_ratio=0.4)
         
-        # Remove grid outliers after bounds filtering
-        Utils.log_info(f"🧹 Removing grid outliers...")
-        grid_filtered_circles = remove_grid_outliers(bounds_filtered_circles)
-        
-        # Remove overlapping circles after grid outlier removal
-        Utils.log_info(f"🔄 Removing overlapping circles...")
-        filtered_circles = remove_overlapping_circles(grid_filtered_circles)
-        
-        best_circles = np.array([filtered_circles], dtype=np.float32)
+        best_circles = filtered_circles[np.newaxis, :, :]
         Utils.log_info(f"✨ Analysis complete: Consensus recovery enhanced to {len(enhanced_circles)} circles, "
-                      f"bounds filtering reduced to {len(bounds_filtered_circles)} circles, "
-                      f"grid outlier removal filtered to {len(grid_filtered_circles)} circles, "
-                      f"overlap removal final result: {len(filtered_circles)} circles")
+                      f"bounds, grid outlier and overlap filtering final result: {len(filtered_circles)} circles")
         if on_progress is not None:
             await on_progress(f"{rect_info}✨ Analysis complete!\nFinal result: {len(filtered_circles)} circles detected\n(bounds + outliers + overlaps filtered)")
     else:
@@ -488,7 +819,7 @@ async def find_circles_hough_iterative(gray_img, dp_base, min_dist, min_radius,
     return best_circles, best_params, best_score
 
 
-def apply_consensus_recovery(best_circles, param_combo_results, 
+def apply_consensus_recovery(best_circles, sweep_results, 
                            location_tolerance=15, min_frequency_ratio=0.5, top_percentage=0.4):
     """
     Apply consensus-based recovery to add back frequently detected circles.
@@ -496,140 +827,183 @@ def apply_consensus_recovery(best_circles, param_combo_results,
     
     Args:
         best_circles: Circles from the best parameter combination
-        param_combo_results: List of (param_combo, score, circles) from all combinations
+        sweep_results: HoughSweepResults with the circles of all combinations
         location_tolerance: Pixel tolerance for considering circles at same location
         min_frequency_ratio: Minimum ratio of appearances in top combinations to be considered for recovery
         top_percentage: Percentage of top-scoring combinations to consider (0.4 = top 40%)
+
+    Returns:
+        (M, 3) array with the best circles followed by the recovered consensus circles
     """
     # Sort parameter combinations by score (highest first) and take top percentage
-    sorted_results = sorted(param_combo_results, key=lambda x: x[1], reverse=True)
-    top_n = max(1, int(len(sorted_results) * top_percentage))
-    top_results = sorted_results[:top_n]
+    combo_count = len(sweep_results)
+    scores = np.array(sweep_results.scores, dtype=np.float64)
+    sorted_combos = np.argsort(-scores, kind='stable')
+    top_n = max(1, int(combo_count * top_percentage))
+    top_combos = sorted_combos[:top_n]
     
-    Utils.log_info(f"Analyzing consensus from top {len(top_results)} parameter combinations ({top_percentage*100:.0f}% of {len(param_combo_results)} total)")
+    Utils.log_info(f"Analyzing consensus from top {len(top_combos)} parameter combinations ({top_percentage*100:.0f}% of {combo_count} total)")
     if Utils.is_debug():
-        for i, (params, score, circles) in enumerate(top_results[:5]):  # Show top 5
-            circle_count = len(circles[0]) if circles is not None and len(circles[0]) > 0 else 0
-            Utils.log_info(f"  #{i+1}: Score {score:.3f}, {circle_count} circles, params: {params}")
-    
-    # Group all found circles from top results by location
-    circle_locations = {}  # location_key -> list of (circle, param_combo, score)
-    
-    for param_combo, score, circles in top_results:
-        if circles is not None and len(circles[0]) > 0:
-            for circle in circles[0]:
-                # Create a location key based on rounded coordinates
-                location_key = (
-                    round(circle[0] / location_tolerance) * location_tolerance,
-                    round(circle[1] / location_tolerance) * location_tolerance
-                )
-                
-                if location_key not in circle_locations:
-                    circle_locations[location_key] = []
-                circle_locations[location_key].append((circle, param_combo, score))
-    
-    # Count frequencies and find consensus circles
+        for i, combo_id in enumerate(top_combos[:5]):  # Show top 5
+            Utils.log_info(f"  #{i+1}: Score {scores[combo_id]:.3f}, {sweep_results.circle_counts[combo_id]} circles, params: {sweep_results.param_combos[combo_id]}")
+    
+    # Circles of the top combinations, ordered by combination rank and then by detection order
+    combo_rank = np.full(combo_count, top_n)
+    combo_rank[top_combos] = np.arange(len(top_combos))
+    all_circles = sweep_results.circles
+    circle_rank = combo_rank[all_circles['combo']]
+    selected = np.flatnonzero(circle_rank < top_n)
+    top_circles = all_circles[selected[np.argsort(circle_rank[selected], kind='stable')]]
+    
+    # Group all found circles from top results by location: a hash grid keyed by the
+    # coordinates rounded to location_tolerance
     consensus_circles = []
-    min_appearances = max(1, int(len(top_results) * min_frequency_ratio))
-    
-    Utils.log_info(f"Looking for circles that appear in at least {min_appearances} out of {len(top_results)} top combinations ({min_frequency_ratio*100:.0f}%)")
-    
-    for location_key, circles_at_location in circle_locations.items():
-        frequency = len(circles_at_location)
+    min_appearances = max(1, int(len(top_combos) * min_frequency_ratio))
+    
+    Utils.log_info(f"Looking for circles that appear in at least {min_appearances} out of {len(top_combos)} top combinations ({min_frequency_ratio*100:.0f}%)")
+    
+    if len(top_circles) > 0:
+        location_keys = np.stack([
+            np.round(top_circles['x'] / location_tolerance).astype(np.int64),
+            np.round(top_circles['y'] / location_tolerance).astype(np.int64)
+        ], axis=1)
+        _, first_index, location_ids, frequencies = np.unique(
+            location_keys, axis=0, return_index=True, return_inverse=True, return_counts=True
+        )
+        location_ids = location_ids.reshape(-1)
         
-        if frequency >= min_appearances:
-            # Calculate average circle parameters for this location
-            avg_x = np.mean([c[0][0] for c in circles_at_location])
-            avg_y = np.mean([c[0][1] for c in circles_at_location])
-            avg_radius = np.mean([c[0][2] for c in circles_at_location])
-            avg_score = np.mean([c[2] for c in circles_at_location])
-            
-            consensus_circle = [avg_x, avg_y, avg_radius]
-            consensus_circles.append((consensus_circle, frequency, avg_score))
+        # Members of each location are contiguous after a stable sort, in detection order
+        members = top_circles[np.argsort(location_ids, kind='stable')]
+        location_starts = np.cumsum(frequencies) - frequencies
+        
+        # Count frequencies and find consensus circles, in the order the locations were first seen
+        for location_id in np.argsort(first_index, kind='stable'):
+            frequency = int(frequencies[location_id])
             
-            Utils.log_info(f"Consensus circle at ({avg_x:.1f}, {avg_y:.1f}) appeared {frequency}/{len(top_results)} times in top combinations")
+            if frequency >= min_appearances:
+                # Calculate average circle parameters for this location
+                circles_at_location = members[location_starts[location_id]:location_starts[location_id] + frequency]
+                avg_x = np.mean(circles_at_location['x'])
+                avg_y = np.mean(circles_at_location['y'])
+                avg_radius = np.mean(circles_at_location['r'])
+                avg_score = np.mean(circles_at_location['score'])
+                
+                consensus_circles.append(([avg_x, avg_y, avg_radius], frequency, avg_score))
+                
+                Utils.log_info(f"Consensus circle at ({avg_x:.1f}, {avg_y:.1f}) appeared {frequency}/{len(top_combos)} times in top combinations")
     
     # Check which consensus circles are missing from best result
-    enhanced_circles = list(best_circles) if best_circles is not None else []
-    
-    for consensus_circle, frequency, avg_score in consensus_circles:
-        # Check if this consensus circle is already represented in best_circles
-        is_already_present = False
-        
-        for existing_circle in enhanced_circles:
-            distance = np.sqrt((consensus_circle[0] - existing_circle[0])**2 + 
-                             (consensus_circle[1] - existing_circle[1])**2)
-            if distance <= location_tolerance:
-                is_already_present = True
-                break
+    best_array = np.asarray(best_circles if best_circles is not None else [], dtype=np.float32).reshape(-1, 3)
+    if len(consensus_circles) == 0:
+        return best_array
+    
+    consensus_array = np.array([circle for circle, _, _ in consensus_circles], dtype=np.float32)
+    centers = np.concatenate([best_array[:, :2], consensus_array[:, :2]])
+    best_count = len(best_array)
+    
+    spatial_index = CircleSpatialIndex(centers, cell_size=location_tolerance)
+    pairs_i, pairs_j = spatial_index.candidate_pairs(location_tolerance)
+    distances = np.sqrt((centers[pairs_j, 0] - centers[pairs_i, 0])**2 + (centers[pairs_j, 1] - centers[pairs_i, 1])**2)
+    # pairs_j is the later circle of each pair, so this keeps the pairs that involve a consensus circle
+    close = (distances <= location_tolerance) & (pairs_j >= best_count)
+    pairs_i, pairs_j = pairs_i[close], pairs_j[close]
+
+    near_best = np.zeros(len(consensus_array), dtype=bool)
+    near_best[pairs_j[pairs_i < best_count] - best_count] = True
+    earlier_consensus = {}
+    for earlier, later in zip((pairs_i[pairs_i >= best_count] - best_count).tolist(),
+                              (pairs_j[pairs_i >= best_count] - best_count).tolist()):
+        earlier_consensus.setdefault(later, []).append(earlier)
+    
+    # A recovered circle also counts as present for the consensus circles after it
+    added = np.zeros(len(consensus_array), dtype=bool)
+    for index, (consensus_circle, frequency, avg_score) in enumerate(consensus_circles):
+        if near_best[index] or any(added[earlier] for earlier in earlier_consensus.get(index, [])):
+            continue
         
-        if not is_already_present:
-            enhanced_circles.append(consensus_circle)
-            Utils.log_info(f"Added consensus circle at ({consensus_circle[0]:.1f}, {consensus_circle[1]:.1f}) "
-                          f"(appeared {frequency}/{len(top_results)} times in top combinations, avg_score: {avg_score:.3f})")
+        added[index] = True
+        Utils.log_info(f"Added consensus circle at ({consensus_circle[0]:.1f}, {consensus_circle[1]:.1f}) "
+                      f"(appeared {frequency}/{len(top_combos)} times in top combinations, avg_score: {avg_score:.3f})")
     
-    return enhanced_circles
+    return np.concatenate([best_array, consensus_array[added]])
+
+def post_filter_circles(circles, img_shape, max_outside_ratio=0.4, tolerance_factor=0.5, overlap_threshold=0.5):
+    """
+    Run bounds filtering, grid outlier removal and overlap removal over the consensus circles.
+
+    The circles are packed into one (N, 3) float32 array and indexed once with a
+    CircleSpatialIndex. Each filter narrows a shared keep mask, so the original order of the
+    circles is preserved and no filter rebuilds Python lists.
+
+    Args:
+        circles: List or array of circles [x, y, radius]
+        img_shape: Shape of the image (height, width)
+        max_outside_ratio: See filter_circles_by_bounds
+        tolerance_factor: See remove_grid_outliers
+        overlap_threshold: See remove_overlapping_circles
+
+    Returns:
+        (M, 3) float32 array with the circles that passed every filter
+    """
+    circles_array = np.asarray(circles, dtype=np.float32).reshape(-1, 3)
+    if len(circles_array) == 0:
+        return circles_array
+
+    # Filters work in double precision, like the float() conversions they replaced
+    values = circles_array.astype(np.float64)
+    spatial_index = CircleSpatialIndex(values[:, :2], cell_size=np.mean(values[:, 2]) * 4)
+
+    # Filter circles by bounds before grid outlier removal
+    Utils.log_info(f"🔍 Filtering circles by image bounds...")
+    keep = filter_circles_by_bounds(values, img_shape, max_outside_ratio=max_outside_ratio)
+    bounds_count = int(np.count_nonzero(keep))
 
-def remove_grid_outliers(circles, tolerance_factor=0.5):
+    # Remove grid outliers after bounds filtering
+    Utils.log_info(f"🧹 Removing grid outliers...")
+    keep = remove_grid_outliers(values, spatial_index, keep, tolerance_factor=tolerance_factor)
+    grid_count = int(np.count_nonzero(keep))
+
+    # Remove overlapping circles after grid outlier removal
+    Utils.log_info(f"🔄 Removing overlapping circles...")
+    keep = remove_overlapping_circles(values, spatial_index, keep, overlap_threshold=overlap_threshold)
+
+    filtered_circles = circles_array[keep]
+    Utils.log_info(f"Post-filtering: {len(circles_array)} → {bounds_count} (bounds) → {grid_count} (grid outliers) "
+                  f"→ {len(filtered_circles)} (overlaps) circles")
+
+    return filtered_circles
+
+
+def remove_grid_outliers(circles, spatial_index, keep, tolerance_factor=0.5):
     """
     Remove circles that don't fit into a proper grid pattern.
     Filters out circles that are not aligned with the majority of rows and columns.
     
     Args:
-        circles: List of circles [x, y, radius]
+        circles: (N, 3) array of circles [x, y, radius]
+        spatial_index: CircleSpatialIndex over the circle centers
+        keep: Boolean mask of the circles still in play
         tolerance_factor: Factor to determine alignment tolerance (0.5 = half of average radius)
     
     Returns:
-        Filtered list of circles that form a proper grid
+        Updated keep mask without the circles that don't form a proper grid
     """
-    if len(circles) < 4:  # Need at least 4 circles to form a grid
-        return circles
-    
-    # Convert to list of lists if needed (handle numpy arrays)
-    circles_list = []
-    for circle in circles:
-        if hasattr(circle, '__len__') and len(circle) >= 3:
-            circles_list.append([float(circle[0]), float(circle[1]), float(circle[2])])
-        else:
-            circles_list.append(circle)
-    circles = circles_list
+    active = np.flatnonzero(keep)
+    if len(active) < 4:  # Need at least 4 circles to form a grid
+        return keep
     
     # Calculate average radius for tolerance
-    avg_radius = np.mean([c[2] for c in circles])
+    avg_radius = np.mean(circles[active, 2])
     row_tolerance = avg_radius * tolerance_factor
     col_tolerance = avg_radius * tolerance_factor
     
-    Utils.log_info(f"Grid outlier removal: Starting with {len(circles)} circles, tolerance: {row_tolerance:.1f}px")
-    
-    # Group circles into rows (similar Y coordinates)
-    sorted_by_y = sorted(circles, key=lambda c: c[1])
-    rows = []
-    
-    for circle in sorted_by_y:
-        placed = False
-        for row in rows:
-            # Check if this circle belongs to an existing row
-            if abs(circle[1] - row[0][1]) <= row_tolerance:
-                row.append(circle)
-                placed = True
-                break
-        if not placed:
-            rows.append([circle])
+    Utils.log_info(f"Grid outlier removal: Starting with {len(active)} circles, tolerance: {row_tolerance:.1f}px")
     
-    # Group circles into columns (similar X coordinates)
-    sorted_by_x = sorted(circles, key=lambda c: c[0])
-    cols = []
-    
-    for circle in sorted_by_x:
-        placed = False
-        for col in cols:
-            # Check if this circle belongs to an existing column
-            if abs(circle[0] - col[0][0]) <= col_tolerance:
-                col.append(circle)
-                placed = True
-                break
-        if not placed:
-            cols.append([circle])
+    # Group circles into rows (similar Y coordinates) and columns (similar X coordinates)
+    ys = circles[active, 1]
+    xs = circles[active, 0]
+    rows = group_sorted_values(ys[np.argsort(ys, kind='stable')], row_tolerance)
+    cols = group_sorted_values(xs[np.argsort(xs, kind='stable')], col_tolerance)
     
     Utils.log_info(f"Grid analysis: Found {len(rows)} rows and {len(cols)} columns")
     
@@ -639,12 +1013,9 @@ def remove_grid_outliers(circles, tolerance_factor=0.5):
     # - Multiple choice A,B,C,D: 4 circles per row  
     # - Multiple choice A,B,C,D,E: 5 circles per row
     # - Student ID: 10 circles per row
-    valid_rows = rows  # Keep all rows
-    valid_cols = cols  # Keep all columns
-    
-    # Log the variety of row and column sizes found
-    row_sizes = [len(row) for row in rows]
-    col_sizes = [len(col) for col in cols]
+    # Every circle belongs to some row, so no circle is dropped for its row or column
+    row_sizes = [end - start for start, end in rows]
+    col_sizes = [end - start for start, end in cols]
     
     if row_sizes:
         unique_row_sizes = sorted(set(row_sizes))
@@ -654,247 +1025,221 @@ def remove_grid_outliers(circles, tolerance_factor=0.5):
         unique_col_sizes = sorted(set(col_sizes))
         Utils.log_info(f"Column sizes found: {unique_col_sizes} (keeping all)")
     
-    # Find circles that belong to either valid rows OR valid columns
-    valid_circles = []
-    
-    for circle in circles:
-        in_valid_row = False
-        in_valid_col = False
-        
-        # Check if circle is in a valid row
-        for row in valid_rows:
-            for r_circle in row:
-                if abs(circle[0] - r_circle[0]) < 1 and abs(circle[1] - r_circle[1]) < 1:
-                    in_valid_row = True
-                    break
-            if in_valid_row:
-                break
-        
-        # Check if circle is in a valid column
-        for col in valid_cols:
-            for c_circle in col:
-                if abs(circle[0] - c_circle[0]) < 1 and abs(circle[1] - c_circle[1]) < 1:
-                    in_valid_col = True
-                    break
-            if in_valid_col:
-                break
-        
-        # Keep circle if it's in either a valid row OR a valid column
-        if in_valid_row or in_valid_col:
-            valid_circles.append(circle)
-        else:
-            Utils.log_info(f"Removing outlier circle at ({circle[0]:.1f}, {circle[1]:.1f}) - "
-                          f"not in any valid row or column")
-    
     # Additional check: Remove isolated circles (circles with no nearby neighbors)
     # For answer sheets, we need to be more lenient since grids can be sparse
-    final_circles = []
     min_neighbors = 1  # A circle should have at least 1 neighbor to be valid (reduced from 2)
     neighbor_distance = avg_radius * 4  # Search within 4 radii for neighbors (increased from 3)
     
-    for i, circle in enumerate(valid_circles):
-        neighbor_count = 0
-        for j, other_circle in enumerate(valid_circles):
-            if i != j:  # Use index comparison instead of array comparison
-                distance = np.sqrt((circle[0] - other_circle[0])**2 + (circle[1] - other_circle[1])**2)
-                if distance <= neighbor_distance:
-                    neighbor_count += 1
-        
-        if neighbor_count >= min_neighbors:
-            final_circles.append(circle)
-        else:
-            Utils.log_info(f"Removing truly isolated circle at ({circle[0]:.1f}, {circle[1]:.1f}) - "
-                          f"only {neighbor_count} neighbors within {neighbor_distance:.1f}px (very likely a false detection)")
+    pairs_i, pairs_j = spatial_index.candidate_pairs(neighbor_distance, mask=keep)
+    distances = np.sqrt((circles[pairs_i, 0] - circles[pairs_j, 0])**2 + (circles[pairs_i, 1] - circles[pairs_j, 1])**2)
+    close = distances <= neighbor_distance
+    neighbor_counts = (
+        np.bincount(pairs_i[close], minlength=len(circles)) +
+        np.bincount(pairs_j[close], minlength=len(circles))
+    )
     
-    Utils.log_info(f"Grid outlier removal complete: {len(circles)} → {len(final_circles)} circles "
-                  f"({len(circles) - len(final_circles)} outliers removed)")
+    isolated = keep & (neighbor_counts < min_neighbors)
+    for index in np.flatnonzero(isolated):
+        Utils.log_info(f"Removing truly isolated circle at ({circles[index, 0]:.1f}, {circles[index, 1]:.1f}) - "
+                      f"only {neighbor_counts[index]} neighbors within {neighbor_distance:.1f}px (very likely a false detection)")
     
-    return final_circles
+    keep = keep & ~isolated
+    final_count = int(np.count_nonzero(keep))
+    Utils.log_info(f"Grid outlier removal complete: {len(active)} → {final_count} circles "
+                  f"({len(active) - final_count} outliers removed)")
+    
+    return keep
 
-def filter_circles_by_bounds(circles, img_shape, max_outside_ratio=0.9):
+def filter_circles_by_bounds(circles, img_shape, max_outside_ratio=0.9, keep=None):
     """
     Filter out circles that are more than max_outside_ratio (50%) outside the image bounds.
     
     Args:
-        circles: List of circles [x, y, radius]
+        circles: (N, 3) array of circles [x, y, radius]
         img_shape: Shape of the image (height, width)
         max_outside_ratio: Maximum ratio of circle area that can be outside bounds (0.5 = 50%)
+        keep: Optional boolean mask of the circles still in play
     
     Returns:
-        Filtered list of circles that are mostly within bounds
+        Boolean keep mask of the circles that are mostly within bounds
     """
-    if not circles:
-        return circles
+    if keep is None:
+        keep = np.ones(len(circles), dtype=bool)
+    if len(circles) == 0:
+        return keep
     
     img_height, img_width = img_shape[:2]
-    filtered_circles = []
-    
-    Utils.log_info(f"Bounds filtering: Image dimensions {img_width}x{img_height}, checking {len(circles)} circles")
-    
-    for circle in circles:
-        x, y, radius = float(circle[0]), float(circle[1]), float(circle[2])
-
-        
-        
-        # Calculate how much of the circle is outside each boundary
-        left_outside = max(0, radius - x)  # How much extends past left edge
-        right_outside = max(0, (x + radius) - img_width)  # How much extends past right edge
-        top_outside = max(0, radius - y)  # How much extends past top edge
-        bottom_outside = max(0, (y + radius) - img_height)  # How much extends past bottom edge
-        
-        # Calculate the area of the circle that's inside the image bounds
-        # This is a simplified calculation - for exact calculation we'd need complex geometry
-        
-        # Check if circle center is inside bounds
-        center_inside = (0 <= x < img_width) and (0 <= y < img_height)
-        
-        # Calculate approximate inside ratio based on how much extends outside
-        total_circle_area = np.pi * radius * radius
-        
-        # Simple approximation: if circle extends outside by distance d, 
-        # approximate the outside area as a fraction based on the distance
-        outside_fraction = 0
-        
-        # If center is outside, most of circle is outside
-        if not center_inside:
-            outside_fraction = 0.8  # Assume 80% outside if center is outside
-        else:
-            # Calculate based on how much extends past each edge
-            edge_penalties = []
-            
-            if left_outside > 0:
-                edge_penalties.append(min(0.5, left_outside / radius))
-            if right_outside > 0:
-                edge_penalties.append(min(0.5, right_outside / radius))
-            if top_outside > 0:
-                edge_penalties.append(min(0.5, top_outside / radius))
-            if bottom_outside > 0:
-                edge_penalties.append(min(0.5, bottom_outside / radius))
-            
-            # Sum penalties but cap at 0.9 (90% outside)
-            outside_fraction = min(0.9, sum(edge_penalties))
-        Utils.log_info(f"Outside fraction: {outside_fraction} | circle: {circle} | img_shape: {img_shape}")
-        
-        inside_ratio = 1 - outside_fraction
-        
-        # Keep circle if more than (1 - max_outside_ratio) is inside bounds
-        threshold = 1 - max_outside_ratio
-        if inside_ratio >= threshold:
-            filtered_circles.append(circle)
-            if Utils.is_debug():
-                Utils.log_info(f"KEEPING circle at ({x:.1f}, {y:.1f}) radius {radius:.1f} - "
-                              f"{inside_ratio*100:.1f}% inside (threshold: {threshold*100:.1f}%)")
-        else:
-            Utils.log_info(f"REMOVING circle at ({x:.1f}, {y:.1f}) radius {radius:.1f} - "
-                          f"only {inside_ratio*100:.1f}% inside bounds (threshold: {threshold*100:.1f}%) "
-                          f"[left_out:{left_outside:.1f}, right_out:{right_outside:.1f}, top_out:{top_outside:.1f}, bottom_out:{bottom_outside:.1f}]")
-    
-    Utils.log_info(f"Bounds filtering: {len(circles)} → {len(filtered_circles)} circles "
-                  f"({len(circles) - len(filtered_circles)} circles removed for being >{max_outside_ratio*100:.0f}% outside bounds)")
-    
-    return filtered_circles
-
-def remove_overlapping_circles(circles, overlap_threshold=0.5):
+    x, y, radius = circles[:, 0], circles[:, 1], circles[:, 2]
+    
+    Utils.log_info(f"Bounds filtering: Image dimensions {img_width}x{img_height}, checking {int(np.count_nonzero(keep))} circles")
+    
+    # Calculate how much of the circle is outside each boundary
+    left_outside = np.maximum(0, radius - x)  # How much extends past left edge
+    right_outside = np.maximum(0, (x + radius) - img_width)  # How much extends past right edge
+    top_outside = np.maximum(0, radius - y)  # How much extends past top edge
+    bottom_outside = np.maximum(0, (y + radius) - img_height)  # How much extends past bottom edge
+    
+    # Check if circle center is inside bounds
+    center_inside = (0 <= x) & (x < img_width) & (0 <= y) & (y < img_height)
+    
+    # Simple approximation: each edge the circle extends past adds a penalty based on the
+    # distance, capped at 50% per edge and 90% overall.
+    # If center is outside, most of circle is outside: assume 80% outside
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge_penalties = 0
+        for edge_outside in (left_outside, right_outside, top_outside, bottom_outside):
+            edge_penalties = edge_penalties + np.where(edge_outside > 0, np.minimum(0.5, edge_outside / radius), 0)
+    outside_fraction = np.where(center_inside, np.minimum(0.9, edge_penalties), 0.8)
+    
+    inside_ratio = 1 - outside_fraction
+    
+    # Keep circle if more than (1 - max_outside_ratio) is inside bounds
+    threshold = 1 - max_outside_ratio
+    removed = keep & ~(inside_ratio >= threshold)
+    for index in np.flatnonzero(removed):
+        Utils.log_info(f"REMOVING circle at ({x[index]:.1f}, {y[index]:.1f}) radius {radius[index]:.1f} - "
+                      f"only {inside_ratio[index]*100:.1f}% inside bounds (threshold: {threshold*100:.1f}%) "
+                      f"[left_out:{left_outside[index]:.1f}, right_out:{right_outside[index]:.1f}, top_out:{top_outside[index]:.1f}, bottom_out:{bottom_outside[index]:.1f}]")
+    
+    checked_count = int(np.count_nonzero(keep))
+    keep = keep & ~removed
+    Utils.log_info(f"Bounds filtering: {checked_count} → {int(np.count_nonzero(keep))} circles "
+                  f"({int(np.count_nonzero(removed))} circles removed for being >{max_outside_ratio*100:.0f}% outside bounds)")
+    
+    return keep
+
+def remove_overlapping_circles(circles, spatial_index, keep, overlap_threshold=0.5):
     """
     Remove overlapping circles, keeping only one when multiple circles overlap.
     
     Args:
-        circles: List of circles [x, y, radius]
+        circles: (N, 3) array of circles [x, y, radius]
+        spatial_index: CircleSpatialIndex over the circle centers
+        keep: Boolean mask of the circles still in play
         overlap_threshold: Minimum overlap ratio to consider circles as overlapping (0.5 = 50%)
     
     Returns:
-        Filtered list of circles with overlaps removed
+        Updated keep mask with overlaps removed
     """
-    if len(circles) <= 1:
-        return circles
-    
-    # Convert to list of lists if needed (handle numpy arrays)
-    circles_list = []
-    for circle in circles:
-        if hasattr(circle, '__len__') and len(circle) >= 3:
-            circles_list.append([float(circle[0]), float(circle[1]), float(circle[2])])
-        else:
-            circles_list.append(circle)
-    circles = circles_list
-    
-    Utils.log_info(f"Overlap removal: Starting with {len(circles)} circles, threshold: {overlap_threshold*100:.0f}%")
-    
-    # Sort circles by some criteria to decide which one to keep when overlapping
-    # We'll keep the circle with larger radius, or if radii are similar, the one with lower index
-    circles_with_index = [(i, circle) for i, circle in enumerate(circles)]
-    
-    filtered_circles = []
-    removed_indices = set()
-    
-    for i, (idx1, circle1) in enumerate(circles_with_index):
-        if idx1 in removed_indices:
+    active_count = int(np.count_nonzero(keep))
+    if active_count <= 1:
+        return keep
+    
+    Utils.log_info(f"Overlap removal: Starting with {active_count} circles, threshold: {overlap_threshold*100:.0f}%")
+    
+    # Two circles overlap if distance < sum of radii
+    # Overlap ratio = (r1 + r2 - distance) / min(2*r1, 2*r2)
+    max_radius = np.max(circles[keep, 2])
+    pairs_i, pairs_j = spatial_index.candidate_pairs(max_radius * 2, mask=keep)
+    x1, y1, r1 = circles[pairs_i, 0], circles[pairs_i, 1], circles[pairs_i, 2]
+    x2, y2, r2 = circles[pairs_j, 0], circles[pairs_j, 1], circles[pairs_j, 2]
+    distance = np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlap_ratio = ((r1 + r2) - distance) / (2 * np.minimum(r1, r2))
+    significant = (distance < (r1 + r2)) & (overlap_ratio >= overlap_threshold)
+    
+    pairs_i, pairs_j, overlap_ratio = pairs_i[significant], pairs_j[significant], overlap_ratio[significant]
+    
+    # Walk the circles in order, like the pairwise scan: an earlier circle that is still kept
+    # removes every later overlapping circle until one is significantly larger, which removes it
+    keep = keep.copy()
+    group_starts = np.flatnonzero(np.r_[True, pairs_i[1:] != pairs_i[:-1]]) if len(pairs_i) > 0 else []
+    group_ends = list(group_starts[1:]) + [len(pairs_i)]
+    
+    for start, end in zip(group_starts, group_ends):
+        idx1 = pairs_i[start]
+        if not keep[idx1]:
             continue
-            
-        x1, y1, r1 = circle1[0], circle1[1], circle1[2]
-        keep_circle1 = True
+        cx1, cy1, cr1 = circles[idx1]
         
-        for j, (idx2, circle2) in enumerate(circles_with_index[i+1:], i+1):
-            if idx2 in removed_indices:
+        for pair in range(start, end):
+            idx2 = pairs_j[pair]
+            if not keep[idx2]:
                 continue
-                
-            x2, y2, r2 = circle2[0], circle2[1], circle2[2]
-            
-            # Calculate distance between centers
-            distance = np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
+            cx2, cy2, cr2 = circles[idx2]
             
-            # Calculate overlap
-            # Two circles overlap if distance < sum of radii
-            # Overlap ratio = (r1 + r2 - distance) / min(2*r1, 2*r2)
-            if distance < (r1 + r2):
-                # Calculate overlap area ratio (simplified)
-                overlap_distance = (r1 + r2) - distance
-                smaller_diameter = 2 * min(r1, r2)
-                overlap_ratio = overlap_distance / smaller_diameter
-                
-                if overlap_ratio >= overlap_threshold:
-                    # Circles are overlapping significantly
-                    # Decide which one to keep based on radius (keep larger) or index (keep first)
-                    if r2 > r1 * 1.1:  # Keep circle2 if significantly larger
-                        Utils.log_info(f"Removing circle at ({x1:.1f}, {y1:.1f}) radius {r1:.1f} - "
-                                      f"overlaps {overlap_ratio*100:.1f}% with larger circle at ({x2:.1f}, {y2:.1f}) radius {r2:.1f}")
-                        keep_circle1 = False
-                        removed_indices.add(idx1)
-                        break
-                    else:  # Keep circle1 (current one)
-                        Utils.log_info(f"Removing circle at ({x2:.1f}, {y2:.1f}) radius {r2:.1f} - "
-                                      f"overlaps {overlap_ratio*100:.1f}% with circle at ({x1:.1f}, {y1:.1f}) radius {r1:.1f}")
-                        removed_indices.add(idx2)
-        
-        if keep_circle1:
-            filtered_circles.append(circle1)
+            # Decide which one to keep based on radius (keep larger) or index (keep first)
+            if cr2 > cr1 * 1.1:  # Keep circle2 if significantly larger
+                Utils.log_info(f"Removing circle at ({cx1:.1f}, {cy1:.1f}) radius {cr1:.1f} - "
+                              f"overlaps {overlap_ratio[pair]*100:.1f}% with larger circle at ({cx2:.1f}, {cy2:.1f}) radius {cr2:.1f}")
+                keep[idx1] = False
+                break
+            else:  # Keep circle1 (current one)
+                Utils.log_info(f"Removing circle at ({cx2:.1f}, {cy2:.1f}) radius {cr2:.1f} - "
+                              f"overlaps {overlap_ratio[pair]*100:.1f}% with circle at ({cx1:.1f}, {cy1:.1f}) radius {cr1:.1f}")
+                keep[idx2] = False
     
-    Utils.log_info(f"Overlap removal complete: {len(circles)} → {len(filtered_circles)} circles "
-                  f"({len(circles) - len(filtered_circles)} overlapping circles removed)")
+    final_count = int(np.count_nonzero(keep))
+    Utils.log_info(f"Overlap removal complete: {active_count} → {final_count} circles "
+                  f"({active_count - final_count} overlapping circles removed)")
     
-    return filtered_circles
+    return keep
+
+
+def group_matricula_rows(output_circles, circle_size):
+    """
+    Group output circles into rows for the MATRICULA filter.
+
+    A circle joins the first row whose first circle is close enough by distance_between_points,
+    otherwise it starts a new row. Nearby row starters are looked up with a CircleSpatialIndex
+    instead of testing every row.
 
-async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, darkness_threshold=180/255, img=None, on_progress=None, circle_size=None, circle_precision_percentage=1, rectangle_info=None):
+    Returns:
+        List of rows, each a list of the circles' dicts, in the order the rows were started
+    """
+    if len(output_circles) == 0:
+        return []
+
+    centers = np.array([[circle["center_x"], circle["center_y"]] for circle in output_circles], dtype=np.float64)
+    max_distance = circle_size * 1.5
+
+    # distance_between_points is half the squared distance
+    reach = math.sqrt(max(max_distance, 0) * 2)
+    spatial_index = CircleSpatialIndex(centers, cell_size=max(reach, 1))
+    pairs_i, pairs_j = spatial_index.candidate_pairs(reach)
+    close = (
+        ((centers[pairs_j, 0] - centers[pairs_i, 0])**2 + (centers[pairs_j, 1] - centers[pairs_i, 1])**2) / 2
+    ) < max_distance
+
+    # Earlier close circles of each circle, in ascending order
+    earlier_neighbors = {}
+    for earlier, later in zip(pairs_i[close].tolist(), pairs_j[close].tolist()):
+        earlier_neighbors.setdefault(later, []).append(earlier)
+
+    rows = []
+    row_of_starter = {}  # index of the circle that started a row -> row number
+    for index, circle in enumerate(output_circles):
+        # Row starters are created in circle order, so the first starter nearby is the first matching row
+        row_number = next(
+            (row_of_starter[earlier] for earlier in earlier_neighbors.get(index, []) if earlier in row_of_starter),
+            None
+        )
+        if row_number is None:
+            row_of_starter[index] = len(rows)
+            rows.append([circle])
+        else:
+            rows[row_number].append(circle)
+
+    return rows
+
+async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, darkness_threshold=180/255, img=None, on_progress=None, circle_size=None, circle_precision_percentage=1, rectangle_info=None, search_mode=HoughSearchMode.GRID, page=None):
     # Load the image
     Utils.log_info(f"Got circle size: {circle_size}")
 
-    if img is None:
-        img = cv2.imread(image_path)
+    params_cache_key = HoughParamsCache.make_key(rectangle, rectangle_type, circle_size)
 
-    # make image 4000 width
-    image_new_width = 4000
-    width_ratio = image_new_width / img.shape[1]
-    img = cv2.resize(img, fx=width_ratio, fy=width_ratio, dsize=(0, 0))
+    # The page is scaled so the bubbles land on the target radius, boxes of the same page share it
+    if page is None:
+        if img is None:
+            img = cv2.imread(image_path)
+        page = PagePreprocessor(img)
 
-    old_x, old_y, width, height = rectangle.values()
-    
-    if old_x > 1 or old_y > 1 or width > 1 or height > 1 or old_x < 0 or old_y < 0 or width < 0 or height < 0:
-        raise ValueError("The rectangle values must be between 0 and 1.")
+    scaled_page = page.scaled(circle_size)
+    img = scaled_page.image
+    width_ratio = scaled_page.width_ratio
 
     # transform to absolute
-    x = int(old_x * img.shape[1])
-    y = int(old_y * img.shape[0])
-    width = int(width * img.shape[1])
-    height = int(height * img.shape[0])
+    x, y, width, height = scaled_page.rectangle_to_pixels(rectangle)
 
     if Utils.is_debug():
         # draw rectangle on image
@@ -902,10 +1247,11 @@ async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, da
         pass
 
     # crop image on rectangle
-    crop_img = img[y:y+height, x:x+width]
+    crop_img = scaled_page.crop(x, y, width, height)
 
-    # add some blur
-    crop_img = cv2.GaussianBlur(crop_img, (17, 17), 1.5)
+    # add some blur, sized for the 4000 width the blur was tuned at
+    blur_size = scaled_page.kernel_size(17)
+    crop_img = cv2.GaussianBlur(crop_img, (blur_size, blur_size), 1.5 * scaled_page.scale)
 
     # Convert cropped image to gray scale
     gray = cv2.cvtColor(crop_img, cv2.COLOR_BGR2GRAY)
@@ -919,7 +1265,11 @@ async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, da
     min_radius = 30
     max_radius = 33
 
+    # row grouping tolerance of the MATRICULA filter, in pixels of the 4000 width it was tuned at
+    row_circle_size = None
+
     if circle_size is not None:
+        row_circle_size = circle_size * PagePreprocessor.REFERENCE_WIDTH
         # circle size is a percentage of width of the image
         circle_size = circle_size * img.shape[1]
         min_radius = int(circle_size * 1)
@@ -962,7 +1312,10 @@ async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, da
         expected_count=expected_count,
         circle_precision_percentage=circle_precision_percentage,
         on_progress=on_progress,
-        rectangle_info=rectangle_info
+        rectangle_info=rectangle_info,
+        search_mode=search_mode,
+        cache_key=params_cache_key,
+        pixel_scale=scaled_page.scale
     )
     
     Utils.log_info(f"Iterative Hough circles result - Score: {best_score:.3f}, Circles found: {len(circles[0]) if circles is not None else 0}")
@@ -977,30 +1330,22 @@ async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, da
 
     output_circles = []
 
-    for i in circles[0, :]:
+    # check which circles are filled (black), all at once before any debug drawing
+    filled_circles, fill_ratios = classify_circles_fill(crop_img, circles[0].astype(int), darkness_threshold)
+
+    for i, filled, fill_ratio in zip(circles[0, :], filled_circles.tolist(), fill_ratios.tolist()):
         i = i.astype(int)
-        y_min = max(i[1] - i[2], 0)
-        x_min = max(i[0] - i[2], 0)
-        y_max = min(i[1] + i[2], crop_img.shape[0])
-        x_max = min(i[0] + i[2], crop_img.shape[1])
 
         try:
-            # clamp to prevent accessing negative indices
-            circle_cropped = crop_img[y_min:y_max, x_min:x_max]
-
-            # check if filled (black) circle
-            filled = False
-            if np.mean(circle_cropped) < darkness_threshold * 255:
-                filled = True
+            if filled:
                 if Utils.is_debug():
                     cv2.circle(crop_img, (i[0], i[1]), i[2], (255, 0, 0), 2)
             else:
-                filled = False
                 if Utils.is_debug():
                     cv2.circle(crop_img, (i[0], i[1]), i[2], (0, 255, 0), 2)
 
             if Utils.is_debug():
-                cv2.putText(crop_img, str(int(np.mean(circle_cropped))), (i[0], i[1]), 
+                cv2.putText(crop_img, str(int(round((1 - fill_ratio) * 255))), (i[0], i[1]), 
                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv2.LINE_AA)
                 cv2.circle(crop_img, (i[0], i[1]), 2, (0, 0, 255), 3)
 
@@ -1018,6 +1363,7 @@ async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, da
                 "center_y": float(i[1]),
                 "radius": float(i[2]),
                 "filled": filled,
+                "fill_ratio": fill_ratio,
                 "id": random.randbytes(10).hex()
             })
         except Exception as e:
@@ -1027,17 +1373,7 @@ async def find_circles_cv2(image_path, rectangle, rectangle_type, param2, dp, da
     if circle_size is not None and rectangle_type == BoxRectangleType.MATRICULA:
         # find all "rows"
         Utils.log_info(f"Finding rows...")
-        rows = []
-        for circle in output_circles:
-            found = False
-            for row in rows:
-                if distance_between_points((circle["center_x"], circle["center_y"]), 
-                                        (row[0]["center_x"], row[0]["center_y"])) < circle_size * 1.5:
-                    row.append(circle)
-                    found = True
-                    break
-            if not found:
-                rows.append([circle])
+        rows = group_matricula_rows(output_circles, row_circle_size)
 
         # sort rows by y
         rows = sorted(rows, key=lambda x: x[0]["center_y"])
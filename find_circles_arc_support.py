@@ -2,6 +2,7 @@ import random
 import cv2
 import numpy as np
 from sklearn.cluster import MeanShift
+from page_preprocessing import PagePreprocessor
 from utils import Utils, show_image
 
 def angle_diff(a, b):
@@ -161,24 +162,15 @@ async def find_circles_arc_support(image_path, rectangle, rectangle_type, darkne
     if img is None:
         img = cv2.imread(image_path)
 
-    # make image 4000 width
-    image_new_width = 4000
-    width_ratio = image_new_width / img.shape[1]
-    img = cv2.resize(img, fx=width_ratio, fy=width_ratio, dsize=(0, 0))
-
-    old_x, old_y, width, height = rectangle.values()
-    
-    if old_x > 1 or old_y > 1 or width > 1 or height > 1 or old_x < 0 or old_y < 0 or width < 0 or height < 0:
-        raise ValueError("The rectangle values must be between 0 and 1.")
+    # scale the page so the bubbles land on the target radius
+    scaled_page = PagePreprocessor(img).scaled(circle_size)
+    width_ratio = scaled_page.width_ratio
 
     # transform to absolute
-    x = int(old_x * img.shape[1])
-    y = int(old_y * img.shape[0])
-    width = int(width * img.shape[1])
-    height = int(height * img.shape[0])
+    x, y, width, height = scaled_page.rectangle_to_pixels(rectangle)
 
     # crop image on rectangle
-    crop_img = img[y:y+height, x:x+width]
+    crop_img = scaled_page.crop(x, y, width, height)
     
     if on_progress is not None:
         await on_progress("Computing gradients and edges...")
@@ -218,9 +210,9 @@ async def find_circles_arc_support(image_path, rectangle, rectangle_type, darkne
     if on_progress is not None:
         await on_progress("Clustering and refining circles...")
     
-    # Cluster and refine
-    clustered = cluster_circles(candidates)
-    final_circles = refine_circles(edges, clustered)
+    # Cluster and refine, the pixel sizes below were tuned at the 4000 width
+    clustered = cluster_circles(candidates, bandwidth=10 * scaled_page.scale)
+    final_circles = refine_circles(edges, clustered, min_inliers=max(1, int(round(30 * scaled_page.scale))))
     
     output_circles = []
     for center, radius in final_circles:
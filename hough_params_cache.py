@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from utils import Utils
+
+
+class HoughParamsCache:
+    """
+    LRU memo of the winning Hough parameters per box geometry, persisted to a JSON file.
+
+    Pages of the same exam layout share the same box rectangles and circle size, so the
+    parameters that won the sweep on one page are almost always the best for the next one.
+
+    Page pool processes share the file, so every save merges the entries other processes
+    saved since into the ones this process changed before replacing the file.
+    """
+
+    def __init__(self, path: str, max_entries: int = 512):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._changed = set()  # keys put since the last save
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def make_key(rectangle, rectangle_type, circle_size=None) -> str:
+        """
+        Build the cache key for a box.
+
+        Args:
+            rectangle: Box rectangle with relative x, y, width and height
+            rectangle_type: BoxRectangleType of the box
+            circle_size: Expected circle radius relative to the page width, None if unknown
+        """
+        rect = ",".join(f"{float(value):.3f}" for value in rectangle.values())
+        size = "none" if circle_size is None else f"{float(circle_size):.3f}"
+        return f"{rectangle_type}|{rect}|{size}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached {"params", "score"} entry for key and mark it as recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, params: Dict, score: float) -> None:
+        """Store the winning params and score for key, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = {"params": dict(params), "score": float(score)}
+            self._entries.move_to_end(key)
+            self._changed.add(key)
+            self._trim()
+            self._save()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_file(self) -> Dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _load(self) -> None:
+        try:
+            self._entries.update(self._read_file())
+            self._trim()
+            if len(self._entries) > 0:
+                Utils.log_info(f"Loaded {len(self._entries)} cached Hough parameter entries from {self.path}")
+        except Exception as e:
+            Utils.log_error(f"Could not load Hough parameter cache {self.path}: {e}")
+            self._entries.clear()
+
+    def _save(self) -> None:
+        try:
+            saved = self._read_file()
+        except Exception as e:
+            Utils.log_error(f"Could not read Hough parameter cache {self.path} before saving: {e}")
+            saved = dict(self._entries)
+
+        # Entries saved by other processes, then the ones changed here as most recently used
+        merged: "OrderedDict[str, Dict]" = OrderedDict(saved)
+        for key in self._changed:
+            if key in self._entries:
+                merged[key] = self._entries[key]
+                merged.move_to_end(key)
+        self._entries = merged
+        self._trim()
+
+        # Write to a temporary file first so a crash or another process never sees a truncated
+        # cache, one per process since the page pool processes share the cache file
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(temp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+            self._changed.clear()
+        except Exception as e:
+            Utils.log_error(f"Could not save Hough parameter cache {self.path}: {e}")
@@ -5,16 +5,18 @@ from pdf2image import convert_from_path
 from utils import Utils
 
 
-def auto_crop_document(img, padding_percent=0.005):
+def auto_crop_document(img, padding_percent=0.005, return_box=False):
     """
     Automatically crop a scanned document to remove empty white spaces.
     
     Args:
         img: PIL Image or OpenCV image
         padding_percent: Percentage of padding to add around detected content (0.02 = 2%)
+        return_box: Also return the crop box
     
     Returns:
-        Cropped PIL Image
+        Cropped PIL Image, or a tuple of (image, (x, y, width, height)) with return_box. The
+        box is None when the image was not cropped
     """
     # Convert PIL Image to OpenCV format if needed
     if isinstance(img, Image.Image):
@@ -53,7 +55,7 @@ def auto_crop_document(img, padding_percent=0.005):
     
     if not contours:
         Utils.log_info("No contours found, returning original image")
-        return original_pil
+        return (original_pil, None) if return_box else original_pil
     
     # Show contours
     contour_img = cv_img.copy()
@@ -113,7 +115,7 @@ def auto_crop_document(img, padding_percent=0.005):
     
     if w < min_width or h < min_height:
         Utils.log_info("Detected crop area too small, returning original image")
-        return original_pil
+        return (original_pil, None) if return_box else original_pil
     
     # Draw the final crop rectangle on the image
     debug_img = cv_img.copy()
@@ -133,6 +135,8 @@ def auto_crop_document(img, padding_percent=0.005):
     cropped_cv = cv2.cvtColor(np.array(cropped_pil), cv2.COLOR_RGB2BGR)
     ##show_image(cropped_cv, "9_final_cropped_result")
     
+    if return_box:
+        return cropped_pil, (x, y, w, h)
     return cropped_pil
 
 
@@ -252,10 +256,13 @@ def detect_contour_angle(img):
     return angle
 
 
-def normalize_image_brightness(img):
+def normalize_image_brightness(img, levels=None, return_levels=False):
     """
     Normalize image brightness using dynamic range stretching and gamma correction.
     Stretches the histogram to use the full 0-255 range, then applies gamma correction.
+
+    levels, a (min, max, gamma) tuple, is used instead of measuring them on img. With
+    return_levels a tuple of (image, levels) is returned.
     """
     # Convert PIL Image to OpenCV format if needed
     if isinstance(img, Image.Image):
@@ -274,13 +281,20 @@ def normalize_image_brightness(img):
     gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
     
     # Step 1: Dynamic Range Normalization - stretch histogram to use full 0-255 range
-    min_val = np.min(gray)
-    max_val = np.max(gray)
+    if levels is not None:
+        min_val, max_val, gamma = levels
+    else:
+        min_val = np.min(gray)
+        max_val = np.max(gray)
     
     if max_val > min_val:  # Avoid division by zero
         # Apply to all channels
         for i in range(3):
-            cv_img[:, :, i] = ((cv_img[:, :, i] - min_val) / (max_val - min_val) * 255).astype(np.uint8)
+            if levels is not None:
+                # Given levels may not cover every pixel, out of range values are clipped, not wrapped
+                cv_img[:, :, i] = ((cv_img[:, :, i].astype(np.int16) - min_val) / (max_val - min_val) * 255).clip(0, 255).astype(np.uint8)
+            else:
+                cv_img[:, :, i] = ((cv_img[:, :, i] - min_val) / (max_val - min_val) * 255).astype(np.uint8)
         
         if Utils.is_debug():
             ##show_image(cv_img, "1_range_stretched")
@@ -292,7 +306,9 @@ def normalize_image_brightness(img):
     # Adjust overall brightness based on image characteristics
     mean_brightness = np.mean(cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY))
     
-    if mean_brightness < 100:  # Too dark
+    if levels is not None:
+        Utils.log_info(f"Using given gamma: {gamma}")
+    elif mean_brightness < 100:  # Too dark
         gamma = 0.7  # Brighten
         Utils.log_info(f"Image too dark (mean: {mean_brightness:.1f}), applying gamma: {gamma}")
     elif mean_brightness > 180:  # Too bright  
@@ -321,14 +337,24 @@ def normalize_image_brightness(img):
     # Convert back to PIL if input was PIL
     if was_pil:
         result = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
-        return result
     else:
-        return cv_img
+        result = cv_img
+
+    if return_levels:
+        return result, (int(min_val), int(max_val), gamma)
+    return result
 
 
-def apply_calibration_to_image(img: Image, calibration_rect=None):
+def apply_calibration_to_image(img: Image, calibration_rect=None, return_geometry=False):
+    """
+    Normalize the brightness of a page, straighten it and crop it to the document.
+
+    With return_geometry a tuple of (image, geometry) is returned, geometry holds the brightness
+    "levels", the rotation "angle" and the "crop_box" found on this image, see
+    apply_calibration_geometry.
+    """
     # First, normalize brightness and contrast to handle varying lighting
-    normalized_img = normalize_image_brightness(img)
+    normalized_img, levels = normalize_image_brightness(img, return_levels=True)
     Utils.log_info("Applied brightness and contrast normalization")
     
     # Convert PIL Image to OpenCV format
@@ -367,10 +393,44 @@ def apply_calibration_to_image(img: Image, calibration_rect=None):
     rotated_pil = Image.fromarray(cv2.cvtColor(rotated, cv2.COLOR_BGR2RGB))
     
     # Now, auto-crop the rotated image to remove empty spaces
-    cropped_img = auto_crop_document(rotated_pil)
+    cropped_img, crop_box = auto_crop_document(rotated_pil, return_box=True)
     
+    if return_geometry:
+        return cropped_img, {"levels": levels, "angle": angle, "crop_box": crop_box}
     return cropped_img
 
+def apply_calibration_geometry(img: Image, geometry, scale: float):
+    """
+    Calibrate a higher resolution copy of a page with the geometry found on the smaller one.
+
+    The brightness levels, the rotation and the crop box measured on the smaller page are
+    reused, the crop box scaled by the ratio of the two widths, so both results show the same
+    area of the page in the same tones.
+
+    Args:
+        img: PIL Image of the page
+        geometry: Geometry returned by apply_calibration_to_image(return_geometry=True)
+        scale: Width of img divided by the width of the page the geometry was found on
+
+    Returns:
+        Calibrated OpenCV (BGR) image
+    """
+    normalized_img = normalize_image_brightness(img, levels=geometry["levels"])
+    cv_img = cv2.cvtColor(np.array(normalized_img), cv2.COLOR_RGB2BGR)
+
+    height, width = cv_img.shape[:2]
+    M = cv2.getRotationMatrix2D((width // 2, height // 2), geometry["angle"], 1.0)
+    rotated = cv2.warpAffine(cv_img, M, (width, height),
+                             flags=cv2.INTER_CUBIC,
+                             borderMode=cv2.BORDER_CONSTANT,
+                             borderValue=(255, 255, 255))
+
+    if geometry["crop_box"] is None:
+        return rotated
+
+    x, y, w, h = (int(round(value * scale)) for value in geometry["crop_box"])
+    return rotated[y:min(height, y + h), x:min(width, x + w)].copy()
+
 def show_image(image, text="image"):
     cv2.imshow(text, image)
     while True:
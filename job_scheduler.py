@@ -0,0 +1,172 @@
+import asyncio
+import re
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List
+from PIL import Image
+from page_preprocessing import PagePreprocessor
+from transfer_buffer import BufferReader
+from utils import Utils
+from websocket_types import WebsocketMessageCommand
+
+# Working copies alive per page while it is detected: the page, its scaled copy, the blurred
+# box, grayscale and thresholded images of the sweep
+PAGE_MEMORY_FACTOR = 4
+# pdf2image renders at 200 dpi, an A4 page is about 1654 x 2339 RGB pixels
+PDF_PAGE_BYTES = 1654 * 2339 * 3
+PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page[^s]")
+
+
+def estimate_pdf_pages(file: bytes) -> int:
+    """
+    Count the page objects of a PDF without parsing it, at least 1. Pages inside compressed
+    object streams are not seen, so the count can be low.
+    """
+    return max(1, len(PDF_PAGE_PATTERN.findall(file)))
+
+
+def estimate_page_memory(file: bytes) -> int:
+    """Estimate the bytes a page needs while its circles are detected, from its image header."""
+    try:
+        with Image.open(BufferReader(file)) as image:
+            width, height = image.size
+    except Exception:
+        return len(file) * PAGE_MEMORY_FACTOR
+
+    scaled_width = PagePreprocessor.REFERENCE_WIDTH
+    scaled_height = height * scaled_width / max(width, 1)
+    return int((width * height + scaled_width * scaled_height) * 3 * PAGE_MEMORY_FACTOR)
+
+
+def estimate_job_memory(job, files: List[bytes], concurrent_pages: int = 1) -> int:
+    """
+    Estimate the peak memory of a job from its files.
+
+    Args:
+        job: Job with its command
+        files: Files of the job
+        concurrent_pages: Pages of a find circles job that are detected at the same time
+    """
+    if len(files) == 0:
+        return 0
+
+    if job.get("command") == WebsocketMessageCommand.READ_TO_IMAGES:
+        # Every page of a PDF is rendered before any of them is processed
+        pages = sum(estimate_pdf_pages(file) for file in files)
+        return pages * PDF_PAGE_BYTES * 2
+
+    page_estimates = sorted((estimate_page_memory(file) for file in files), reverse=True)
+    return sum(page_estimates[:max(1, concurrent_pages)])
+
+
+class JobScheduler:
+    """
+    Admission control for the jobs of a worker.
+
+    A job runs once it gets one of max_slots compute slots and its estimated memory fits in
+    what the running jobs left of memory_budget. Jobs that don't fit wait in arrival order. A
+    job larger than the whole budget still runs, alone, so it can't wait forever.
+    """
+
+    def __init__(self, max_slots: int, memory_budget: int):
+        """
+        Args:
+            max_slots: Jobs allowed to run at the same time
+            memory_budget: Bytes the running jobs may reserve together
+        """
+        self.max_slots = max(1, max_slots)
+        self.memory_budget = memory_budget
+        self._running: Dict[str, int] = {}  # task id -> reserved bytes
+        self._waiting = deque()  # (task id, estimated bytes, future)
+        self._listeners = []
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def reserved_memory(self) -> int:
+        return sum(self._running.values())
+
+    def load(self) -> Dict[str, int]:
+        """Current load of the worker, reported to the relay."""
+        return {
+            "running_jobs": self.running,
+            "queued_jobs": self.queued,
+            "slots": self.max_slots,
+            "reserved_memory": self.reserved_memory,
+            "memory_budget": self.memory_budget
+        }
+
+    def add_listener(self, listener) -> None:
+        """Call the async listener(load) every time a job is queued, admitted or finished."""
+        self._listeners.append(listener)
+
+    def position(self, task_id: str) -> int:
+        """Number of jobs queued before task_id, -1 if it is not waiting."""
+        for index, (waiting_id, _, _) in enumerate(self._waiting):
+            if waiting_id == task_id:
+                return index
+        return -1
+
+    @asynccontextmanager
+    async def slot(self, task_id: str, estimated_memory: int, on_queued=None):
+        """
+        Hold a compute slot for the duration of the block, waiting for one if needed.
+
+        Args:
+            task_id: Job the slot is for
+            estimated_memory: Bytes the job is expected to need
+            on_queued: Async callback receiving the number of jobs ahead when the job has to wait
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((task_id, estimated_memory, future))
+        self._admit()
+
+        if not future.done():
+            Utils.log_info(f"Job {task_id} queued, {self.queued} waiting and {self.running} running")
+            await self._notify()
+            if on_queued is not None:
+                await on_queued(self.position(task_id))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._remove_waiting(task_id)
+            raise
+
+        await self._notify()
+        try:
+            yield
+        finally:
+            self._running.pop(task_id, None)
+            self._admit()
+            await self._notify()
+
+    def _admit(self) -> None:
+        while len(self._waiting) > 0 and self.running < self.max_slots:
+            task_id, estimated_memory, future = self._waiting[0]
+            if self.running > 0 and self.reserved_memory + estimated_memory > self.memory_budget:
+                break
+            self._waiting.popleft()
+            if future.done():
+                continue
+            self._running[task_id] = estimated_memory
+            future.set_result(None)
+
+    def _remove_waiting(self, task_id: str) -> None:
+        self._waiting = deque(entry for entry in self._waiting if entry[0] != task_id)
+        self._running.pop(task_id, None)
+        self._admit()
+
+    async def _notify(self) -> None:
+        load = self.load()
+        for listener in self._listeners:
+            try:
+                await listener(load)
+            except Exception as e:
+                Utils.log_error(f"Could not report worker load: {e}")
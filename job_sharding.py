@@ -0,0 +1,89 @@
+from typing import Dict, List, Optional, Tuple
+from config_loader import config
+from websocket_types import WebsocketMessageCommand
+
+# A sub-job, its data and its files
+Shard = Tuple[Dict, Dict[str, bytes]]
+
+
+def get_shard_count(pages: int, workers: int) -> int:
+    """
+    Number of sub-jobs a job of this many pages is split into, 1 to keep it whole.
+
+    Every sub-job gets at least JOB_SHARD_PAGES pages and no more sub-jobs are made than
+    there are workers to run them.
+    """
+    shard_pages = config.get_routing_config()['shard_pages']
+    if shard_pages <= 0 or pages < 2 * shard_pages:
+        return 1
+    return max(1, min(workers, pages // shard_pages))
+
+
+def shard_task_id(task_id: str, index: int) -> str:
+    return f"{task_id}.{index}"
+
+
+def split_evenly(count: int, parts: int) -> List[Tuple[int, int]]:
+    """Split range(count) into at most parts contiguous (start, end) ranges differing by at most 1 in size."""
+    parts = max(1, min(parts, count))
+    size, extra = divmod(count, parts)
+    ranges = []
+    start = 0
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def plan_shards(command: str, data: Dict, files: Dict[str, bytes], shard_count: int, pdf_pages: Optional[int] = None) -> List[Shard]:
+    """
+    Split a job into up to shard_count sub-jobs over contiguous pages, in page order.
+
+    Find circles jobs are split by their files. Read to images jobs of one PDF are split into
+    page ranges (first_page, last_page) over pdf_pages pages, every sub-job gets the whole
+    PDF. The last range is left open, so pages the estimate missed still go to it. Other
+    jobs are kept whole. Sub-jobs get the task id of the job with their index appended.
+    """
+    if shard_count <= 1:
+        return [(data, files)]
+
+    if command == WebsocketMessageCommand.FIND_CIRCLES and len(files) > 1:
+        file_ids = list(files)
+        return [
+            ({**data, "task_id": shard_task_id(data["task_id"], index)},
+             {file_id: files[file_id] for file_id in file_ids[start:end]})
+            for index, (start, end) in enumerate(split_evenly(len(file_ids), shard_count))
+        ]
+
+    if command == WebsocketMessageCommand.READ_TO_IMAGES and len(files) == 1 and pdf_pages and pdf_pages > 1:
+        ranges = split_evenly(pdf_pages, shard_count)
+        return [
+            ({**data, "task_id": shard_task_id(data["task_id"], index),
+              "first_page": start + 1, "last_page": end if index < len(ranges) - 1 else None}, files)
+            for index, (start, end) in enumerate(ranges)
+        ]
+
+    return [(data, files)]
+
+
+def merge_shard_responses(task_id: str, responses: List[Dict]) -> Dict:
+    """
+    Merge the responses of the sub-jobs of a job, in sub-job order.
+
+    Dicts (circles, image sizes) are merged and lists (images_ids) concatenated, so pages
+    keep their order. The files of all responses are merged the same way.
+    """
+    merged = {"data": {}, "files": {}}
+    for response in responses:
+        for key, value in response["data"].items():
+            if isinstance(value, dict):
+                merged["data"].setdefault(key, {}).update(value)
+            elif isinstance(value, list):
+                merged["data"].setdefault(key, []).extend(value)
+            else:
+                merged["data"][key] = value
+        merged["files"].update(response["files"])
+
+    merged["data"]["task_id"] = task_id
+    return merged
@@ -0,0 +1,89 @@
+import threading
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Tuple
+import numpy as np
+from utils import Utils
+
+
+class SharedArrayRef(NamedTuple):
+    """Picklable handle to an array in a shared memory segment, sent to pool processes instead of the data."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class JobSharedMemory:
+    """
+    Shared memory segments holding the page data of one job.
+
+    Arrays are copied into a segment once and pool processes attach to it by name, so handing
+    the same data to several processes does not copy it through the pool pipes or multiply it
+    in memory. Every segment is reference counted and unlinked when its last holder releases
+    it, close() unlinks whatever is left when the job finishes.
+    """
+
+    def __init__(self):
+        self._segments: Dict[str, List] = {}  # name -> [SharedMemory, reference count]
+        self._lock = threading.Lock()
+
+    def share(self, array) -> SharedArrayRef:
+        """Copy array into a new segment held once by the caller."""
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+
+        with self._lock:
+            self._segments[segment.name] = [segment, 1]
+
+        return SharedArrayRef(segment.name, array.shape, array.dtype.str)
+
+    def acquire(self, ref: SharedArrayRef) -> None:
+        """Add a holder to the segment of ref."""
+        with self._lock:
+            self._segments[ref.name][1] += 1
+
+    def release(self, ref: SharedArrayRef) -> None:
+        """Drop a holder of the segment of ref, unlinking it when it was the last one."""
+        with self._lock:
+            entry = self._segments.get(ref.name)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._segments[ref.name]
+
+        self._unlink(entry[0])
+
+    def close(self) -> None:
+        """Unlink every segment that is still held."""
+        with self._lock:
+            segments = [entry[0] for entry in self._segments.values()]
+            self._segments.clear()
+
+        for segment in segments:
+            self._unlink(segment)
+
+    def __len__(self):
+        return len(self._segments)
+
+    @staticmethod
+    def _unlink(segment) -> None:
+        try:
+            segment.close()
+            segment.unlink()
+        except Exception as e:
+            Utils.log_error(f"Could not release shared memory segment {segment.name}: {e}")
+
+
+def attach_shared_array(ref: SharedArrayRef):
+    """
+    Attach to a shared array without copying it.
+
+    Returns:
+        Tuple of (array, segment). The array is only valid while the segment is open, drop
+        every reference to it before calling segment.close()
+    """
+    segment = shared_memory.SharedMemory(name=ref.name)
+    array = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=segment.buf)
+    return array, segment
@@ -1,17 +1,24 @@
 import asyncio
 from contextlib import asynccontextmanager
-from typing import Dict, List
+from typing import Dict, List, Set, Tuple
 import cv2
 import numpy as np
 import traceback
 from PIL import Image
 import os
-from base64 import b64decode, b64encode
+from base64 import b64encode
 from find_circles import find_circles, find_circles_cv2, show_image
 from read_to_images import read_to_images
 from utils import Utils
 from fastapi.responses import HTMLResponse
 from websocket_types import WebsocketMessageCommand, WebsocketMessageStatus
+from content_store import content_hash
+from worker_affinity import WorkerAffinity
+from worker_selection import WorkerLatency, get_worker_policy
+from pending_jobs import PendingJobs
+from job_scheduler import estimate_pdf_pages
+from job_sharding import get_shard_count, merge_shard_responses, plan_shards
+from websocket_chunks import chunk_message, decode_chunk, encode_chunk, get_chunk_size, iter_chunks, parse_internal_subprotocol, receive_chunk
 import json
 import io
 from hypercorn.config import Config
@@ -19,7 +26,6 @@ from hypercorn.asyncio import serve
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from starlette.responses import JSONResponse
 from starlette.websockets import WebSocket,WebSocketDisconnect,WebSocketClose
-from queue import SimpleQueue
 import random
 from config_loader import config
 
@@ -28,23 +34,33 @@ from fastapi.middleware.cors import CORSMiddleware
 # Load HTTP configuration from environment
 HTTP_CONFIG = config.get_http_config()
 IS_DEV = HTTP_CONFIG['is_dev']
+JOB_DISTRIBUTION = config.get_routing_config()['distribution'].lower()
 
 class WebsocketInternalClient:
-    def __init__(self,websocket: WebSocket, id: str):
+    def __init__(self,websocket: WebSocket, id: str, transfer_version: int = 1):
         self.websocket = websocket
         self.id = id
+        # File transfer protocol of the client, see websocket_chunks
+        self.transfer_version = transfer_version
         self.jobs = 0
-        self.messages_per_task: Dict[str,SimpleQueue] = {}
+        # Mailbox of every running task, its handler sleeps on it until the next message arrives
+        self.messages_per_task: Dict[str,asyncio.Queue] = {}
         self.on_progress_per_task = {}
         self.last_pong = asyncio.get_event_loop().time()
+        # Last load the internal client reported, see JobScheduler.load
+        self.load: Dict = {}
+        # Seconds per page of the jobs it completed, see worker_selection
+        self.latency = WorkerLatency()
     
     async def send_ping(self):
         
         await self.websocket.send_text(json.dumps({"command": WebsocketMessageCommand.PING,"data": None}))
     
-    def received_pong(self):
+    def received_pong(self, load: Dict = None):
         Utils.log_info(f"Received pong from: {self.id}")
         self.last_pong = asyncio.get_event_loop().time()
+        if load:
+            self.load = load
     
 class WebsocketInternalClientJob:
     def __init__(self,command: WebsocketMessageCommand, data: Dict,files: Dict[str,bytes] = {}):
@@ -101,6 +117,137 @@ app.add_middleware(
 
 clients: Dict[str,WebSocket] = {}  # Dictionary to track WebSocket sessions by ID
 internal_clients: Dict[str,WebsocketInternalClient] = {}  # Dictionary to track WebSocket sessions by ID
+worker_affinity = WorkerAffinity()  # Internal client that rendered each page, by image id and content hash
+worker_policy = get_worker_policy()  # Picks the internal client of jobs without affinity, see WORKER_SELECTION_POLICY
+
+def choose_internal_client(command: WebsocketMessageCommand, affinity_keys: List[str] = [], exclude: Set[str] = set()) -> str:
+    """
+    Pick the internal client of a job.
+
+    The client that rendered the job's pages is preferred while it is connected and has no
+    queued jobs, otherwise worker_policy picks one, another one than the busy client if
+    there is any. Clients in exclude, such as those running the other parts of a split job,
+    are only picked when there is no other client.
+    """
+    candidates = [client for client in internal_clients.values() if client.id not in exclude] or list(internal_clients.values())
+
+    preferred = worker_affinity.preferred_client(affinity_keys)
+    if preferred in internal_clients:
+        if internal_clients[preferred].load.get("queued_jobs", 0) == 0:
+            Utils.log_info(f"Routing job to internal client {preferred}, which rendered its pages")
+            return preferred
+
+        others = [client for client in candidates if client.id != preferred]
+        if len(others) > 0:
+            Utils.log_info(f"Internal client {preferred} is busy, routing job elsewhere")
+            candidates = others
+
+    return worker_policy.choose(candidates, command).id
+
+# Jobs waiting for a pulling internal client to ask for work, see JOB_DISTRIBUTION
+pending_jobs = PendingJobs(lambda client_ids, command: worker_policy.choose([internal_clients[client_id] for client_id in client_ids], command).id)
+
+async def assign_internal_client(command: WebsocketMessageCommand, affinity_keys: List[str] = [], on_progress=None,
+                                 exclude: Set[str] = set()) -> Tuple[str, bool]:
+    """
+    Find the internal client of a job, and whether the client claimed it from pending_jobs.
+
+    In pull mode the job waits in pending_jobs until a client with a free compute slot claims
+    it. Clients on transfer protocols before 4 never ask for work, while none of the others
+    is connected, and in push mode, the job is sent right away to the client
+    choose_internal_client picks, not one in exclude if there is another. Pulling clients
+    only claim jobs for their free slots, so they spread the parts of a split job themselves.
+    run_internal_job sends claimed jobs marked "pulled", only those give their client's
+    credit back when they end.
+
+    Raises:
+        HTTPException: If no internal client is connected
+    """
+    if JOB_DISTRIBUTION == "pull" and len(pending_jobs.pull_clients) > 0:
+        if on_progress is not None and all(pending_jobs.credits(client_id) == 0 for client_id in pending_jobs.pull_clients):
+            await on_progress(f"Waiting for a free processing computer ({len(pending_jobs)} jobs ahead)...")
+
+        client_id = await pending_jobs.claim(command, worker_affinity.preferred_client(affinity_keys))
+        if client_id in internal_clients:
+            return client_id, True
+
+    if len(internal_clients) == 0:
+        Utils.log_info("No internal clients connected.")
+        raise HTTPException(status_code=404, detail="No internal clients connected.")
+
+    return choose_internal_client(command, affinity_keys, exclude), False
+
+async def run_internal_job(job: WebsocketInternalClientJob, affinity_keys: Dict[str, List[str]] = {}, on_progress=None):
+    """
+    Run a job on the internal clients and return its response, as handle_internal_client_task.
+
+    Jobs of at least twice JOB_SHARD_PAGES pages are split into contiguous sub-jobs run in
+    parallel on different clients, see job_sharding. Their progress is prefixed with their
+    part, and their responses are merged in page order. If any part fails, the job fails.
+
+    Args:
+        job: Job with its files
+        affinity_keys: Affinity keys of every file of the job, see worker_affinity
+        on_progress: Async callback receiving progress messages
+    """
+    shards = [(job.data, job.files)]
+
+    # Page ranges are only understood by clients on transfer protocol 5 or later
+    if len(internal_clients) > 1 and all(client.transfer_version >= 5 for client in internal_clients.values()):
+        if job.command == WebsocketMessageCommand.READ_TO_IMAGES:
+            pdf_pages = sum([await asyncio.to_thread(estimate_pdf_pages, file_data) for file_data in job.files.values()])
+        else:
+            pdf_pages = None
+        pages = pdf_pages or len(job.files)
+        shards = plan_shards(job.command, job.data, job.files, get_shard_count(pages, len(internal_clients)), pdf_pages)
+
+    async def assign(data, files, progress, exclude=set()):
+        keys = [key for file_id in files for key in affinity_keys.get(file_id, [])]
+        client_id, pulled = await assign_internal_client(job.command, keys, progress, exclude)
+        if pulled:
+            data = {**data, "pulled": True}
+        return client_id, WebsocketInternalClientJob(job.command, data, files)
+
+    if len(shards) == 1:
+        client_id, client_job = await assign(job.data, job.files, on_progress)
+        return await handle_internal_client_task(internal_clients[client_id], client_job, on_progress=on_progress)
+
+    Utils.log_info(f"Splitting task {job.data['task_id']} into {len(shards)} parts")
+    if on_progress is not None:
+        await on_progress(f"Splitting job into {len(shards)} parts...")
+
+    assigned = set()
+    finished = 0
+
+    async def run_shard(index, data, files):
+        nonlocal finished
+        shard_progress = None
+        if on_progress is not None:
+            shard_progress = lambda message: on_progress(f"[Part {index + 1}/{len(shards)}] {message}")
+
+        client_id, client_job = await assign(data, files, shard_progress, assigned)
+        assigned.add(client_id)
+
+        response = await handle_internal_client_task(internal_clients[client_id], client_job, on_progress=shard_progress)
+        finished += 1
+        if on_progress is not None and type(response) != JSONResponse:
+            await on_progress(f"Part {index + 1}/{len(shards)} complete ({finished}/{len(shards)} parts done)")
+        return response
+
+    responses = await asyncio.gather(
+        *(run_shard(index, data, files) for index, (data, files) in enumerate(shards)),
+        return_exceptions=True
+    )
+
+    for response in responses:
+        if isinstance(response, HTTPException):
+            raise response
+        if isinstance(response, Exception):
+            return JSONResponse(content={"status": WebsocketMessageStatus.ERROR, "error": str(response)})
+        if type(response) == JSONResponse:
+            return response
+
+    return merge_shard_responses(job.data["task_id"], responses)
 
 async def send_progress(websocket: WebSocket, message, task_id):
     await websocket.send_text(json.dumps({"status": WebsocketMessageStatus.PROGRESS,'data': {
@@ -108,18 +255,14 @@ async def send_progress(websocket: WebSocket, message, task_id):
         'message': message
     }}))
 
-CHUNK_SIZE = 1024 * 200 # 200kb
-
-async def send_bytes_in_chunks(websocket: WebSocket, task_id: str,file_data: bytes,file_id: str):
-    #print(f"Sending {len(file_data)} bytes in chunks.")
-    for i in range(0, len(file_data), CHUNK_SIZE):
-        #print(f"Sending chunk {i}.")
-        chunk = file_data[i:i+CHUNK_SIZE]
+async def send_bytes_in_chunks(websocket: WebSocket, task_id: str,file_data: bytes,file_id: str, binary: bool = True):
+    """Send a file to an internal client, as binary chunk frames or, for clients on transfer protocol 1, base64 JSON."""
+    for offset, chunk, final in iter_chunks(file_data, get_chunk_size()):
+        if binary:
+            await websocket.send_bytes(encode_chunk(task_id, file_id, offset, len(file_data), chunk, final))
+            continue
 
-        #print(f"Chunk {i} size: {len(chunk)}")
-        status = WebsocketMessageStatus.SENDING_CHUNK
-        if  i + CHUNK_SIZE >= len(file_data):
-            status = WebsocketMessageStatus.FINAL_CHUNK
+        status = WebsocketMessageStatus.FINAL_CHUNK if final else WebsocketMessageStatus.SENDING_CHUNK
         await websocket.send_text(json.dumps({"status": status,'data': {
             'chunk': b64encode(chunk).decode('utf-8'),
             "task_id": task_id,
@@ -132,17 +275,37 @@ async def send_job_to_internal_client(client_id: str, job: WebsocketInternalClie
     socket = internal_clients[client_id]
 
     
-    socket.messages_per_task[job.data["task_id"]] = SimpleQueue()
+    socket.messages_per_task[job.data["task_id"]] = asyncio.Queue()
 
     internal_clients[client_id].jobs += 1
 
+    data = job.data
+    wanted_file_ids = list(job.files)
+
+    # Clients with a content store say which files they already hold, only the rest is sent
+    if socket.transfer_version >= 3 and len(job.files) > 0:
+        file_hashes = await asyncio.to_thread(
+            lambda: {file_id: content_hash(file_data) for file_id, file_data in job.files.items()}
+        )
+        data = {**job.data, "file_hashes": file_hashes}
+
     await socket.websocket.send_text(json.dumps({
         "command": job.command,
-        "data": job.data
+        "data": data
     }))
+
+    if "file_hashes" in data:
+        message = await socket.messages_per_task[job.data["task_id"]].get()
+        if message["status"] != WebsocketMessageStatus.FILES_WANTED:
+            # The job failed before asking for its files, its handler gets the message
+            socket.messages_per_task[job.data["task_id"]].put_nowait(message)
+            return
+        wanted_file_ids = message["data"]["file_ids"]
+        Utils.log_info(f"Internal client {client_id} holds {len(job.files) - len(wanted_file_ids)} of {len(job.files)} files")
     
-    for file_id in job.files:
-        await send_bytes_in_chunks(socket.websocket,job.data["task_id"],job.files[file_id],file_id)
+    for file_id in wanted_file_ids:
+        await send_bytes_in_chunks(socket.websocket,job.data["task_id"],job.files[file_id],file_id,
+                                   binary=socket.transfer_version >= 2)
     
     
 
@@ -164,7 +327,7 @@ async def read_to_images_route(file: UploadFile = File(...), task_id: str = Form
         Utils.log_info("No internal clients connected.")
         raise HTTPException(status_code=404, detail="No internal clients connected.")
     
-    chosen_internal_client = random.choice(list(internal_clients.keys()))
+    on_progress = lambda x: send_progress(clients[socket_id], x, task_id) if socket_id in clients else None
     
     file_id = random.randbytes(16).hex()
 
@@ -174,7 +337,7 @@ async def read_to_images_route(file: UploadFile = File(...), task_id: str = Form
         "filename": file.filename,
     }, {file_id: await file.read()})
     
-    response = await handle_internal_client_task(internal_clients[chosen_internal_client], job,on_progress=lambda x: send_progress(clients[socket_id], x, task_id) if socket_id in clients else None)
+    response = await run_internal_job(job, on_progress=on_progress)
 
     if type(response) == JSONResponse:
         Utils.log_error(f"Error occurred: {response}")
@@ -205,26 +368,35 @@ async def read_to_images_route(file: UploadFile = File(...), task_id: str = Form
 
 
 @app.post('/find_circles')
-async def find_circles_route(file: UploadFile = File(...), task_id: str = Form(...), socket_id: str = Form(...), data: str = Form(...)):
+async def find_circles_route(file: List[UploadFile] = File(...), task_id: str = Form(...), socket_id: str = Form(...), data: str = Form(...)):
+    # Several pages can be sent as repeated file fields, in page order
     Utils.log_info("Received request to find circles.")
-    Utils.log_info(f"Received file: {file.filename}")
+    Utils.log_info(f"Received files: {', '.join(str(upload.filename) for upload in file)}")
     
     if len(internal_clients) == 0:
         Utils.log_info("No internal clients connected.")
         raise HTTPException(status_code=404, detail="No internal clients connected.")
 
-    chosen_internal_client = random.choice(list(internal_clients.keys()))
-    
-    file_id = random.randbytes(16).hex()
+    files = {}
+    affinity_keys = {}
+    for upload in file:
+        file_id = random.randbytes(16).hex()
+        files[file_id] = await upload.read()
+
+        # Pages go back to the worker that rendered them, by their bytes or their image id
+        affinity_keys[file_id] = [await asyncio.to_thread(content_hash, files[file_id])]
+        if upload.filename:
+            affinity_keys[file_id].append(os.path.splitext(upload.filename)[0])
+    on_progress = lambda x: send_progress(clients[socket_id], x, task_id) if socket_id in clients else None
 
     job = WebsocketInternalClientJob(WebsocketMessageCommand.FIND_CIRCLES, {
         "socket_id": socket_id,
         "task_id": task_id,
-        "filename": file.filename,
+        "filename": file[0].filename,
         **json.loads(data)
-    }, {file_id: await file.read()})
+    }, files)
     
-    response = await handle_internal_client_task(internal_clients[chosen_internal_client], job,on_progress=lambda x: send_progress(clients[socket_id], x, task_id) if socket_id in clients else None)
+    response = await run_internal_job(job, affinity_keys, on_progress)
 
     if type(response) == JSONResponse:
         return response
@@ -250,7 +422,7 @@ async def handle_internal_client_task(internal_client: WebsocketInternalClient,
     
     internal_client.on_progress_per_task[job_data["task_id"]] = on_progress
 
-    await send_job_to_internal_client(internal_client.id, WebsocketInternalClientJob(job.command, job_data, job.files))
+    sent_at = asyncio.get_event_loop().time()
     chunks_per_file = {}
     files_received = {}
 
@@ -264,56 +436,59 @@ async def handle_internal_client_task(internal_client: WebsocketInternalClient,
         Utils.log_info("Received request to find circles.")
 
     try:
+        # Counts the job in internal_client.jobs, the finally block below takes it out again
+        await send_job_to_internal_client(internal_client.id, WebsocketInternalClientJob(job.command, job_data, job.files))
+
         while True:
 
             if job_data["task_id"] not in internal_client.messages_per_task:
                 Utils.log_info(f"Task {job_data['task_id']} not found in internal client {internal_client.id}.")
-                internal_client.jobs -= 1
-                del internal_client.on_progress_per_task[job_data["task_id"]]
                 return JSONResponse(content={"status": WebsocketMessageStatus.ERROR, "error": "Task not found."})
-            
-            if internal_client.messages_per_task[job_data["task_id"]].empty():
-                await asyncio.sleep(0.1)
-                continue
 
-            message = internal_client.messages_per_task[job_data["task_id"]].get()
+            message = await internal_client.messages_per_task[job_data["task_id"]].get()
 
             Utils.log_info(f'Internal message on task "{job.data["task_id"]}": {message["status"]}')
 
             if message["status"] == WebsocketMessageStatus.ERROR:
-                internal_client.jobs -= 1
-                del internal_client.on_progress_per_task[job_data["task_id"]]
                 return JSONResponse(content={"status": WebsocketMessageStatus.ERROR, "error": message["data"]})
             elif message["status"] == WebsocketMessageStatus.COMPLETED_TASK:
-                internal_client.jobs -= 1
-                del internal_client.on_progress_per_task[job_data["task_id"]]
+                # Workers report the time the job ran for, without transfers and queueing
+                seconds = message["data"].pop("processing_seconds", None)
+                if seconds is None:
+                    seconds = asyncio.get_event_loop().time() - sent_at
+                pages = len(message["data"].get("images_ids", job_data["file_ids"]))
+                internal_client.latency.record(job.command, seconds, pages)
+
                 return {
                     "data": message["data"],
                     "files": files_received
                 }
             elif message["status"] == WebsocketMessageStatus.SENDING_CHUNK:
-                if message["data"]["file_id"] not in chunks_per_file:
-                    chunks_per_file[message["data"]["file_id"]] = bytearray()
-                chunks_per_file[message["data"]["file_id"]] += bytearray(b64decode(message["data"]["chunk"]))
+                receive_chunk(chunks_per_file, message["data"])
 
                 #Utils.log_info(f"Received chunk for file {message['data']['file_id']} with size {len(chunks_per_file[message['data']['file_id']])}.")
 
             elif message["status"] == WebsocketMessageStatus.FINAL_CHUNK:
-                if message["data"]["file_id"] not in chunks_per_file:
-                    chunks_per_file[message["data"]["file_id"]] = bytearray()
-                chunks_per_file[message["data"]["file_id"]] += bytearray(b64decode(message["data"]["chunk"]))
+                transfer = receive_chunk(chunks_per_file, message["data"])
+
+                # Rendered pages are remembered, find circles jobs on them go back to this client
+                if job.command == WebsocketMessageCommand.READ_TO_IMAGES:
+                    page_hash = await asyncio.to_thread(content_hash, transfer.data)
+                    worker_affinity.record(internal_client.id, [message["data"]["file_id"], page_hash])
 
-                files_received[message["data"]["file_id"]] = b64encode(chunks_per_file[message["data"]["file_id"]]).decode('utf-8')
+                files_received[message["data"]["file_id"]] = b64encode(transfer.data).decode('utf-8')
                 
                 del chunks_per_file[message["data"]["file_id"]]
+                transfer.close()
     except Exception as e:
-        internal_client.jobs -= 1
-        del internal_client.on_progress_per_task[job_data["task_id"]]
         Utils.log_error(f"An error occurred: {traceback.format_exc()}")
         return JSONResponse(content={"status": WebsocketMessageStatus.ERROR, "error": str(e)})
     finally:
         internal_client.jobs -= 1
         internal_client.on_progress_per_task.pop(job_data["task_id"], None)
+        internal_client.messages_per_task.pop(job_data["task_id"], None)
+        for transfer in chunks_per_file.values():
+            transfer.close()
         chunks_per_file.clear()
 
 
@@ -326,9 +501,9 @@ async def handle_websocket(websocket: WebSocket):
     try:
         if "sec-websocket-protocol" in websocket.headers and  websocket.headers["sec-websocket-protocol"].startswith("processing-computer-internal"):
 
-            version = websocket.headers["sec-websocket-protocol"].split("-")[-2]
+            version, id, transfer_version = parse_internal_subprotocol(websocket.headers["sec-websocket-protocol"])
 
-            if version == "internal":
+            if version is None:
                 await websocket.send_text(json.dumps({"status": WebsocketMessageStatus.ERROR, 'data': "Missing version."}))
 
                 return
@@ -341,24 +516,44 @@ async def handle_websocket(websocket: WebSocket):
 
 
 
-            id = websocket.headers["sec-websocket-protocol"].split("-")[-1]
-            Utils.log_info(f"Internal client connected: {id}")
-            internal_clients[id] = WebsocketInternalClient(websocket, id)
+            Utils.log_info(f"Internal client connected: {id}, transfer protocol {transfer_version}")
+            internal_clients[id] = WebsocketInternalClient(websocket, id, transfer_version)
             for client in clients.values():
                 await client.send_text(json.dumps({"status": WebsocketMessageStatus.INTERNAL_CLIENT_REPORT, 'data': {"num_clients": len(internal_clients)}}))
             
             while True:
-                message = await websocket.receive_text()
-                message = json.loads(message)
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
+
+                # File chunks come as binary frames, everything else as JSON text
+                if frame.get("bytes") is not None:
+                    message = chunk_message(decode_chunk(frame["bytes"]))
+                else:
+                    message = json.loads(frame["text"])
 
                 if message["status"] == WebsocketMessageStatus.PONG:
-                    internal_clients[id].received_pong()
+                    internal_clients[id].received_pong(message.get("data"))
+                    continue
+                if message["status"] == WebsocketMessageStatus.WORKER_LOAD:
+                    internal_clients[id].load = message["data"]
+                    continue
+                if message["status"] == WebsocketMessageStatus.REQUEST_JOB:
+                    # Pushed jobs never take a credit, so credits are only kept in pull mode
+                    if JOB_DISTRIBUTION == "pull":
+                        pending_jobs.add_credits(id, message["data"]["count"])
                     continue
                 if message["status"] == WebsocketMessageStatus.PROGRESS:
                     if message["data"]["task_id"] in internal_clients[id].on_progress_per_task:
                         await internal_clients[id].on_progress_per_task[message["data"]["task_id"]](message["data"]["message"])
                 else:
-                    internal_clients[id].messages_per_task[message["data"]["task_id"]].put(message)
+                    # Chunks and results of a task the relay stopped handling, after an error or
+                    # a cancelled request, have no mailbox anymore
+                    mailbox = internal_clients[id].messages_per_task.get(message["data"]["task_id"])
+                    if mailbox is None:
+                        Utils.log_info(f'Dropping {message["status"]} message of unknown task "{message["data"]["task_id"]}" from internal client {id}')
+                        continue
+                    mailbox.put_nowait(message)
         else:
             await websocket.send_text(json.dumps({"status": WebsocketMessageStatus.INTERNAL_CLIENT_REPORT, 'data': {"num_clients": len(internal_clients)}}))
             client_id = None
@@ -382,15 +577,16 @@ async def handle_websocket(websocket: WebSocket):
         if client_id and  client_id in clients:
             del clients[client_id]
         if id in internal_clients:
-            handle_internal_client_disconnect(id)
+            await handle_internal_client_disconnect(id)
 
 async def handle_internal_client_disconnect(id):
+    pending_jobs.remove_client(id)
     if internal_clients[id].jobs == 0:
         Utils.log_info(f"Removing internal client {id}.")
         del internal_clients[id]
     else:
         for task in internal_clients[id].messages_per_task:
-            internal_clients[id].messages_per_task[task].put({"status": WebsocketMessageStatus.ERROR, "data": "Internal client disconnected."})
+            internal_clients[id].messages_per_task[task].put_nowait({"status": WebsocketMessageStatus.ERROR, "data": "Internal client disconnected."})
         del internal_clients[id]
     for client in clients.values():
         await client.send_text(json.dumps({"status": WebsocketMessageStatus.INTERNAL_CLIENT_REPORT, 'data': {"num_clients": len(internal_clients)}}))
@@ -399,6 +595,10 @@ async def handle_internal_client_disconnect(id):
 
 
 
+def format_latency(latency: WorkerLatency) -> str:
+    return ", ".join(f"{command}: {seconds:.2f}" for command, seconds in latency.seconds_per_page.items()) or "-"
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     num_clients = len(clients)
@@ -411,7 +611,8 @@ async def root():
     )
     internal_client_info = "".join(
         [
-            f"<tr><td>{client_id}</td><td>{client.jobs}</td></tr>"
+            f"<tr><td>{client_id}</td><td>{client.jobs}</td><td>{client.load.get('queued_jobs', 0)}</td>"
+            f"<td>{client.load.get('slots', '-')}</td><td>{format_latency(client.latency)}</td></tr>"
             for client_id, client in internal_clients.items()
         ]
     )
@@ -436,6 +637,7 @@ async def root():
         <h2>WebSocket Clients Overview</h2>
         <p><strong>Total Clients Connected:</strong> {num_clients}</p>
         <p><strong>Total Internal Clients Connected:</strong> {num_internal_clients}</p>
+        <p><strong>Jobs Waiting for a Worker:</strong> {len(pending_jobs)}</p>
         <h3>Client IDs</h3>
         <table>
             <tr><th>Client ID</th></tr>
@@ -443,7 +645,7 @@ async def root():
         </table>
         <h3>Internal Client Details</h3>
         <table>
-            <tr><th>Internal Client ID</th><th>Jobs in Progress</th></tr>
+            <tr><th>Internal Client ID</th><th>Jobs in Progress</th><th>Jobs Queued</th><th>Slots</th><th>Seconds per Page</th></tr>
             {internal_client_info}
         </table>
     </body>
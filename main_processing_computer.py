@@ -1,21 +1,26 @@
 import asyncio
-from base64 import b64decode, b64encode
-from io import BytesIO
-from typing import Dict
-from PIL import Image
-import cv2
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 from fastapi import UploadFile
 import numpy as np
 import websockets.client as websockets
-from websockets.exceptions import ConnectionClosedError
+from websockets.exceptions import ConnectionClosed
 import random
 import json
-from queue import SimpleQueue
+import time
 import traceback
 from websockets.uri import WebSocketURI
-from find_circles import find_circles_cv2, find_circles_fallback
+from page_encoding import encode_page, get_page_codec, page_mime_type
+from page_detection import PageLoadError, find_circles_in_page, find_circles_in_page_process, get_page_pool, get_page_workers, share_registration
+from content_store import ContentStore, content_hash
+from job_scheduler import JobScheduler, estimate_job_memory
+from job_shared_memory import JobSharedMemory
+from page_cache import PageCache, RenderedPage
+from transfer_store import TransferQuotaExceeded, TransferRejected, TransferStore
+from websocket_chunks import chunk_message, decode_chunk, encode_chunk, get_chunk_size, internal_subprotocol, iter_chunks
 from read_to_images import read_to_images
-from websocket_types import BoxRectangleType, WebsocketMessageCommand, WebsocketMessageStatus
+from websocket_types import WebsocketMessageCommand, WebsocketMessageStatus
 from copy import deepcopy
 from utils import Utils
 from websockets.asyncio.client import connect
@@ -28,7 +33,6 @@ from config_loader import config
 MEMORY_CONFIG = config.get_memory_config()
 MEMORY_THRESHOLD_PERCENT = MEMORY_CONFIG['threshold_percent']
 CHECK_INTERVAL = MEMORY_CONFIG['check_interval']
-CHUNK_SIZE = 1024 * 200  # 200kb
 
 class InternalClientMessageType:
     FILE_RECEIVED = "fileReceived"
@@ -41,67 +45,264 @@ class Environment:
     def get_environment():
         return Environment.DEV if config.is_dev_environment() else Environment.PROD
     
-def image_as_encoded(image):
-    byte_arr = BytesIO()
-    image.save(byte_arr, format='PNG') # convert the PIL image to byte array
-    encoded_img = b64encode(byte_arr.getvalue()).decode('utf-8') # encode as base64
-    return encoded_img
-
 async def send_bytes_in_chunks(websocket: websockets.ClientProtocol,task_id: str, file_data: bytes,file_id: str):
     Utils.log_info(f"Sending file in chunks: {file_id}, size: {len(file_data)}")
-    for i in range(0, len(file_data), CHUNK_SIZE):
-        chunk = file_data[i:i+CHUNK_SIZE]
-        status = WebsocketMessageStatus.SENDING_CHUNK
-        if  i + CHUNK_SIZE >= len(file_data):
-            status = WebsocketMessageStatus.FINAL_CHUNK
-        await websocket.send(json.dumps({"status": status,'data': {
-            'task_id': task_id,
-            'chunk': b64encode(chunk).decode('utf-8'),
-            "file_id": file_id
-        }}))
-    
-chunks_per_file_id = {}
-files_received: Dict[str,bytearray] = {}
-messages_per_task_id: Dict[str,SimpleQueue] = {}
+    for offset, chunk, final in iter_chunks(file_data, get_chunk_size()):
+        await websocket.send(encode_chunk(task_id, file_id, offset, len(file_data), chunk, final))
     
+# Files being received and received, with the mailboxes of their tasks
+transfer_store = TransferStore()
+shared_memory_per_task_id: Dict[str,JobSharedMemory] = {}
+
+
+def get_job_shared_memory(task_id: str) -> JobSharedMemory:
+    """Return the shared memory of a job, released by handle_job_received when the job ends."""
+    if task_id not in shared_memory_per_task_id:
+        shared_memory_per_task_id[task_id] = JobSharedMemory()
+    return shared_memory_per_task_id[task_id]
+
+
+def release_job_shared_memory(task_id: str) -> None:
+    job_memory = shared_memory_per_task_id.pop(task_id, None)
+    if job_memory is not None:
+        job_memory.close()
+
+
+class LoopBoundWebsocket:
+    """
+    Websocket stand-in for job handlers running on a job executor thread.
+
+    The connection belongs to the main event loop, so every send is handed back to that loop
+    and awaited from the handler's own loop.
+    """
+
+    def __init__(self, websocket: websockets.ClientProtocol, loop: asyncio.AbstractEventLoop):
+        self.websocket = websocket
+        self.loop = loop
+
+    async def send(self, message):
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.websocket.send(message), self.loop))
+
+
+_job_executor = None
+
+
+_job_scheduler = None
+_content_store = None
+_page_cache = None
+
+
+def get_content_store() -> ContentStore:
+    """Return the store of the pages this worker produced and the files it received."""
+    global _content_store
+
+    if _content_store is None:
+        _content_store = ContentStore()
+        Utils.log_info(f"Content store in {_content_store.directory}: {_content_store.stats()}")
+
+    return _content_store
+
+
+def get_page_cache() -> PageCache:
+    """Return the cache of the full-resolution pages this worker rendered."""
+    global _page_cache
+
+    if _page_cache is None:
+        _page_cache = PageCache()
+
+    return _page_cache
+
+
+def job_processing_seconds(job) -> Optional[float]:
+    """Seconds since the job got its compute slot, reported to the relay with the results."""
+    if "started_at" not in job:
+        return None
+    return round(time.monotonic() - job["started_at"], 3)
+
+
+def get_job_workers() -> int:
+    workers = config.get_worker_config()['job_workers']
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def get_job_scheduler() -> JobScheduler:
+    """
+    Return the scheduler admitting jobs into the job executor's slots.
+
+    Without JOB_MEMORY_BUDGET_MB the budget is the memory left below MEMORY_THRESHOLD_PERCENT
+    when the worker starts, so admitted jobs don't push monitor_memory into a restart.
+    """
+    global _job_scheduler
+
+    if _job_scheduler is None:
+        budget = config.get_worker_config()['job_memory_budget_mb'] * 1024 * 1024
+        if budget <= 0:
+            system_memory = psutil.virtual_memory()
+            budget = max(0, int(system_memory.total * MEMORY_THRESHOLD_PERCENT / 100) - system_memory.used)
+        _job_scheduler = JobScheduler(get_job_workers(), budget)
+        _job_scheduler.add_listener(send_worker_load)
+        Utils.log_info(f"Job scheduler started with {_job_scheduler.max_slots} slots and {budget / 1024 / 1024:.0f} MB budget")
+
+    return _job_scheduler
+
+
+# Connection to the relay, worker load updates are sent through it
+connected_websocket = None
+
+
+async def send_worker_load(load):
+    if connected_websocket is not None:
+        await connected_websocket.send(json.dumps({"status": WebsocketMessageStatus.WORKER_LOAD, "data": load}))
+
+
+# Jobs received and not finished yet
+active_jobs = 0
+# Relay connections made so far, jobs remember the one they were received on
+connection_count = 0
+
+
+async def request_jobs(count: int):
+    """
+    Ask the relay for count more jobs, relays that pull work hand them out as this worker's
+    compute slots free up. A request lost with its connection is made again on the next one.
+    A request for 0 jobs still tells the relay this worker pulls its work.
+    """
+    if connected_websocket is None or count < 0:
+        return
+    try:
+        await connected_websocket.send(json.dumps({"status": WebsocketMessageStatus.REQUEST_JOB, "data": {"count": count}}))
+    except ConnectionClosed:
+        pass
+
+
+async def run_received_job(job, websocket: websockets.ClientProtocol):
+    """
+    Run a job the relay sent, then give its compute slot back to the relay if the relay
+    doesn't count it as free already. That is if the job was claimed from the relay's queue
+    ("pulled"), or if it was received on an earlier connection, since the request made on
+    connecting left out the slots of running jobs. Pushed jobs never took a slot.
+    """
+    global active_jobs
+
+    active_jobs += 1
+    received_on = connection_count
+    try:
+        await handle_job_received(job, websocket)
+    finally:
+        active_jobs -= 1
+        if job.get("pulled", False) or received_on != connection_count:
+            await request_jobs(1)
+
+
+def get_job_executor():
+    """
+    Return the shared thread pool jobs run on, so the websocket event loop is left free for I/O.
+
+    OpenCV, pdf2image and NumPy release the GIL for their heavy work, so pings, incoming
+    chunks and the progress of other jobs keep flowing while a job computes.
+    """
+    global _job_executor
+
+    if _job_executor is None:
+        workers = get_job_workers()
+        _job_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        Utils.log_info(f"Job executor started with {workers} workers")
+
+    return _job_executor
+
+
+async def run_job_handler(handler, job, websocket: websockets.ClientProtocol):
+    """
+    Run a job handler coroutine to completion in its own event loop on the job executor.
+    """
+    loop = asyncio.get_running_loop()
+    loop_bound_websocket = LoopBoundWebsocket(websocket, loop)
+    await loop.run_in_executor(get_job_executor(), lambda: asyncio.run(handler(job, loop_bound_websocket)))
+
+
+async def receive_stored_files(job):
+    """
+    Load the files of a job the content store holds into the transfer store.
+
+    Returns:
+        Ids of the files the relay still has to send
+    """
+    missing_file_ids = []
+    for file_id in job["file_ids"]:
+        data = None
+        if file_id in job["file_hashes"]:
+            data = await asyncio.to_thread(get_content_store().read, job["file_hashes"][file_id])
+
+        if data is None:
+            missing_file_ids.append(file_id)
+            continue
+
+        transfer_store.receive_chunk(job["task_id"], {"file_id": file_id, "offset": 0, "total_size": len(data), "chunk": data})
+
+    if len(missing_file_ids) < len(job["file_ids"]):
+        Utils.log_info(f"Content store holds {len(job['file_ids']) - len(missing_file_ids)} of {len(job['file_ids'])} files of task {job['task_id']}")
+    return missing_file_ids
+
 
 async def handle_job_received(job,websocket: websockets.ClientProtocol):
     try:
         files_to_wait_for: list = deepcopy(job["file_ids"])
+        mailbox = transfer_store.mailbox(job["task_id"])
+
+        # Files the content store holds are not sent again
+        if "file_hashes" in job:
+            files_to_wait_for = await receive_stored_files(job)
+            await websocket.send(json.dumps({
+                "status": WebsocketMessageStatus.FILES_WANTED,
+                "data": {
+                    "task_id": job["task_id"],
+                    "file_ids": files_to_wait_for
+                }
+            }))
+
+        while len(files_to_wait_for) > 0:
+            message = await mailbox.get()
 
-        # Create task queue if it doesn't exist
-        if job["task_id"] not in messages_per_task_id:
-            messages_per_task_id[job["task_id"]] = SimpleQueue()
+            # The transfer store evicted the task's files
+            if message["status"] == WebsocketMessageStatus.ERROR:
+                raise Exception(message["data"]["error"])
 
-        while True:
-            if messages_per_task_id[job["task_id"]].empty():
-                await asyncio.sleep(0.1)
-                continue
-            message = messages_per_task_id[job["task_id"]].get()
-            
             if message["status"] == InternalClientMessageType.FILE_RECEIVED:
-                files_to_wait_for.remove(message["data"]["file_id"])     
+                files_to_wait_for.remove(message["data"]["file_id"])
 
-            if len(files_to_wait_for) > 0:     
-                continue
+                # Later jobs with the same file skip the transfer
+                transfer = transfer_store.file(message["data"]["file_id"])
+                if transfer is not None and "file_hashes" in job:
+                    await asyncio.to_thread(get_content_store().put, transfer.data)
+
+        try:
+            transfer_store.pin(job["task_id"])
+
+            # Wait for a compute slot with enough memory left for the job
+            concurrent_pages = get_page_workers() if job["command"] == WebsocketMessageCommand.FIND_CIRCLES else 1
+            estimated_memory = await asyncio.get_running_loop().run_in_executor(
+                None, estimate_job_memory, job,
+                [transfer.data for transfer in map(transfer_store.file, job["file_ids"]) if transfer is not None],
+                concurrent_pages
+            )
+            on_queued = lambda jobs_ahead: send_progress(
+                websocket, f"All files received on internal client, waiting for a free slot ({jobs_ahead} jobs ahead)", job["task_id"]
+            )
+
+            async with get_job_scheduler().slot(job["task_id"], estimated_memory, on_queued=on_queued):
+                await send_progress(websocket, "All files received on internal client, starting job", job["task_id"])
+                job["started_at"] = time.monotonic()
 
-            await send_progress(websocket, "All files received on internal client, starting job", job["task_id"])
-            
-            try:
                 if job["command"] == WebsocketMessageCommand.READ_TO_IMAGES:
-                    await handle_read_to_images(job, websocket)
+                    await run_job_handler(handle_read_to_images, job, websocket)
                 elif job["command"] == WebsocketMessageCommand.FIND_CIRCLES:
-                    await handle_find_circles(job, websocket)
-            finally:
-                # Clean up resources
-                for file_id in job["file_ids"]:
-                    if file_id in files_received:
-                        del files_received[file_id]
-                    if file_id in chunks_per_file_id:
-                        del chunks_per_file_id[file_id]
-                if job["task_id"] in messages_per_task_id:
-                    del messages_per_task_id[job["task_id"]]
-            return
+                    await run_job_handler(handle_find_circles, job, websocket)
+        finally:
+            # Clean up resources
+            transfer_store.discard_task(job["task_id"])
+            release_job_shared_memory(job["task_id"])
     except Exception as e:
         Utils.log_error(f"Error in handle_job_received: {str(e)}")
         try:
@@ -115,13 +316,8 @@ async def handle_job_received(job,websocket: websockets.ClientProtocol):
         except:
             pass
         # Clean up on error
-        for file_id in job.get("file_ids", []):
-            if file_id in files_received:
-                del files_received[file_id]
-            if file_id in chunks_per_file_id:
-                del chunks_per_file_id[file_id]
-        if job.get("task_id") in messages_per_task_id:
-            del messages_per_task_id[job["task_id"]]
+        transfer_store.discard_task(job.get("task_id"))
+        release_job_shared_memory(job.get("task_id"))
 
 async def handle_read_to_images(job, websocket):
     await send_progress(websocket, "Starting to read PDF to images.", job["task_id"])
@@ -129,26 +325,22 @@ async def handle_read_to_images(job, websocket):
     
     for file_id in job["file_ids"]:
         try:
-            if file_id not in files_received:
+            transfer = transfer_store.file(file_id)
+            if transfer is None:
                 raise Exception(f"File {file_id} not found")
 
-            Utils.log_info(f"Processing file: {file_id} with size: {len(files_received[file_id])}")
-            file = files_received[file_id]
-
+            Utils.log_info(f"Processing file: {file_id} with size: {len(transfer)}")
+            # The transfer is read in place, a spilled PDF is converted straight from its file
             uploadFile = UploadFile(
-                file=BytesIO(file),
+                file=transfer.open(),
                 filename=job["filename"]
             )
 
-            images_inner = await read_to_images(uploadFile, on_progress=lambda x: send_progress(websocket, x, job["task_id"]))
+            # Jobs split across workers by the relay read a range of the PDF's pages
+            images_inner = await read_to_images(uploadFile, on_progress=lambda x: send_progress(websocket, x, job["task_id"]),
+                                                full_resolution=get_page_cache().enabled,
+                                                first_page=job.get("first_page"), last_page=job.get("last_page"))
             await send_progress(websocket, "Completed reading PDF to images.", job["task_id"])
-            
-            for image in images_inner["images"]:
-                try:
-                    images_inner["images"][image] = image_as_encoded(images_inner["images"][image])
-                except Exception as e:
-                    Utils.log_error(f"Error encoding image {image}: {str(e)}")
-                    continue
 
             for key in images_inner:
                 if key not in images:
@@ -163,11 +355,25 @@ async def handle_read_to_images(job, websocket):
 
     await send_progress(websocket, "Sending images back to server...", job["task_id"])
     
+    codec = get_page_codec()
     images_ids = []
+    full_resolution_images = images.pop("full_resolution_images", {})
     for index, image in enumerate(images.get("images", {})):
-        images_ids.append(image)
         await send_progress(websocket, f"Sending images back to server {index}/{len(images['images'])}...", job["task_id"])
-        await send_bytes_in_chunks(websocket, job["task_id"], b64decode(images["images"][image]), image)
+        # Each page is compressed once, right before it is sent, and goes out as raw bytes
+        try:
+            encoded_image = encode_page(images["images"][image], codec)
+        except Exception as e:
+            Utils.log_error(f"Error encoding image {image}: {str(e)}")
+            continue
+        images["images"][image] = None
+        # The client uploads the page back for find circles, then it isn't sent again and is
+        # detected on its full-resolution version
+        address = get_content_store().put(encoded_image)
+        if image in full_resolution_images:
+            get_page_cache().put(address or content_hash(encoded_image), full_resolution_images.pop(image))
+        await send_bytes_in_chunks(websocket, job["task_id"], encoded_image, image)
+        images_ids.append(image)
 
     if "images" in images:
         del images["images"]
@@ -176,143 +382,133 @@ async def handle_read_to_images(job, websocket):
         "status": WebsocketMessageStatus.COMPLETED_TASK,
         "data": {
             "task_id": job["task_id"],
+            "processing_seconds": job_processing_seconds(job),
             "images_ids": images_ids,
+            "image_mime_type": page_mime_type(codec),
             **images
         }
     }))
 
 async def handle_find_circles(job, websocket):
     await send_progress(websocket, "Starting to find circles in images.", job["task_id"])
-    circles_final = {}
     
     total_files = len(job["file_ids"])
     
     # Add overall progress message
     if total_files > 1:
         await send_progress(websocket, f"Processing {total_files} pages for circle detection...", job["task_id"])
-    
-    for file_index, file_id in enumerate(job["file_ids"]):
-        try:
-            if file_id not in files_received:
-                raise Exception(f"File {file_id} not found")
 
-            file = files_received[file_id]
-            
-            try:
-                image = Image.open(BytesIO(file))
-                cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                image.close()  # Explicitly close PIL Image
-            except Exception as e:
-                Utils.log_error(f"Error loading image {file_id}: {str(e)}")
-                continue
+    on_progress = lambda x: send_progress(websocket, x, job["task_id"])
+    page_results = {}  # file_id -> circles per box, filled in as pages finish
+    finished_pages = 0
+
+    def get_page_info(file_index):
+        # Create page info for progress messages
+        return f"[Page {file_index + 1}/{total_files}] " if total_files > 1 else ""
+
+    async def finish_page(file_index, file_id, circles_per_box=None, error=None):
+        nonlocal finished_pages
+        page_info = get_page_info(file_index)
 
-            # Create page info for progress messages
-            page_info = ""
-            if total_files > 1:
-                page_info = f"[Page {file_index + 1}/{total_files}] "
+        if isinstance(error, PageLoadError):
+            Utils.log_error(f"Error loading image {file_id}: {str(error)}")
+            return
 
-            await send_progress(websocket, f"{page_info}Processing image: {file_id}\nStarting page analysis...", job["task_id"])
+        finished_pages += 1
+        page_progress = f"({finished_pages}/{total_files})" if total_files > 1 else ""
 
-            # Apply image transformations
-            if job.get("image_offset"):
-                M = np.float32([[1, 0, job["image_offset"]["x"]], [0, 1, job["image_offset"]["y"]]])
-                cv_image = cv2.warpAffine(cv_image, M, cv_image.shape[1::-1], flags=cv2.INTER_LINEAR)
+        if error is not None:
+            Utils.log_error(f"Error processing file {file_id}: {str(error)}")
+            page_results[file_id] = {}
+            # Add error message for this page
+            await send_progress(websocket, f"{page_info}❌ Page {file_index + 1} failed {page_progress}\nError: {str(error)}", job["task_id"])
+            return
 
-            if job.get("image_angle") is not None:
-                center = (cv_image.shape[1] // 2, cv_image.shape[0] // 2)
-                M = cv2.getRotationMatrix2D(center, -job["image_angle"], 1)
-                cv_image = cv2.warpAffine(cv_image, M, cv_image.shape[1::-1])
+        page_results[file_id] = circles_per_box
 
-            circles_per_box = {}
-            
-            # Sort boxes with exemplo circles first
-            boxes = sorted(job.get("boxes", []), key=lambda x: 0 if x.get("rect_type") == BoxRectangleType.EXEMPLO_CIRCULO else 1)
-            total_boxes = len(boxes)
+        # Add page completion summary
+        total_circles_on_page = sum(len(circles) for circles in circles_per_box.values())
+        await send_progress(websocket, f"{page_info}✅ Page {file_index + 1} complete! {page_progress}\nFound {total_circles_on_page} total circles across {len(circles_per_box)} regions", job["task_id"])
 
-            for box_index, box in enumerate(boxes):
-                try:
-                    rect = box.get("rect")
-                    rect_type = box.get("rect_type")
-                    box_name = box.get("name")
-                    
-                    if not all([rect, rect_type, box_name]):
-                        continue
-
-                    circle_size = job.get("circle_size")
-                    if rect_type == BoxRectangleType.EXEMPLO_CIRCULO:
-                        circle_size = None
-
-                    # Prepare rectangle info for progress tracking
-                    rectangle_info = {
-                        'index': box_index + 1,
-                        'total': total_boxes,
-                        'name': box_name,
-                        'page_info': page_info  # Add page info to rectangle info
-                    }
-
-                    if job.get("use_fallback_method") and box.get("template_circles"):
-                        circles = await find_circles_fallback("",
-                            rect,
-                            rectangle_type=rect_type,
-                            template_circles=box["template_circles"],
-                            darkness_threshold=job.get("darkness_threshold", 0),
-                            img=cv_image,
-                            on_progress=lambda x: send_progress(websocket, f"{page_info}{x}", job["task_id"])
-                        )
-                    else:
-                        circles = await find_circles_cv2("", rect, rect_type, 
-                            img=cv_image,
-                            circle_size=circle_size,
-                            dp=job.get("inverse_ratio_accumulator_resolution", 1),
-                            darkness_threshold=job.get("darkness_threshold", 0),
-                            circle_precision_percentage=job.get("circle_precision_percentage", 1),
-                            param2=job.get("param2", 30),
-                            on_progress=lambda x: send_progress(websocket, f"{page_info}{x}", job["task_id"]),
-                            rectangle_info=rectangle_info
-                        )
-
-                    # Process circles
-                    if rect_type == BoxRectangleType.EXEMPLO_CIRCULO and circles:
-                        job["circle_size"] = circles[0]["radius"] / cv_image.shape[1]
-
-                    for circle in circles:
-                        # Normalize coordinates
-                        if job.get("image_offset"):
-                            circle["center_x"] -= job["image_offset"]["x"]
-                            circle["center_y"] -= job["image_offset"]["y"]
-
-                        if job.get("image_angle") is not None:
-                            center = (cv_image.shape[1] // 2, cv_image.shape[0] // 2)
-                            M = cv2.getRotationMatrix2D(center, job["image_angle"], 1)
-                            circle["center_x"], circle["center_y"] = cv2.transform(
-                                np.array([[circle["center_x"],circle["center_y"]]]).reshape(-1,1,2),
-                                M
-                            ).reshape(2)
-
-                        # Normalize to image dimensions
-                        circle["center_x"] /= cv_image.shape[1]
-                        circle["center_y"] /= cv_image.shape[0]
-                        circle["radius"] /= cv_image.shape[1]
-
-                    circles_per_box[box_name] = circles
+    def get_file(file_id):
+        # Pages this worker rendered are detected on their full-resolution version
+        rendered_page = get_page_cache().get(job.get("file_hashes", {}).get(file_id))
+        if rendered_page is not None:
+            return rendered_page
 
-                except Exception as e:
-                    Utils.log_error(f"Error processing box {box_name}: {str(e)}")
-                    circles_per_box[box_name] = []
+        transfer = transfer_store.file(file_id)
+        if transfer is None:
+            raise Exception(f"File {file_id} not found")
+        return transfer.data
+
+    pages = list(enumerate(job["file_ids"]))
+    page_pool = get_page_pool() if total_files > 1 else None
 
-            circles_final[file_id] = circles_per_box
-            
-            # Add page completion summary
-            total_circles_on_page = sum(len(circles) for circles in circles_per_box.values())
-            page_progress = f"({file_index + 1}/{total_files})" if total_files > 1 else ""
-            await send_progress(websocket, f"{page_info}✅ Page {file_index + 1} complete! {page_progress}\nFound {total_circles_on_page} total circles across {len(circles_per_box)} regions", job["task_id"])
+    # With template registration the later pages need the reference page, so pages run here
+    # one at a time until one of them becomes the reference. Like pool pages they get a copy of
+    # the job, so the circle size an EXEMPLO_CIRCULO box finds stays on its own page
+    use_registration = job.get("use_template_registration", False)
+    registration = None
 
+    while len(pages) > 0 and (page_pool is None or (use_registration and registration is None)):
+        file_index, file_id = pages.pop(0)
+        try:
+            circles_per_box, reference = await find_circles_in_page(
+                dict(job), file_id, get_file(file_id), get_page_info(file_index), registration, on_progress
+            )
+            registration = registration or reference
+            await finish_page(file_index, file_id, circles_per_box)
         except Exception as e:
-            Utils.log_error(f"Error processing file {file_id}: {str(e)}")
-            circles_final[file_id] = {}
-            # Add error message for this page
-            page_progress = f"({file_index + 1}/{total_files})" if total_files > 1 else ""
-            await send_progress(websocket, f"{page_info}❌ Page {file_index + 1} failed {page_progress}\nError: {str(e)}", job["task_id"])
+            await finish_page(file_index, file_id, error=e)
+
+    # The remaining pages are spread over the page pool, results are reported as they finish.
+    # Pages and the registration reference go through shared memory, the pool only gets handles
+    if len(pages) > 0:
+        loop = asyncio.get_running_loop()
+        job_memory = get_job_shared_memory(job["task_id"])
+
+        shared_registration, reference_ref = None, None
+        if registration is not None:
+            shared_registration, reference_ref = share_registration(registration, job_memory)
+
+        page_of_future = {}
+        for file_index, file_id in pages:
+            try:
+                file = get_file(file_id)
+                if isinstance(file, RenderedPage):
+                    file_ref, page_scale = job_memory.share(file.image), file.scale
+                else:
+                    file_ref, page_scale = job_memory.share(np.frombuffer(file, dtype=np.uint8)), None
+                file = None
+                if reference_ref is not None:
+                    job_memory.acquire(reference_ref)
+                future = loop.run_in_executor(page_pool, find_circles_in_page_process,
+                                              job, file_id, file_ref, get_page_info(file_index), shared_registration, reference_ref,
+                                              page_scale)
+                page_of_future[future] = (file_index, file_id, file_ref)
+            except Exception as e:
+                await finish_page(file_index, file_id, error=e)
+
+        # The job's own hold on the reference, the pages release theirs as they finish
+        if reference_ref is not None:
+            job_memory.release(reference_ref)
+
+        pending = set(page_of_future)
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in sorted(done, key=lambda future: page_of_future[future][0]):
+                file_index, file_id, file_ref = page_of_future[future]
+                job_memory.release(file_ref)
+                if reference_ref is not None:
+                    job_memory.release(reference_ref)
+                try:
+                    circles_per_box, _ = future.result()
+                    await finish_page(file_index, file_id, circles_per_box)
+                except Exception as e:
+                    await finish_page(file_index, file_id, error=e)
+
+    # Results are merged back in page order
+    circles_final = {file_id: page_results[file_id] for file_id in job["file_ids"] if file_id in page_results}
 
     # Add final summary for multi-page documents
     if total_files > 1:
@@ -326,6 +522,7 @@ async def handle_find_circles(job, websocket):
         "status": WebsocketMessageStatus.COMPLETED_TASK,
         "data": {
             "task_id": job["task_id"],
+            "processing_seconds": job_processing_seconds(job),
             "circles": circles_final
         }
     }))
@@ -338,68 +535,79 @@ async def send_progress(websocket: websockets.ClientProtocol, message, task_id):
     }}))
 
 async def connect_to_websocket():
+    global connected_websocket, connection_count
     uri = config.get_websocket_uri()
 
     id = random.randbytes(32).hex()
     while True:
         try: 
-            async with connect(uri,subprotocols=[f"processing-computer-internal-{Utils.get_version()}-{id}"]) as websocket:
+            async with connect(uri,subprotocols=[internal_subprotocol(Utils.get_version(), id)]) as websocket:
                 Utils.log_info(f"Connected to websocket: {uri}")
+                connected_websocket = websocket
+                connection_count += 1
+                # One request per free compute slot, running jobs ask for theirs when they end
+                await request_jobs(max(0, get_job_scheduler().max_slots - active_jobs))
                 while True:
                     try:
                         response = await websocket.recv()
                         #Utils.log_info(f"Received: {response}")
-                        response = json.loads(response)
+                        # File chunks come as binary frames, everything else as JSON text
+                        if isinstance(response, bytes):
+                            response = chunk_message(decode_chunk(response))
+                        else:
+                            response = json.loads(response)
                         
 
 
                         
 
-                        if type(response["data"]) == dict and response["data"]["task_id"] not in messages_per_task_id:
-                            messages_per_task_id[response["data"]["task_id"]] = SimpleQueue()
+                        if type(response["data"]) == dict:
+                            transfer_store.mailbox(response["data"]["task_id"])
 
 
                         
                         if "command" in response:
                             if response["command"] == WebsocketMessageCommand.READ_TO_IMAGES or response["command"] == WebsocketMessageCommand.FIND_CIRCLES:
-                                Utils.log_info(f"len of files: {len(files_received)}, len of chunks: {len(chunks_per_file_id)}, len of messages: {len(messages_per_task_id)}")
-                                asyncio.create_task(handle_job_received({
+                                Utils.log_info(f"Transfers: {transfer_store.stats()}")
+                                asyncio.create_task(run_received_job({
                                     "command": response["command"],
                                     **response["data"]
                                 },websocket))
                             if response["command"] == WebsocketMessageCommand.PING:
-                                await websocket.send(json.dumps({"status": WebsocketMessageStatus.PONG}))
+                                await websocket.send(json.dumps({"status": WebsocketMessageStatus.PONG, "data": {
+                                    **get_job_scheduler().load(),
+                                    "transfers": transfer_store.stats(),
+                                    "content_store": get_content_store().stats(),
+                                    "page_cache": get_page_cache().stats()
+                                }}))
                         else:
                             
 
                             if response["status"] == WebsocketMessageStatus.SENDING_CHUNK:
-                                if response["data"]["file_id"] not in chunks_per_file_id:
-                                    chunks_per_file_id[response["data"]["file_id"]] = bytearray()
-                                chunks_per_file_id[response["data"]["file_id"]] += bytearray(b64decode(response["data"]["chunk"]))
-                                #await send_progress(websocket, f'Received chunk on Internal Client, current size: {len(chunks_per_file_id[response["data"]["file_id"]])}', response["data"]["task_id"])
+                                transfer_store.receive_chunk(response["data"]["task_id"], response["data"])
                             
                             if response["status"] == WebsocketMessageStatus.FINAL_CHUNK:
 
-                                if response["data"]["file_id"] not in chunks_per_file_id:
-                                    chunks_per_file_id[response["data"]["file_id"]] = bytearray()
-
                                 Utils.log_info(f"Received final chunk for file: {response['data']['file_id']}")
-                                chunks_per_file_id[response["data"]["file_id"]] += bytearray(b64decode(response["data"]["chunk"]))
-                                files_received[response["data"]["file_id"]] = chunks_per_file_id[response["data"]["file_id"]]
-                                del chunks_per_file_id[response["data"]["file_id"]]
+                                transfer = transfer_store.receive_chunk(response["data"]["task_id"], response["data"])
 
-                                await send_progress(websocket, f'Received final chunk on Internal Client, total size: {len(files_received[response["data"]["file_id"]])}', response["data"]["task_id"])
+                                await send_progress(websocket, f'Received final chunk on Internal Client, total size: {len(transfer)}', response["data"]["task_id"])
 
-                                messages_per_task_id[response["data"]["task_id"]].put({"status": InternalClientMessageType.FILE_RECEIVED, "data": {
+                                transfer_store.mailbox(response["data"]["task_id"]).put_nowait({"status": InternalClientMessageType.FILE_RECEIVED, "data": {
                                     "file_id": response["data"]["file_id"]
                                 }}) 
 
                             if response["status"] == WebsocketMessageStatus.ERROR:
                                 Utils.log_error(f"Received error: {response['error']}")
                                 break
-                    except ConnectionClosedError as e:
+                    except ConnectionClosed as e:
                         Utils.log_error(f"Connection closed: {e}")
                         break
+                    except TransferQuotaExceeded as e:
+                        Utils.log_error(f"Transfer rejected: {e}")
+                    except TransferRejected:
+                        # The rest of an evicted upload, counted in the store's rejected_chunks
+                        pass
                     except Exception as e:
                         Utils.log_error(f"An error occurred: {e}")
         
@@ -407,6 +615,9 @@ async def connect_to_websocket():
                 Utils.log_error(f"An error occurred while connecting to websocket: {e}")
 
         finally:
+            connected_websocket = None
+            # Uploads of the lost connection will never complete, running jobs keep their files
+            transfer_store.evict_unpinned("Connection to the relay closed.")
             Utils.log_info("Connection closed... retrying in 5 seconds")
             await asyncio.sleep(5)
 
@@ -432,6 +643,9 @@ async def monitor_memory():
             print(f"System Memory Used: {used_memory_percent:.1f}%")
             print(f"System Memory Available: {system_memory.available / 1024 / 1024:.2f} MB")
             print(f"System Memory Total: {system_memory.total / 1024 / 1024:.2f} MB")
+            print(f"Transfers: {transfer_store.stats()}")
+            print(f"Content store: {get_content_store().stats()}")
+            print(f"Page cache: {get_page_cache().stats()}")
             print("-" * 60)
             print_counter = 0  # Reset counter
         
@@ -442,6 +656,13 @@ async def monitor_memory():
         await asyncio.sleep(CHECK_INTERVAL)  # Check based on config
         print_counter += 1
 
+async def expire_transfers():
+    """Evict transfers idle for longer than TRANSFER_TTL_SECONDS, checking a few times per TTL."""
+    interval = min(60, max(1, transfer_store.ttl / 4))
+    while True:
+        await asyncio.sleep(interval)
+        transfer_store.evict_expired()
+
 async def reset_script():
     """
     Resets the script by terminating the current process and restarting it.
@@ -456,11 +677,15 @@ async def reset_script():
 async def main():
     # Start memory monitoring task
     asyncio.create_task(monitor_memory())
+    asyncio.create_task(expire_transfers())
     
     # Your existing asyncio tasks...
     await connect_to_websocket()  # Example of existing main function
 
 if __name__ == "__main__":
+    # The page pool spawns processes, which needs this in frozen builds
+    multiprocessing.freeze_support()
+
     # Load and apply configuration
     if config.is_debug_mode():
         config.print_config_summary()
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+import numpy as np
+from config_loader import config
+
+
+class RenderedPage(NamedTuple):
+    """A calibrated page at the resolution it was rendered at."""
+    image: np.ndarray  # BGR
+    scale: float  # Width of image divided by the width of the page sent to the client
+
+
+class PageCache:
+    """
+    Bounded in-memory cache of the full-resolution pages a worker rendered.
+
+    read_to_images sends the client pages at most 800 px wide. The calibrated page at its
+    rendered resolution is kept here under the content hash of the page that was sent, so
+    a find circles job uploading that page again is detected on the full-resolution one.
+    The least recently used pages are dropped once the cache grows past max_bytes. Jobs run
+    on several threads, every operation takes the cache's lock.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        """
+        Args:
+            max_bytes: Memory the cached pages may take, 0 disables the cache. Defaults to
+                PAGE_CACHE_MB
+        """
+        self.max_bytes = max_bytes if max_bytes is not None else config.get_image_config()['cache_mb'] * 1024 * 1024
+
+        self._pages: "OrderedDict[str, RenderedPage]" = OrderedDict()  # hash -> page, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def put(self, address: str, page: RenderedPage) -> None:
+        """Keep the full-resolution page of the sent page with this hash."""
+        if not self.enabled or page.image.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._pages.pop(address, None)
+            if previous is not None:
+                self._size -= previous.image.nbytes
+            self._pages[address] = page
+            self._size += page.image.nbytes
+
+            while self._size > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._size -= evicted.image.nbytes
+
+    def get(self, address: Optional[str]) -> Optional[RenderedPage]:
+        """Return the full-resolution page of the sent page with this hash, None if it isn't cached."""
+        with self._lock:
+            page = self._pages.get(address) if address is not None else None
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(address)
+            self.hits += 1
+            return page
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pages": len(self._pages),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
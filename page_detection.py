@@ -0,0 +1,336 @@
+import asyncio
+import copy
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+from config_loader import config
+from find_circles import find_circles_cv2, find_circles_fallback
+from job_shared_memory import attach_shared_array
+from page_cache import RenderedPage
+from page_preprocessing import PagePreprocessor
+from page_registration import PageRegistration
+from transfer_buffer import BufferReader
+from utils import Utils
+from websocket_types import BoxRectangleType, HoughSearchMode
+
+
+class PageLoadError(Exception):
+    """The page image could not be decoded, the page is skipped."""
+
+
+def page_offset(job, file):
+    """
+    The job's image offset in pixels of the page being detected, None if it has none.
+
+    Offsets are given in pixels of the page the client was sent, a RenderedPage is scaled up
+    from it.
+    """
+    if not job.get("image_offset"):
+        return None
+    scale = file.scale if isinstance(file, RenderedPage) else 1
+    return job["image_offset"]["x"] * scale, job["image_offset"]["y"] * scale
+
+
+def load_page(job, file):
+    """
+    Decode a page and apply the job's offset and rotation to it.
+
+    The encoded page is decoded in place from its buffer, formats OpenCV can't read go
+    through PIL. A RenderedPage is used as is.
+
+    Raises:
+        PageLoadError: If the file is not a readable image
+    """
+    if isinstance(file, RenderedPage):
+        cv_image = file.image.copy()
+    else:
+        cv_image = decode_page(file)
+
+    # Apply image transformations
+    offset = page_offset(job, file)
+    if offset is not None:
+        M = np.float32([[1, 0, offset[0]], [0, 1, offset[1]]])
+        cv_image = cv2.warpAffine(cv_image, M, cv_image.shape[1::-1], flags=cv2.INTER_LINEAR)
+
+    if job.get("image_angle") is not None:
+        center = (cv_image.shape[1] // 2, cv_image.shape[0] // 2)
+        M = cv2.getRotationMatrix2D(center, -job["image_angle"], 1)
+        cv_image = cv2.warpAffine(cv_image, M, cv_image.shape[1::-1])
+
+    return cv_image
+
+
+def decode_page(file):
+    """
+    Decode an encoded page into a BGR image.
+
+    Raises:
+        PageLoadError: If the file is not a readable image
+    """
+    try:
+        # EXIF orientation is ignored, as PIL does, so box rectangles keep matching the page
+        cv_image = cv2.imdecode(np.frombuffer(file, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if cv_image is None:
+            image = Image.open(BufferReader(file))
+            cv_image = cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+            image.close()  # Explicitly close PIL Image
+    except Exception as e:
+        raise PageLoadError(str(e)) from e
+
+    return cv_image
+
+
+async def find_circles_in_page(job, file_id, file, page_info="", registration=None, on_progress=None):
+    """
+    Find the circles of every box of a find circles job on one page.
+
+    An EXEMPLO_CIRCULO box updates job["circle_size"] for the boxes after it.
+
+    Args:
+        job: Find circles job
+        file_id: Id of the page file, used in progress messages
+        file: Encoded page image, or the RenderedPage of the page kept by the worker
+        page_info: Prefix of the progress messages of this page
+        registration: PageRegistration of the job's reference page, None to run the full
+            detection on every box
+        on_progress: Async callback receiving progress messages
+
+    Returns:
+        Tuple of (circles_per_box, reference). circles_per_box maps box names to their circles,
+        normalized to the page size. reference is a PageRegistration built from this page when
+        the job uses template registration, no reference was given and every box succeeded,
+        otherwise None.
+
+    Raises:
+        PageLoadError: If the page image could not be decoded
+    """
+    async def send(message):
+        if on_progress is not None:
+            await on_progress(f"{page_info}{message}")
+
+    cv_image = load_page(job, file)
+    offset = page_offset(job, file)
+
+    await send(f"Processing image: {file_id}\nStarting page analysis...")
+
+    # Scale the page once for all of its boxes, at the resolution their circle size needs
+    page = PagePreprocessor(cv_image)
+    page_width = page.original_width
+    page_height = page.original_height
+
+    # With template registration the first fully detected page becomes the reference and the
+    # later pages only read the fill of its circles, moved onto them
+    use_registration = job.get("use_template_registration", False)
+
+    warp = None
+    if registration is not None:
+        warp = registration.align(cv_image)
+        if warp is None:
+            await send("Page does not match the reference page, running full detection...")
+
+    # Circles of this page relative to its size, kept as templates if it becomes the reference
+    reference_circles = {}
+    reference_complete = True
+
+    circles_per_box = {}
+
+    # Sort boxes with exemplo circles first
+    boxes = sorted(job.get("boxes", []), key=lambda x: 0 if x.get("rect_type") == BoxRectangleType.EXEMPLO_CIRCULO else 1)
+    total_boxes = len(boxes)
+
+    for box_index, box in enumerate(boxes):
+        try:
+            rect = box.get("rect")
+            rect_type = box.get("rect_type")
+            box_name = box.get("name")
+
+            if not all([rect, rect_type, box_name]):
+                continue
+
+            circle_size = job.get("circle_size")
+            if rect_type == BoxRectangleType.EXEMPLO_CIRCULO:
+                circle_size = None
+
+            # Prepare rectangle info for progress tracking
+            rectangle_info = {
+                'index': box_index + 1,
+                'total': total_boxes,
+                'name': box_name,
+                'page_info': page_info  # Add page info to rectangle info
+            }
+
+            if job.get("use_fallback_method") and box.get("template_circles"):
+                circles = await find_circles_fallback("",
+                    rect,
+                    rectangle_type=rect_type,
+                    template_circles=box["template_circles"],
+                    darkness_threshold=job.get("darkness_threshold", 0),
+                    page=page,
+                    on_progress=send
+                )
+            elif warp is not None:
+                circles = await find_circles_fallback("",
+                    rect,
+                    rectangle_type=rect_type,
+                    template_circles=registration.template_circles(box_name, warp),
+                    darkness_threshold=job.get("darkness_threshold", 0),
+                    page=page,
+                    on_progress=send
+                )
+            else:
+                circles = await find_circles_cv2("", rect, rect_type,
+                    page=page,
+                    circle_size=circle_size,
+                    dp=job.get("inverse_ratio_accumulator_resolution", 1),
+                    darkness_threshold=job.get("darkness_threshold", 0),
+                    circle_precision_percentage=job.get("circle_precision_percentage", 1),
+                    param2=job.get("param2", 30),
+                    search_mode=job.get("hough_search_mode", HoughSearchMode.GRID),
+                    on_progress=send,
+                    rectangle_info=rectangle_info
+                )
+
+            if use_registration and registration is None:
+                reference_circles[box_name] = [
+                    {
+                        "center_x": circle["center_x"] / page_width,
+                        "center_y": circle["center_y"] / page_height,
+                        "radius": circle["radius"] / page_width
+                    }
+                    for circle in circles
+                ]
+
+            # Process circles
+            if rect_type == BoxRectangleType.EXEMPLO_CIRCULO and circles:
+                job["circle_size"] = circles[0]["radius"] / page_width
+
+            for circle in circles:
+                # Normalize coordinates
+                if offset is not None:
+                    circle["center_x"] -= offset[0]
+                    circle["center_y"] -= offset[1]
+
+                if job.get("image_angle") is not None:
+                    center = (page_width // 2, page_height // 2)
+                    M = cv2.getRotationMatrix2D(center, job["image_angle"], 1)
+                    circle["center_x"], circle["center_y"] = cv2.transform(
+                        np.array([[circle["center_x"],circle["center_y"]]]).reshape(-1,1,2),
+                        M
+                    ).reshape(2)
+
+                # Normalize to image dimensions
+                circle["center_x"] /= page_width
+                circle["center_y"] /= page_height
+                circle["radius"] /= page_width
+
+            circles_per_box[box_name] = circles
+
+        except Exception as e:
+            Utils.log_error(f"Error processing box {box_name}: {str(e)}")
+            circles_per_box[box_name] = []
+            reference_complete = False
+
+    reference = None
+    if use_registration and registration is None and reference_complete and reference_circles:
+        reference = PageRegistration(cv_image, reference_circles)
+        Utils.log_info(f"Using page {file_id} as the registration reference")
+
+    return circles_per_box, reference
+
+
+def share_registration(registration, job_memory):
+    """
+    Prepare a PageRegistration to be sent to the page pool.
+
+    Returns:
+        Tuple of (registration, reference_ref), a copy of registration without its reference
+        image and the handle of the reference image in job_memory
+    """
+    reference_ref = job_memory.share(registration.reference)
+    shared = copy.copy(registration)
+    shared.reference = None
+    return shared, reference_ref
+
+
+def find_circles_in_page_process(job, file_id, file_ref, page_info="", registration=None, reference_ref=None,
+                                 page_scale=None):
+    """
+    Page pool entry point, runs find_circles_in_page without progress messages.
+
+    file_ref holds the encoded page, or with page_scale the image of a RenderedPage. The page
+    and the reference image of the registration are read straight from the
+    job's shared memory (see share_registration), only their handles travel through the pool.
+    The job is a copy in the pool process, so the circle size an EXEMPLO_CIRCULO box finds
+    only applies to the boxes of its own page.
+    """
+    segments = []
+    try:
+        file, segment = attach_shared_array(file_ref)
+        segments.append(segment)
+        if page_scale is not None:
+            file = RenderedPage(file, page_scale)
+
+        if registration is not None and reference_ref is not None:
+            registration.reference, segment = attach_shared_array(reference_ref)
+            segments.append(segment)
+
+        return asyncio.run(find_circles_in_page(job, file_id, file, page_info, registration))
+    finally:
+        # The views must be gone before their segments can be closed
+        file = None
+        if registration is not None:
+            registration.reference = None
+        for segment in segments:
+            segment.close()
+
+
+def init_page_worker(threads, debug):
+    """Cap the threads of a page process so the pool as a whole doesn't oversubscribe the CPU."""
+    Utils.set_debug(debug)
+    cv2.setNumThreads(threads)
+    config.set('HOUGH_SWEEP_WORKERS', threads)
+
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def get_page_workers() -> int:
+    """Number of pages of a multi-page job detected at the same time."""
+    workers = config.get_worker_config()['page_workers']
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def get_page_pool():
+    """
+    Return the shared process pool pages of multi-page jobs are spread over, or None when
+    PAGE_WORKERS runs the pages one after another.
+
+    The pool uses spawned processes, the job threads of the parent make forking unsafe.
+    Every process gets an equal share of the cores for OpenCV and the Hough sweep.
+    """
+    global _page_pool
+
+    workers = get_page_workers()
+    if workers == 1:
+        return None
+
+    # Jobs run on several threads, only one of them may start the pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            _page_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_page_worker,
+                initargs=(threads, Utils.is_debug())
+            )
+            Utils.log_info(f"Page pool started with {workers} processes, {threads} threads each")
+
+    return _page_pool
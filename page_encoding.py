@@ -0,0 +1,49 @@
+from io import BytesIO
+from config_loader import config
+
+# Codecs pages read by read_to_images can be sent back in, with their MIME type
+PAGE_CODECS = {
+    "png": "image/png",
+    "png-gray": "image/png",
+    "webp": "image/webp",
+}
+
+
+def get_page_codec() -> str:
+    """
+    Codec of the page images sent back to the relay.
+
+    Raises:
+        ValueError: If PAGE_IMAGE_CODEC is not one of PAGE_CODECS
+    """
+    codec = config.get_image_config()['codec'].lower()
+    if codec not in PAGE_CODECS:
+        raise ValueError(f"Unknown page image codec {codec}, expected one of {', '.join(PAGE_CODECS)}.")
+    return codec
+
+
+def page_mime_type(codec: str = None) -> str:
+    return PAGE_CODECS[codec or get_page_codec()]
+
+
+def encode_page(image, codec: str = None) -> bytes:
+    """
+    Compress a PIL page image once into the bytes that are sent as is.
+
+    Args:
+        image: PIL image
+        codec: One of PAGE_CODECS, defaults to PAGE_IMAGE_CODEC. png-gray drops the colour,
+            webp is lossless
+    """
+    codec = codec or get_page_codec()
+    image_config = config.get_image_config()
+    buffer = BytesIO()
+
+    if codec == "webp":
+        image.save(buffer, format="WEBP", lossless=True, method=image_config['webp_method'])
+    else:
+        if codec == "png-gray":
+            image = image.convert("L")
+        image.save(buffer, format="PNG", compress_level=image_config['png_compression'])
+
+    return buffer.getvalue()
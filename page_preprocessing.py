@@ -0,0 +1,104 @@
+import cv2
+from config_loader import config
+
+
+class ScaledPage:
+    """
+    The page resized to the working width of a detection, boxes crop their rectangle out of it.
+    """
+
+    def __init__(self, image, width: int, width_ratio: float, scale: float):
+        """
+        Args:
+            image: BGR page resized by width_ratio
+            width: Working width the page was scaled for
+            width_ratio: Scaled width divided by the original page width
+            scale: Working width divided by PagePreprocessor.REFERENCE_WIDTH, pixel sized
+                detection parameters tuned at the reference width are multiplied by it
+        """
+        self.image = image
+        self.width = width
+        self.width_ratio = width_ratio
+        self.scale = scale
+
+    def rectangle_to_pixels(self, rectangle):
+        """
+        Convert a relative rectangle to (x, y, width, height) in scaled page pixels.
+
+        Raises:
+            ValueError: If any of the rectangle values is outside of [0, 1]
+        """
+        old_x, old_y, width, height = rectangle.values()
+
+        if old_x > 1 or old_y > 1 or width > 1 or height > 1 or old_x < 0 or old_y < 0 or width < 0 or height < 0:
+            raise ValueError("The rectangle values must be between 0 and 1.")
+
+        x = int(old_x * self.image.shape[1])
+        y = int(old_y * self.image.shape[0])
+        width = int(width * self.image.shape[1])
+        height = int(height * self.image.shape[0])
+        return x, y, width, height
+
+    def crop(self, x, y, width, height):
+        """Return a read-only view of the box on the scaled page, callers that draw on it must copy it first."""
+        return self.image[y:y+height, x:x+width]
+
+    def kernel_size(self, reference_size: int) -> int:
+        """Scale an odd kernel size tuned at the reference width, the result stays odd and at least 3."""
+        return max(3, int(round(reference_size * self.scale)) | 1)
+
+
+class PagePreprocessor:
+    """
+    Page-scoped preprocessing shared by every box detected on the same page.
+
+    Detection runs on the page resized so the expected bubble radius lands on
+    DETECTION_TARGET_RADIUS pixels, never wider than REFERENCE_WIDTH. Resizing the full
+    colour page is by far the largest allocation of a box, so the last scaled page is kept
+    and every box with the same working width crops its rectangle out of it.
+    """
+
+    # Width the detection parameters were tuned at, also used when the circle size is unknown
+    REFERENCE_WIDTH = 4000
+
+    def __init__(self, img, target_radius: float = None):
+        """
+        Args:
+            img: BGR page image
+            target_radius: Bubble radius in pixels to scale the page for, 0 always uses
+                REFERENCE_WIDTH. Defaults to DETECTION_TARGET_RADIUS
+        """
+        if target_radius is None:
+            target_radius = config.get_detection_config()['target_radius']
+
+        self.original = img
+        self.original_height, self.original_width = img.shape[:2]
+        self.target_radius = target_radius
+        self._scaled = None
+
+    def working_width(self, circle_size=None) -> int:
+        """
+        Width the page is scaled to for a detection.
+
+        Args:
+            circle_size: Expected bubble radius relative to the page width, None if unknown
+        """
+        if circle_size is None or circle_size <= 0 or self.target_radius <= 0:
+            return self.REFERENCE_WIDTH
+
+        return max(1, min(self.REFERENCE_WIDTH, int(round(self.target_radius / circle_size))))
+
+    def scaled(self, circle_size=None) -> ScaledPage:
+        """Return the page scaled for circle_size, resizing it only when the working width changes."""
+        width = self.working_width(circle_size)
+
+        if self._scaled is None or self._scaled.width != width:
+            # Release the previous scale first, boxes of a page rarely switch back to it
+            self._scaled = None
+            width_ratio = width / self.original_width
+            image = cv2.resize(self.original, fx=width_ratio, fy=width_ratio, dsize=(0, 0))
+            # Boxes share this buffer, so nothing may draw on it in place
+            image.flags.writeable = False
+            self._scaled = ScaledPage(image, width, width_ratio, width / self.REFERENCE_WIDTH)
+
+        return self._scaled
@@ -0,0 +1,94 @@
+from typing import Dict, List, Optional
+import cv2
+import numpy as np
+from config_loader import config
+from utils import Utils
+
+
+class PageRegistration:
+    """
+    Reference page of a batch of identical answer cards, used to skip the Hough sweep on the rest.
+
+    The circles found on the reference page become templates. Every later page is aligned to
+    the reference with an affine transform estimated on small grayscale copies of both pages,
+    and the templates are moved with it, so only the fill of the known circles has to be read.
+    """
+
+    def __init__(self, reference_img, circles_per_box: Dict[str, List[Dict]], width: int = None,
+                 min_correlation: float = None):
+        """
+        Args:
+            reference_img: BGR reference page, in the same frame later pages are passed in
+            circles_per_box: Box name -> circles found on the reference page, with center_x and
+                radius relative to the page width and center_y relative to the page height
+            width: Width of the downscaled copies the alignment runs on, defaults to
+                REGISTRATION_WIDTH
+            min_correlation: Lowest ECC correlation accepted as a match, defaults to
+                REGISTRATION_MIN_CORRELATION
+        """
+        detection_config = config.get_detection_config()
+        self.width = width if width is not None else detection_config['registration_width']
+        self.min_correlation = min_correlation if min_correlation is not None else detection_config['registration_min_correlation']
+
+        height, page_width = reference_img.shape[:2]
+        self.size = (self.width, max(1, int(round(height * self.width / page_width))))
+        self.reference = self._downscale(reference_img)
+        self.circles_per_box = {
+            box_name: [{key: circle[key] for key in ("center_x", "center_y", "radius")} for circle in circles]
+            for box_name, circles in circles_per_box.items()
+        }
+
+    def _downscale(self, img):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Every page is stretched to the reference size, so relative coordinates line up
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def align(self, img) -> Optional[np.ndarray]:
+        """
+        Estimate the affine transform from the reference page to img.
+
+        Returns:
+            2x3 matrix mapping downscaled reference pixels to downscaled img pixels, or None
+            when the pages do not match well enough to reuse the templates
+        """
+        warp = np.eye(2, 3, dtype=np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 100, 1e-5)
+
+        try:
+            correlation, warp = cv2.findTransformECC(self.reference, self._downscale(img), warp,
+                                                     cv2.MOTION_AFFINE, criteria, None, 5)
+        except cv2.error as e:
+            Utils.log_info(f"Page registration did not converge: {str(e).strip()}")
+            return None
+
+        if correlation < self.min_correlation:
+            Utils.log_info(f"Page registration correlation {correlation:.3f} is below {self.min_correlation}")
+            return None
+
+        return warp
+
+    def template_circles(self, box_name: str, warp: np.ndarray) -> List[Dict]:
+        """
+        Move the reference circles of a box onto the aligned page.
+
+        Returns:
+            Circles with center_x and radius relative to the page width and center_y relative
+            to the page height, the template_circles format of find_circles_fallback
+        """
+        circles = self.circles_per_box.get(box_name, [])
+        if len(circles) == 0:
+            return []
+
+        width, height = self.size
+        points = np.array([[circle["center_x"] * width, circle["center_y"] * height] for circle in circles])
+        moved = points @ warp[:, :2].T + warp[:, 2]
+        radius_scale = np.sqrt(abs(np.linalg.det(warp[:, :2])))
+
+        return [
+            {
+                "center_x": float(x / width),
+                "center_y": float(y / height),
+                "radius": float(circle["radius"] * radius_scale)
+            }
+            for (x, y), circle in zip(moved, circles)
+        ]
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Callable, Dict, List, Optional
+
+
+class PendingJob:
+    """A job waiting in the relay for a worker to claim it."""
+
+    def __init__(self, command: str, preferred_client: Optional[str]):
+        self.command = command
+        self.preferred_client = preferred_client
+        # Resolved with the id of the claiming client, or None when no worker can claim it
+        self.claimed = asyncio.get_running_loop().create_future()
+
+
+class PendingJobs:
+    """
+    Relay-side queue of jobs for internal clients that pull their work.
+
+    Such clients send REQUEST_JOB with the number of compute slots they have free, and one
+    more every time a job of theirs ends. Every slot is a credit. Jobs are handed out in
+    arrival order to clients with credits, to the client that rendered the job's pages if it
+    has one, otherwise to the client choose_client picks. Only then are the job and its files
+    sent, so a busy worker never receives work it can't start and idle workers take what
+    the others can't.
+    """
+
+    def __init__(self, choose_client: Callable[[List[str], str], str]):
+        """
+        Args:
+            choose_client: Called with the ids of the clients with credits and the job's
+                command, returns the one to give the job to
+        """
+        self.choose_client = choose_client
+        self._waiting: List[PendingJob] = []
+        self._credits: Dict[str, int] = {}  # client id -> jobs it asked for
+
+    @property
+    def pull_clients(self) -> List[str]:
+        """Clients that pull their work."""
+        return list(self._credits)
+
+    def credits(self, client_id: str) -> int:
+        return self._credits.get(client_id, 0)
+
+    def __len__(self):
+        return len(self._waiting)
+
+    async def claim(self, command: str, preferred_client: Optional[str] = None) -> Optional[str]:
+        """
+        Wait until a client claims a job.
+
+        Returns:
+            Id of the client to send the job to, None if every pulling client disconnected
+            while the job waited
+        """
+        job = PendingJob(command, preferred_client)
+        self._waiting.append(job)
+        self._dispatch()
+
+        try:
+            return await job.claimed
+        except asyncio.CancelledError:
+            # The request went away after a client claimed the job, its slot is still free
+            if job.claimed.done() and not job.claimed.cancelled() and job.claimed.result() in self._credits:
+                self.add_credits(job.claimed.result(), 1)
+            raise
+        finally:
+            if job in self._waiting:
+                self._waiting.remove(job)
+
+    def add_credits(self, client_id: str, count: int) -> None:
+        """Record the free compute slots a client asked work for and hand it waiting jobs."""
+        self._credits[client_id] = self._credits.get(client_id, 0) + max(0, count)
+        self._dispatch()
+
+    def remove_client(self, client_id: str) -> None:
+        """Forget the credits of a disconnected client, it asks again when it reconnects."""
+        self._credits.pop(client_id, None)
+
+        if len(self._credits) == 0:
+            for job in self._waiting:
+                if not job.claimed.done():
+                    job.claimed.set_result(None)
+            self._waiting.clear()
+
+    def _dispatch(self) -> None:
+        while len(self._waiting) > 0:
+            available = [client_id for client_id, credits in self._credits.items() if credits > 0]
+            if len(available) == 0:
+                return
+
+            job = self._waiting.pop(0)
+            if job.claimed.done():
+                # The request of the job went away while it waited
+                continue
+
+            if job.preferred_client in available:
+                client_id = job.preferred_client
+            else:
+                client_id = self.choose_client(available, job.command)
+
+            self._credits[client_id] -= 1
+            job.claimed.set_result(client_id)
@@ -7,15 +7,18 @@ import sys
 from pathlib import Path
 from PIL import Image
 import cv2
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_bytes, convert_from_path
 import json
 from find_circles import find_circles, find_circles_cv2
 from internal_calibrate import (
+    apply_calibration_geometry,
     apply_calibration_to_image,
     get_calibration_center_for_image,
     get_calibration_rect_for_image,
 )
 from fastapi import UploadFile
+from page_cache import RenderedPage
+from transfer_buffer import BufferReader
 
 from utils import Utils
 
@@ -37,11 +40,26 @@ def get_poppler_path():
         return None
 
 
-async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=None):
+async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=None, full_resolution=False,
+                         first_page=None, last_page=None):
+    """
+    Convert a PDF or an image into calibrated pages at most 800 px wide.
+
+    first_page and last_page, counted from 1, limit the PDF pages read. Pages past the end of
+    the PDF are ignored, None reads from the start or to the end.
+
+    With full_resolution the result also has "full_resolution_images", every calibrated page
+    as a RenderedPage at the resolution it was rendered at, for the worker's PageCache.
+    """
     print("Reading data to images...")
 
-    # Read file bytes
-    bytes_arr = await file.read()
+    # Read file bytes, files that expose their buffer (BytesIO, transfer buffers) are read in place
+    source = file.file
+    source_path = getattr(source, "path", None)
+    if hasattr(source, "getbuffer"):
+        bytes_arr = source.getbuffer()
+    else:
+        bytes_arr = await file.read()
 
     if file.filename.endswith(".pdf"):
         if on_progress:
@@ -51,12 +69,17 @@ async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=N
             # Get poppler path for PyInstaller builds
             poppler_path = get_poppler_path()
             
-            if poppler_path:
+            if source_path:
+                # The PDF is already on disk, convert_from_bytes would write it out again
+                images = convert_from_path(source_path, thread_count=4, poppler_path=poppler_path,
+                                           first_page=first_page, last_page=last_page)
+            elif poppler_path:
                 # Use bundled poppler
-                images = convert_from_bytes(bytes_arr, thread_count=4, poppler_path=poppler_path)
+                images = convert_from_bytes(bytes_arr, thread_count=4, poppler_path=poppler_path,
+                                            first_page=first_page, last_page=last_page)
             else:
                 # Use system poppler
-                images = convert_from_bytes(bytes_arr, thread_count=4)
+                images = convert_from_bytes(bytes_arr, thread_count=4, first_page=first_page, last_page=last_page)
 
             if on_progress:
                 await on_progress(f"Converted PDF, {len(images)} pages")
@@ -78,7 +101,7 @@ async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=N
             
             return None
     else:
-        images = [Image.open(io.BytesIO(bytes_arr))]
+        images = [Image.open(source_path or BufferReader(bytes_arr))]
         if on_progress:
             await on_progress("Read image")
 
@@ -87,6 +110,7 @@ async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=N
         "image_calibration_rects": {},
         "image_sizes": {},
     }
+    full_resolution_images = {}
 
     with tempfile.TemporaryDirectory() as temp_dir:
         for i, image in enumerate(images):
@@ -98,6 +122,8 @@ async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=N
 
             print(f"Saving image to {image_path}")
 
+            rendered_image = image
+
             # Resize if width is greater than 800
             if image.width > 800:
                 width_ratio = 800 / image.width
@@ -117,10 +143,17 @@ async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=N
                 if on_progress:
                     await on_progress(f"Applying calibration to image {i}")
 
-                img = apply_calibration_to_image(image, calibration_rect)
-                img, _alpha, _beta = Utils.automatic_brightness_and_contrast(img)
+                img, geometry = apply_calibration_to_image(image, calibration_rect, return_geometry=True)
+                img, alpha, beta = Utils.automatic_brightness_and_contrast(img)
                 img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
 
+                if full_resolution:
+                    # The rendered page gets the rotation, crop and contrast found on the small one
+                    scale = rendered_image.width / image.width
+                    full_img = apply_calibration_geometry(rendered_image, geometry, scale)
+                    full_img = cv2.convertScaleAbs(full_img, alpha=alpha, beta=beta)
+                    full_resolution_images[random_hash] = RenderedPage(full_img, full_img.shape[1] / img.width)
+
                 if on_progress:
                     await on_progress(f"Applied calibration to image {i}")
 
@@ -137,4 +170,7 @@ async def read_to_images(file: UploadFile, needs_calibration=True, on_progress=N
     if not needs_calibration:
         return list(final_json["images"].keys())
 
+    if full_resolution:
+        final_json["full_resolution_images"] = full_resolution_images
+
     return final_json
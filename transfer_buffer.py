@@ -0,0 +1,149 @@
+import io
+import mmap
+import os
+import tempfile
+from typing import Optional
+from config_loader import config
+from utils import Utils
+
+
+class TransferBuffer:
+    """
+    Destination of one file received in chunks.
+
+    When the sender announces the file size the buffer is allocated once and every chunk is
+    written in place. Files larger than TRANSFER_SPILL_THRESHOLD_MB are written to a
+    memory-mapped temporary file instead of memory, so the page cache holds them and the OS
+    can drop them under pressure. Transfers of unknown size grow an in-memory buffer.
+    """
+
+    def __init__(self, total_size: Optional[int] = None, spill_threshold: Optional[int] = None,
+                 spill_dir: Optional[str] = None):
+        """
+        Args:
+            total_size: Size of the file in bytes, None if the sender doesn't announce it
+            spill_threshold: Size in bytes above which the file goes to disk, defaults to
+                TRANSFER_SPILL_THRESHOLD_MB
+            spill_dir: Directory of the temporary files, defaults to TRANSFER_SPILL_DIR or the
+                system temporary directory
+        """
+        transfer_config = config.get_transfer_config()
+        if spill_threshold is None:
+            spill_threshold = transfer_config['spill_threshold_mb'] * 1024 * 1024
+        if spill_dir is None:
+            spill_dir = transfer_config['spill_dir'] or None
+
+        self.total_size = total_size
+        self.received = 0
+        self.path = None
+        self._mmap = None
+
+        if total_size is None:
+            self._buffer = bytearray()
+        elif total_size > spill_threshold > 0:
+            fd, self.path = tempfile.mkstemp(prefix="transfer_", dir=spill_dir)
+            try:
+                os.ftruncate(fd, total_size)
+                self._mmap = mmap.mmap(fd, total_size)
+            except Exception:
+                os.close(fd)
+                os.unlink(self.path)
+                raise
+            os.close(fd)
+            self._buffer = self._mmap
+        else:
+            self._buffer = bytearray(total_size)
+
+    @property
+    def complete(self) -> bool:
+        return self.total_size is None or self.received >= self.total_size
+
+    @property
+    def data(self) -> memoryview:
+        """The received bytes, without copying them."""
+        return memoryview(self._buffer)[:self.received]
+
+    def write(self, offset: int, payload) -> None:
+        """
+        Write a chunk at offset, chunks must arrive in order.
+
+        Raises:
+            ValueError: If the chunk doesn't follow the bytes received or overflows the
+                announced size
+        """
+        if offset != self.received:
+            raise ValueError(f"Chunk at offset {offset} does not follow the {self.received} bytes received.")
+
+        end = offset + len(payload)
+        if self.total_size is None:
+            self._buffer += payload
+        elif end > self.total_size:
+            raise ValueError(f"Chunk ends at {end}, past the announced size of {self.total_size} bytes.")
+        else:
+            self._buffer[offset:end] = payload
+
+        self.received = end
+
+    def open(self):
+        """Return a seekable file object reading the received bytes, see BufferReader."""
+        return BufferReader(self.data, self.path)
+
+    def close(self) -> None:
+        """Release the memory or the temporary file of the transfer."""
+        self._buffer = bytearray()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A view is still alive, the mapping goes away with it
+                Utils.log_info(f"Transfer file {self.path} is still in use, unlinking it only")
+            self._mmap = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError as e:
+                Utils.log_error(f"Could not remove transfer file {self.path}: {e}")
+            self.path = None
+
+    def __len__(self):
+        return self.received
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only file object over a buffer, for readers that want a file (PIL, UploadFile).
+
+    Unlike io.BytesIO it does not copy the buffer. getbuffer() returns the buffer itself and
+    path is the file backing it, if any.
+    """
+
+    def __init__(self, buffer, path: Optional[str] = None):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+        self.path = path
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._view[self._position:self._position + len(b)]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        return self._view
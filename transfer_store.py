@@ -0,0 +1,234 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from config_loader import config
+from transfer_buffer import TransferBuffer
+from utils import Utils
+from websocket_chunks import receive_chunk
+from websocket_types import WebsocketMessageStatus
+
+
+class TransferQuotaExceeded(Exception):
+    """A new transfer does not fit in the store's quota, its task is failed."""
+
+
+class TransferRejected(Exception):
+    """A chunk of an evicted task, or of a file whose first chunk never arrived, is dropped."""
+
+# Evicted tasks remembered, so chunks the relay still sends for them don't start them again
+EVICTED_TASKS_REMEMBERED = 1024
+
+
+def transfer_footprint(transfer: Optional[TransferBuffer]) -> int:
+    """Bytes a transfer counts against the quota, its announced size or what it received so far."""
+    if transfer is None:
+        return 0
+    return transfer.total_size if transfer.total_size is not None else transfer.received
+
+
+class TaskTransfers:
+    """Files and mailbox of one task, with the time it last received anything."""
+
+    def __init__(self, now: float):
+        self.files: Dict[str, TransferBuffer] = {}
+        # Mailbox of the task, handle_job_received sleeps on it until the next file arrives
+        self.mailbox = asyncio.Queue()
+        self.last_activity = now
+        self.pinned = False
+
+    @property
+    def size(self) -> int:
+        return sum(transfer_footprint(transfer) for transfer in self.files.values())
+
+
+class TransferStore:
+    """
+    Files received by the worker and the mailboxes of their tasks.
+
+    Everything is grouped by task and timestamped on every chunk. A task that receives nothing
+    for ttl seconds, such as an upload cut off by a relay disconnect or files whose command
+    never arrived, is evicted. So are the oldest idle tasks when a new transfer would take
+    the store past quota_bytes. Tasks whose files are all in are pinned and only leave the store
+    through discard_task when their job ends. Evicted tasks get an error in their mailbox, so a
+    job waiting on them fails instead of waiting forever. The relay keeps sending the rest of
+    their files, those chunks are rejected rather than starting the task again.
+    """
+
+    def __init__(self, ttl: float = None, quota_bytes: int = None):
+        """
+        Args:
+            ttl: Seconds an unpinned task may stay idle, defaults to TRANSFER_TTL_SECONDS
+            quota_bytes: Bytes all transfers may take together, 0 for no limit. Defaults to
+                TRANSFER_QUOTA_MB
+        """
+        transfer_config = config.get_transfer_config()
+        self.ttl = ttl if ttl is not None else transfer_config['ttl_seconds']
+        self.quota_bytes = quota_bytes if quota_bytes is not None else transfer_config['quota_mb'] * 1024 * 1024
+
+        self._tasks: Dict[str, TaskTransfers] = {}
+        self._task_of_file: Dict[str, str] = {}
+        self._size = 0
+        self._evicted: "OrderedDict[str, str]" = OrderedDict()  # task id -> reason, oldest first
+
+        self.evicted_tasks = 0
+        self.evicted_bytes = 0
+        self.quota_evictions = 0
+        self.rejected_transfers = 0
+        self.rejected_chunks = 0
+
+    def _task(self, task_id: str) -> TaskTransfers:
+        now = time.monotonic()
+        task = self._tasks.get(task_id)
+        if task is None:
+            task = self._tasks[task_id] = TaskTransfers(now)
+        task.last_activity = now
+        return task
+
+    def mailbox(self, task_id: str) -> asyncio.Queue:
+        """
+        Return the mailbox of a task, creating the task if needed. The mailbox of an evicted task
+        only holds the error it was evicted with.
+        """
+        if task_id in self._evicted:
+            mailbox = asyncio.Queue()
+            mailbox.put_nowait(self._eviction_error(task_id, self._evicted[task_id]))
+            return mailbox
+        return self._task(task_id).mailbox
+
+    def has_task(self, task_id: str) -> bool:
+        return task_id in self._tasks
+
+    def receive_chunk(self, task_id: str, data) -> TransferBuffer:
+        """
+        Write a chunk message into the transfer of its file.
+
+        Raises:
+            TransferQuotaExceeded: If a new transfer doesn't fit in the quota, even after
+                evicting idle tasks. The task is evicted
+            TransferRejected: If the task was evicted, or the chunk is not the first of a file
+                the task doesn't have yet
+        """
+        file_id = data["file_id"]
+        if task_id in self._evicted:
+            self.rejected_chunks += 1
+            raise TransferRejected(f"Task {task_id} was evicted: {self._evicted[task_id]}")
+
+        task = self._tasks.get(task_id)
+        if (task is None or file_id not in task.files) and data.get("offset", 0) != 0:
+            self.rejected_chunks += 1
+            raise TransferRejected(f"Chunk at offset {data['offset']} of file {file_id}, whose transfer never started.")
+
+        task = self._task(task_id)
+
+        if file_id not in task.files:
+            self._make_room(task_id, data.get("total_size") or 0)
+            self._task_of_file[file_id] = task_id
+
+        previous_footprint = transfer_footprint(task.files.get(file_id))
+        try:
+            return receive_chunk(task.files, data)
+        finally:
+            # Announced sizes are reserved up front, unknown sizes grow with every chunk
+            self._size += transfer_footprint(task.files.get(file_id)) - previous_footprint
+
+    def file(self, file_id: str) -> Optional[TransferBuffer]:
+        """Return the transfer of a fully received file, None if it is missing or incomplete."""
+        task = self._tasks.get(self._task_of_file.get(file_id))
+        if task is None or file_id not in task.files:
+            return None
+        transfer = task.files[file_id]
+        return transfer if transfer.complete else None
+
+    def pin(self, task_id: str) -> None:
+        """Keep a task whose job is about to run out of TTL and quota eviction."""
+        if task_id in self._tasks:
+            self._tasks[task_id].pinned = True
+
+    def discard_task(self, task_id: str) -> None:
+        """Release the files and the mailbox of a finished task."""
+        task = self._tasks.pop(task_id, None)
+        if task is not None:
+            self._release(task)
+
+    def evict_expired(self) -> int:
+        """Evict the unpinned tasks idle for longer than the TTL, returns how many were evicted."""
+        if self.ttl <= 0:
+            return 0
+
+        now = time.monotonic()
+        expired = [task_id for task_id, task in self._tasks.items()
+                   if not task.pinned and now - task.last_activity > self.ttl]
+        for task_id in expired:
+            self._evict(task_id, f"No data received for {self.ttl:.0f} seconds, transfer expired.")
+        return len(expired)
+
+    def evict_unpinned(self, reason: str) -> int:
+        """Evict every task still receiving files, used when the relay connection drops."""
+        unpinned = [task_id for task_id, task in self._tasks.items() if not task.pinned]
+        for task_id in unpinned:
+            self._evict(task_id, reason)
+        return len(unpinned)
+
+    def stats(self) -> Dict[str, int]:
+        """Current size and eviction counters of the store."""
+        return {
+            "tasks": len(self._tasks),
+            "files": len(self._task_of_file),
+            "bytes": self._size,
+            "quota_bytes": self.quota_bytes,
+            "evicted_tasks": self.evicted_tasks,
+            "evicted_bytes": self.evicted_bytes,
+            "quota_evictions": self.quota_evictions,
+            "rejected_transfers": self.rejected_transfers,
+            "rejected_chunks": self.rejected_chunks
+        }
+
+    def _make_room(self, task_id: str, size: int) -> None:
+        if self.quota_bytes <= 0 or self._size + size <= self.quota_bytes:
+            return
+
+        # Least recently active tasks go first, pinned tasks and the one receiving are kept
+        candidates = sorted(
+            (task for task in self._tasks.items() if not task[1].pinned and task[0] != task_id),
+            key=lambda task: task[1].last_activity
+        )
+        for candidate_id, _ in candidates:
+            if self._size + size <= self.quota_bytes:
+                break
+            self._evict(candidate_id, "Transfer evicted to make room for newer uploads.")
+            self.quota_evictions += 1
+
+        if self._size + size > self.quota_bytes:
+            self.rejected_transfers += 1
+            message = f"Transfer of {size} bytes does not fit in the {self.quota_bytes} bytes transfer quota."
+            self._evict(task_id, message)
+            raise TransferQuotaExceeded(message)
+
+    def _evict(self, task_id: str, reason: str) -> None:
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return
+
+        size = task.size
+        self.evicted_tasks += 1
+        self.evicted_bytes += size
+        Utils.log_info(f"Evicting transfers of task {task_id} ({size} bytes): {reason}")
+
+        self._evicted[task_id] = reason
+        while len(self._evicted) > EVICTED_TASKS_REMEMBERED:
+            self._evicted.popitem(last=False)
+
+        self._release(task)
+        task.mailbox.put_nowait(self._eviction_error(task_id, reason))
+
+    @staticmethod
+    def _eviction_error(task_id: str, reason: str) -> Dict:
+        return {"status": WebsocketMessageStatus.ERROR, "data": {"task_id": task_id, "error": reason}}
+
+    def _release(self, task: TaskTransfers) -> None:
+        self._size -= task.size
+        for file_id, transfer in task.files.items():
+            self._task_of_file.pop(file_id, None)
+            transfer.close()
+        task.files.clear()
@@ -0,0 +1,145 @@
+import struct
+from base64 import b64decode
+from typing import Dict, NamedTuple, Optional, Tuple
+from config_loader import config
+from transfer_buffer import TransferBuffer
+from websocket_types import WebsocketMessageStatus
+
+INTERNAL_SUBPROTOCOL_PREFIX = "processing-computer-internal-"
+
+# File transfer protocols between relay and internal clients:
+# 1 - base64 chunks in JSON text frames
+# 2 - binary chunk frames, see encode_chunk
+# 3 - jobs carry file_hashes and the client answers with the files it still needs, see
+#     ContentStore
+# 4 - the client asks for jobs with REQUEST_JOB when it has free compute slots, see PendingJobs
+# 5 - read to images jobs may carry a first_page and last_page range, see job_sharding
+TRANSFER_PROTOCOL_VERSION = 5
+
+# Frame header: format version, flags, task id length, file id length, offset of the payload in
+# the file, total size of the file
+CHUNK_HEADER = struct.Struct("!BBHHQQ")
+CHUNK_FRAME_VERSION = 2
+CHUNK_FLAG_FINAL = 1
+
+
+class BinaryChunk(NamedTuple):
+    task_id: str
+    file_id: str
+    offset: int
+    total_size: int
+    final: bool
+    payload: memoryview
+
+
+def internal_subprotocol(version: str, client_id: str) -> str:
+    """Subprotocol an internal client connects with, announcing the transfer protocol it speaks."""
+    return f"{INTERNAL_SUBPROTOCOL_PREFIX}{version}-{client_id}-t{TRANSFER_PROTOCOL_VERSION}"
+
+
+def parse_internal_subprotocol(subprotocol: str) -> Tuple[Optional[str], Optional[str], int]:
+    """
+    Parse processing-computer-internal-<version>-<id>[-t<transfer version>].
+
+    Returns:
+        Tuple of (version, client id, transfer protocol version). Version and id are None when
+        missing, clients that don't announce a transfer protocol speak version 1
+    """
+    parts = subprotocol[len(INTERNAL_SUBPROTOCOL_PREFIX):].split("-")
+    if len(parts) < 2:
+        return None, parts[-1] or None, 1
+
+    transfer_version = 1
+    if len(parts) > 2 and parts[2].startswith("t") and parts[2][1:].isdigit():
+        transfer_version = int(parts[2][1:])
+
+    return parts[0], parts[1], transfer_version
+
+
+def get_chunk_size() -> int:
+    return max(1, config.get_transfer_config()['chunk_size_kb']) * 1024
+
+
+def encode_chunk(task_id: str, file_id: str, offset: int, total_size: int, payload, final: bool) -> bytes:
+    """Build a binary chunk frame, the payload is copied once into the frame."""
+    task_id = task_id.encode("utf-8")
+    file_id = file_id.encode("utf-8")
+    header = CHUNK_HEADER.pack(CHUNK_FRAME_VERSION, CHUNK_FLAG_FINAL if final else 0, len(task_id), len(file_id),
+                               offset, total_size)
+    return b"".join((header, task_id, file_id, payload))
+
+
+def decode_chunk(frame) -> BinaryChunk:
+    """
+    Read a binary chunk frame, the payload is a view of the frame.
+
+    Raises:
+        ValueError: If the frame is truncated or has an unknown format version
+    """
+    frame = memoryview(frame)
+    if len(frame) < CHUNK_HEADER.size:
+        raise ValueError("Chunk frame is shorter than its header.")
+
+    version, flags, task_id_length, file_id_length, offset, total_size = CHUNK_HEADER.unpack_from(frame)
+    if version != CHUNK_FRAME_VERSION:
+        raise ValueError(f"Unknown chunk frame version {version}.")
+
+    start = CHUNK_HEADER.size
+    if len(frame) < start + task_id_length + file_id_length:
+        raise ValueError("Chunk frame is shorter than its ids.")
+
+    task_id = bytes(frame[start:start + task_id_length]).decode("utf-8")
+    start += task_id_length
+    file_id = bytes(frame[start:start + file_id_length]).decode("utf-8")
+    start += file_id_length
+
+    return BinaryChunk(task_id, file_id, offset, total_size, bool(flags & CHUNK_FLAG_FINAL), frame[start:])
+
+
+def chunk_message(chunk: BinaryChunk):
+    """Turn a binary chunk into the message the JSON chunk protocol delivers, with the raw payload."""
+    return {
+        "status": WebsocketMessageStatus.FINAL_CHUNK if chunk.final else WebsocketMessageStatus.SENDING_CHUNK,
+        "data": {
+            "task_id": chunk.task_id,
+            "file_id": chunk.file_id,
+            "offset": chunk.offset,
+            "total_size": chunk.total_size,
+            "chunk": chunk.payload
+        }
+    }
+
+
+def iter_chunks(file_data, chunk_size: int):
+    """Yield (offset, payload view, final) over file_data, an empty file is one empty final chunk."""
+    data = memoryview(file_data)
+    if len(data) == 0:
+        yield 0, data, True
+        return
+
+    for offset in range(0, len(data), chunk_size):
+        yield offset, data[offset:offset + chunk_size], offset + chunk_size >= len(data)
+
+
+def chunk_payload(data):
+    """Raw bytes of a chunk message, binary chunks carry them as is and JSON chunks as base64 text."""
+    chunk = data["chunk"]
+    return b64decode(chunk) if isinstance(chunk, str) else chunk
+
+
+def receive_chunk(transfers: Dict[str, TransferBuffer], data) -> TransferBuffer:
+    """
+    Write the payload of a chunk message into the transfer of its file, starting the transfer
+    on its first chunk. Binary chunks announce the file size, so the transfer is allocated once.
+
+    Raises:
+        ValueError: If a transfer would start at a chunk past the beginning of its file
+    """
+    transfer = transfers.get(data["file_id"])
+    if transfer is None:
+        if data.get("offset", 0) != 0:
+            raise ValueError(f"Chunk at offset {data['offset']} of file {data['file_id']}, whose transfer never started.")
+        transfer = transfers[data["file_id"]] = TransferBuffer(data.get("total_size"))
+
+    transfer.write(data.get("offset", transfer.received), chunk_payload(data))
+    return transfer
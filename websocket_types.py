@@ -21,6 +21,9 @@ class WebsocketMessageStatus:
     SENDING_CHUNK = "sendingChunk"
     FINAL_CHUNK = "finalChunk"
     INTERNAL_CLIENT_REPORT = "internalClientReport"
+    WORKER_LOAD = "workerLoad"
+    FILES_WANTED = "filesWanted"
+    REQUEST_JOB = "requestJob"
 
 class BoxRectangleType:
     TYPE_B = "Tipo B"
@@ -28,4 +31,8 @@ class BoxRectangleType:
     MATRICULA = "Matricula"
     OUTRO = "Outro"
     TEMP = "Temp"
-    EXEMPLO_CIRCULO = "Exemplo de Circulo"
\ No newline at end of file
+    EXEMPLO_CIRCULO = "Exemplo de Circulo"
+
+class HoughSearchMode:
+    GRID = "grid"
+    SUCCESSIVE_HALVING = "successiveHalving"
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from typing import Iterable, Optional
+from config_loader import config
+
+
+class WorkerAffinity:
+    """
+    Which internal client rendered which pages, remembered by the relay.
+
+    Pages returned by read to images jobs are recorded under their image id and the content
+    hash of their bytes. The worker that rendered a page keeps it at full resolution, see
+    PageCache, so find circles jobs on that page are best sent back to it. Workers keep their
+    id when they reconnect, so entries outlive a dropped connection. Only the most recent
+    max_entries keys are remembered.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        """
+        Args:
+            max_entries: Keys remembered, 0 disables affinity. Defaults to WORKER_AFFINITY_ENTRIES
+        """
+        self.max_entries = max_entries if max_entries is not None else config.get_routing_config()['affinity_entries']
+        self._client_of_key: "OrderedDict[str, str]" = OrderedDict()  # key -> client id, oldest first
+
+    def record(self, client_id: str, keys: Iterable[str]) -> None:
+        """Remember that client_id rendered the pages with these image ids or hashes."""
+        if self.max_entries <= 0:
+            return
+
+        for key in keys:
+            self._client_of_key[key] = client_id
+            self._client_of_key.move_to_end(key)
+
+        while len(self._client_of_key) > self.max_entries:
+            self._client_of_key.popitem(last=False)
+
+    def preferred_client(self, keys: Iterable[str]) -> Optional[str]:
+        """Client that rendered the most of the pages with these keys, None if none is known."""
+        votes = {}
+        for key in keys:
+            client_id = self._client_of_key.get(key)
+            if client_id is not None:
+                votes[client_id] = votes.get(client_id, 0) + 1
+
+        if len(votes) == 0:
+            return None
+        return max(votes, key=votes.get)
+
+    def __len__(self):
+        return len(self._client_of_key)
@@ -0,0 +1,99 @@
+import random
+from typing import Dict, List, Optional
+from config_loader import config
+
+# Policies the relay can pick internal clients with, see get_worker_policy
+WORKER_POLICIES = ("random", "least-outstanding", "ewma")
+
+
+class WorkerLatency:
+    """
+    Exponentially weighted moving average of the seconds a worker spends per page, per command.
+
+    Fed with the processing time internal clients report for every completed job, queueing on
+    the worker is not part of it, so it measures how fast the worker is, not how busy.
+    """
+
+    def __init__(self, alpha: Optional[float] = None):
+        """
+        Args:
+            alpha: Weight of the newest sample, defaults to WORKER_LATENCY_EWMA_ALPHA
+        """
+        self.alpha = alpha if alpha is not None else config.get_routing_config()['latency_ewma_alpha']
+        self.seconds_per_page: Dict[str, float] = {}  # command -> seconds
+        self.samples = 0
+
+    def record(self, command: str, seconds: float, pages: int = 1) -> None:
+        sample = seconds / max(1, pages)
+        previous = self.seconds_per_page.get(command)
+        self.seconds_per_page[command] = sample if previous is None else previous + self.alpha * (sample - previous)
+        self.samples += 1
+
+    def get(self, command: str) -> Optional[float]:
+        return self.seconds_per_page.get(command)
+
+
+def worker_capacity(client) -> int:
+    """Jobs a worker runs at the same time, as it last reported, 1 until it reports."""
+    return max(1, client.load.get("slots", 1))
+
+
+class RandomPolicy:
+    """Any connected worker, the relay's original behaviour."""
+
+    def choose(self, clients: List, command: str):
+        return random.choice(clients)
+
+
+class LeastOutstandingPolicy:
+    """
+    The worker with the fewest jobs in flight per compute slot.
+
+    Jobs in flight are counted by the relay as it sends and finishes them, so two jobs sent
+    back to back don't both land on the same idle worker. Ties are broken at random.
+    """
+
+    def scores(self, clients: List, command: str) -> List[float]:
+        return [(client.jobs + 1) / worker_capacity(client) for client in clients]
+
+    def choose(self, clients: List, command: str):
+        scores = self.scores(clients, command)
+        best = min(scores)
+        return random.choice([client for client, score in zip(clients, scores) if score == best])
+
+
+class EwmaLatencyPolicy(LeastOutstandingPolicy):
+    """
+    The worker expected to finish a new job first.
+
+    A worker's jobs in flight per compute slot are weighted by its average seconds per page
+    for the job's command, so a worker twice as fast gets about twice the jobs. Workers that
+    haven't completed a job of this command yet are assumed as fast as the average worker.
+    """
+
+    def scores(self, clients: List, command: str) -> List[float]:
+        latencies = [client.latency.get(command) for client in clients]
+        known = [latency for latency in latencies if latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+
+        return [
+            outstanding * (default_latency if latency is None else latency)
+            for outstanding, latency in zip(super().scores(clients, command), latencies)
+        ]
+
+
+def get_worker_policy(name: Optional[str] = None):
+    """
+    Policy the relay picks the internal client of a job with.
+
+    Raises:
+        ValueError: If the name, by default WORKER_SELECTION_POLICY, is not one of WORKER_POLICIES
+    """
+    name = (name or config.get_routing_config()['policy']).lower()
+    if name == "random":
+        return RandomPolicy()
+    if name == "least-outstanding":
+        return LeastOutstandingPolicy()
+    if name == "ewma":
+        return EwmaLatencyPolicy()
+    raise ValueError(f"Unknown worker selection policy {name}, expected one of {', '.join(WORKER_POLICIES)}.")